@@ -0,0 +1,87 @@
+import os
+import subprocess
+import sys
+import time
+import logging
+
+# 로깅 설정
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 진입점별 시작 시간 예산(ms): 모듈 최상위 코드 실행(import 포함)까지
+# IMS_cam 은 cv2/numpy 를 촬영 경로에서만 import 하므로 예산이 작음
+ENTRY_POINTS = {
+    'main': ('/usr/bin/ims/main.py', 150),
+    'uart': ('/usr/bin/ims/uart/IMS_uart.py', 400),
+    'cam': ('/usr/bin/ims/cam/IMS_cam.py', 150),
+}
+TOP_IMPORTS = 5  # 보고할 가장 무거운 최상위 import 수
+
+# __main__ 블록은 실행하지 않고 모듈 최상위 코드만 실행
+LOAD_SNIPPET = "import runpy, sys; sys.path.insert(0, sys.argv[2]); runpy.run_path(sys.argv[1], run_name='__importtime__')"
+
+
+def parse_importtime(stderr):
+    """-X importtime 출력에서 최상위 import 의 (모듈, 누적 us) 목록을 반환합니다."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        if name.startswith("  "):
+            continue  # 하위 import 는 상위의 누적 시간에 포함됨
+        imports.append((name.strip(), int(cumulative)))
+    return imports
+
+
+def measure(script, python=sys.executable):
+    """스크립트 최상위 코드를 새 인터프리터로 실행하여 (경과 ms, 최상위 import 목록, 오류)를 반환합니다."""
+    started = time.monotonic()
+    result = subprocess.run([python, "-X", "importtime", "-c", LOAD_SNIPPET, script, os.path.dirname(script)],
+                            capture_output=True, text=True)
+    elapsed_ms = (time.monotonic() - started) * 1000
+    error = None
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit {result.returncode}"
+    return elapsed_ms, parse_importtime(result.stderr), error
+
+
+def run_benchmark(entry_points=ENTRY_POINTS, repeat=3):
+    """
+    진입점마다 repeat 번 측정하여 가장 빠른 값을 예산과 비교합니다.
+    모든 진입점이 예산 안이면 True.
+    """
+    within_budget = True
+    for name, (script, budget_ms) in entry_points.items():
+        best = None
+        for _ in range(repeat):
+            elapsed_ms, imports, error = measure(script)
+            if error:
+                break
+            if best is None or elapsed_ms < best[0]:
+                best = (elapsed_ms, imports)
+        if error:
+            logger.error(f"{name}: failed to load {script}: {error}")
+            within_budget = False
+            continue
+        elapsed_ms, imports = best
+        import_ms = sum(cumulative for _, cumulative in imports) / 1000
+        status = "OK" if elapsed_ms <= budget_ms else "OVER BUDGET"
+        print(f"{name:>6}: {elapsed_ms:7.1f} ms total, {import_ms:7.1f} ms in imports "
+              f"(budget {budget_ms} ms) {status}")
+        for module, cumulative in sorted(imports, key=lambda item: item[1], reverse=True)[:TOP_IMPORTS]:
+            print(f"        {cumulative / 1000:7.1f} ms  {module}")
+        within_budget = within_budget and elapsed_ms <= budget_ms
+    return within_budget
+
+
+if __name__ == "__main__":
+    # IMS_importtime.py [이름=경로 ...]: 경로를 바꿔 측정 (예: 개발 PC 에서 cam=v010/cam/IMS_cam.py)
+    entry_points = dict(ENTRY_POINTS)
+    for arg in sys.argv[1:]:
+        name, _, path = arg.partition("=")
+        if name not in entry_points or not path:
+            print(f"Usage: {sys.argv[0]} [{'|'.join(ENTRY_POINTS)}=<path> ...]")
+            sys.exit(2)
+        entry_points[name] = (path, entry_points[name][1])
+    sys.exit(0 if run_benchmark(entry_points) else 1)
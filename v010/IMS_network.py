@@ -0,0 +1,198 @@
+import asyncio
+import socket
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# TCP 연결만 확인하는 프로브 대상 (HTTP 요청 없음). IP 는 DNS 없이 바로 연결
+PROBE_ENDPOINTS = [('8.8.8.8', 53), ('1.1.1.1', 53), ('www.google.com', 80)]
+PROBE_TIMEOUT = 2.0  # 연결 대기 시간(초)
+ONLINE_INTERVAL = 30.0  # 온라인일 때 프로브 주기(초)
+OFFLINE_INTERVAL = 3.0  # 오프라인일 때 프로브 주기(초)
+ONLINE_AFTER = 1  # 연속 성공 횟수 이상이면 온라인
+OFFLINE_AFTER = 3  # 연속 실패 횟수 이상이면 오프라인 (일시적인 끊김 무시)
+DNS_CACHE_TTL = 300  # 호스트 이름 조회 결과 캐시 시간(초)
+EVENT_DEBOUNCE = 0.5  # 링크/라우트 이벤트 후 프로브까지 대기(초)
+
+ROUTE_TABLE = '/proc/net/route'
+
+# netlink 라우트 이벤트 그룹 (linux/rtnetlink.h)
+NETLINK_ROUTE = 0
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+
+
+def has_default_route(route_table=ROUTE_TABLE):
+    """기본 경로(목적지 0.0.0.0)가 있는지 /proc/net/route 로 확인합니다. 확인할 수 없으면 True."""
+    try:
+        with open(route_table, 'r') as routes:
+            next(routes, None)  # 헤더
+            return any(line.split()[1:2] == ['00000000'] for line in routes)
+    except OSError:
+        return True
+
+
+def open_route_events():
+    """링크/주소/라우트 변경을 알려주는 netlink 소켓을 엽니다. 지원하지 않으면 None."""
+    if not hasattr(socket, 'AF_NETLINK'):
+        return None
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE))
+        sock.setblocking(False)
+        return sock
+    except OSError as e:
+        logger.warning(f"Netlink route events unavailable, polling only: {e}")
+        return None
+
+
+### 인터넷 연결 감시 ###
+class ConnectivityMonitor:
+    """
+    asyncio 이벤트 루프에서 인터넷 연결 상태를 감시합니다.
+    - 기본 경로가 없으면 프로브 없이 바로 실패로 처리
+    - 프로브는 여러 대상에 동시에 TCP 연결만 시도하고 하나라도 되면 성공 (호스트 이름은 DNS 캐시 사용)
+    - 연속 성공/실패 횟수로 온라인/오프라인 전환 (히스테리시스)
+    - netlink 링크/라우트 이벤트가 오면 주기를 기다리지 않고 바로 프로브
+    상태가 바뀌면 subscribe 한 콜백(online: bool)을 호출합니다. 콜백은 코루틴 함수여도 됩니다.
+    """
+
+    def __init__(self, endpoints=PROBE_ENDPOINTS, online_after=ONLINE_AFTER, offline_after=OFFLINE_AFTER):
+        self.endpoints = list(endpoints)
+        self.online_after = online_after
+        self.offline_after = offline_after
+        self.online = False
+        self.online_event = asyncio.Event()
+        self.subscribers = []
+        self.successes = 0
+        self.failures = 0
+        self.dns_cache = {}  # 호스트 -> (주소 목록, 조회 시각)
+        self.probe_now = asyncio.Event()
+        self.events = None
+        self.loop = None
+        self.counters = {"probes": 0, "failed_probes": 0, "route_events": 0, "transitions": 0}
+        self.last_change = None
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    async def wait_online(self):
+        await self.online_event.wait()
+
+    ### 프로브 ###
+    async def resolve(self, host, port):
+        """호스트 이름 조회 결과를 DNS_CACHE_TTL 동안 재사용합니다. IP 는 조회하지 않습니다."""
+        try:
+            socket.inet_aton(host)
+            return [host]
+        except OSError:
+            pass
+        cached = self.dns_cache.get(host)
+        if cached is not None and time.monotonic() - cached[1] < DNS_CACHE_TTL:
+            return cached[0]
+        infos = await asyncio.wait_for(
+            self.loop.getaddrinfo(host, port, family=socket.AF_INET, type=socket.SOCK_STREAM), PROBE_TIMEOUT)
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        self.dns_cache[host] = (addresses, time.monotonic())
+        return addresses
+
+    async def probe_endpoint(self, host, port):
+        addresses = await self.resolve(host, port)
+        for address in addresses:
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection(address, port), PROBE_TIMEOUT)
+            except (OSError, asyncio.TimeoutError):
+                continue
+            writer.close()
+            return True
+        # 캐시된 주소가 모두 실패하면 다음에는 다시 조회
+        self.dns_cache.pop(host, None)
+        return False
+
+    async def probe(self):
+        """대상 중 하나라도 TCP 연결되면 True."""
+        self.counters["probes"] += 1
+        if not has_default_route():
+            return False
+        pending = [self.loop.create_task(self.probe_endpoint(host, port)) for host, port in self.endpoints]
+        try:
+            for finished in asyncio.as_completed(pending):
+                try:
+                    if await finished:
+                        return True
+                except (OSError, asyncio.TimeoutError):
+                    continue
+            return False
+        finally:
+            for task in pending:
+                task.cancel()
+
+    ### 상태 전환 ###
+    async def update(self, ok):
+        if ok:
+            self.successes += 1
+            self.failures = 0
+        else:
+            self.counters["failed_probes"] += 1
+            self.failures += 1
+            self.successes = 0
+        if not self.online and self.successes >= self.online_after:
+            await self.set_online(True)
+        elif self.online and self.failures >= self.offline_after:
+            await self.set_online(False)
+
+    async def set_online(self, online):
+        self.online = online
+        self.counters["transitions"] += 1
+        previous, self.last_change = self.last_change, time.monotonic()
+        duration = f" after {self.last_change - previous:.0f}s" if previous is not None else ""
+        logger.info(f"Internet connection {'established' if online else 'lost'}{duration}.")
+        if online:
+            self.online_event.set()
+        else:
+            self.online_event.clear()
+        for callback in self.subscribers:
+            try:
+                result = callback(online)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Connectivity subscriber failed: {e}")
+
+    def on_route_event(self):
+        try:
+            while self.events.recv(65536):
+                pass
+        except BlockingIOError:
+            pass
+        except OSError as e:
+            logger.error(f"Netlink read failed: {e}")
+        self.counters["route_events"] += 1
+        self.probe_now.set()
+
+    ### 실행 ###
+    async def run(self):
+        """취소될 때까지 상태를 감시합니다."""
+        self.loop = asyncio.get_running_loop()
+        self.events = open_route_events()
+        if self.events is not None:
+            self.loop.add_reader(self.events.fileno(), self.on_route_event)
+        try:
+            while True:
+                await self.update(await self.probe())
+                self.probe_now.clear()
+                # 판단이 바뀌는 중(히스테리시스)이거나 오프라인이면 빨리 다시 확인
+                settling = self.failures if self.online else self.successes
+                interval = OFFLINE_INTERVAL if settling or not self.online else ONLINE_INTERVAL
+                try:
+                    await asyncio.wait_for(self.probe_now.wait(), interval)
+                    await asyncio.sleep(EVENT_DEBOUNCE)  # 이벤트가 몰려 오므로 잠시 모음
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if self.events is not None:
+                self.loop.remove_reader(self.events.fileno())
+                self.events.close()
+            logger.info(f"Connectivity monitor stats: {self.counters}")
@@ -0,0 +1,293 @@
+import asyncio
+import collections
+import json
+import os
+import shutil
+import struct
+import time
+import zlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+KIND_TELEMETRY = 1  # to_server JSON 스냅샷
+KIND_IMAGE = 2  # 촬영 이미지 (본문은 images/ 안의 파일 이름)
+KIND_NAMES = {KIND_TELEMETRY: "telemetry", KIND_IMAGE: "image"}
+
+# 레코드 헤더: 본문 길이, 순번, 기록 시각(time.time()), 종류, 본문 crc32
+RECORD_HEADER = struct.Struct('<IQdBI')
+SEGMENT_PREFIX = 'segment_'
+SEGMENT_SUFFIX = '.log'
+CURSOR_FILE = 'cursor'
+IMAGE_DIR = 'images'
+
+
+def write_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Record:
+    __slots__ = ('seq', 'timestamp', 'kind', 'segment', 'offset', 'size', 'extra_bytes')
+
+    def __init__(self, seq, timestamp, kind, segment, offset, size, extra_bytes=0):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.kind = kind
+        self.segment = segment  # 세그먼트 첫 순번
+        self.offset = offset  # 본문 위치
+        self.size = size
+        self.extra_bytes = extra_bytes  # 이미지 파일 크기
+
+
+### 저장 후 전달 큐 ###
+class OutboundQueue:
+    """
+    오프라인 동안 서버로 보낼 텔레메트리 스냅샷과 이미지를 순서대로 보관하는 디스크 큐.
+    - 레코드는 세그먼트 파일에 추가하고, 이미지는 images/ 로 옮겨 파일 이름만 기록
+    - 전달이 확인된 순번은 cursor 파일에 기록, 모두 확인된 세그먼트와 이미지는 삭제
+    - max_bytes(세그먼트 + 이미지) 를 넘거나 max_age 초보다 오래된 레코드는 오래된 것부터 버림
+    - 다시 열면 cursor 이후 레코드를 복구 (끝이 잘린 레코드는 잘라냄)
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, max_age=7 * 24 * 3600, segment_bytes=1024 * 1024):
+        self.directory = directory
+        self.image_dir = os.path.join(directory, IMAGE_DIR)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.segment_bytes = segment_bytes
+        self.records = collections.deque()
+        self.segments = {}  # 세그먼트 첫 순번 -> 남은 레코드 수
+        self.acked = 0  # 전달 확인된(또는 버려진) 마지막 순번
+        self.next_seq = 1
+        self.live_bytes = 0
+        self.segment_file = None
+        self.segment_start = None
+        self.counters = {"enqueued": 0, "acked": 0, "evicted_size": 0, "evicted_age": 0, "truncated": 0}
+        self.open()
+
+    def _segment_path(self, start):
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{start:012d}{SEGMENT_SUFFIX}")
+
+    ### 열기/복구 ###
+    def open(self):
+        os.makedirs(self.image_dir, exist_ok=True)
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE), 'r') as f:
+                self.acked = int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            self.acked = 0
+        starts = sorted(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+                        if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+        self.next_seq = self.acked + 1
+        for start in starts:
+            self._load_segment(start)
+        if self.records:
+            logger.info(f"Outbound queue recovered {len(self.records)} record(s), {self.live_bytes} bytes")
+
+    def _load_segment(self, start):
+        path = self._segment_path(start)
+        remaining = 0
+        with open(path, 'rb+') as f:
+            data = f.read()
+            position = 0
+            while position + RECORD_HEADER.size <= len(data):
+                size, seq, timestamp, kind, crc = RECORD_HEADER.unpack_from(data, position)
+                body = data[position + RECORD_HEADER.size:position + RECORD_HEADER.size + size]
+                if len(body) != size or zlib.crc32(body) != crc:
+                    break
+                if seq > self.acked:
+                    extra = 0
+                    if kind == KIND_IMAGE:
+                        try:
+                            extra = os.path.getsize(os.path.join(self.image_dir, body.decode()))
+                        except OSError:
+                            extra = 0
+                    self.records.append(Record(seq, timestamp, kind, start, position + RECORD_HEADER.size, size, extra))
+                    self.live_bytes += RECORD_HEADER.size + size + extra
+                    remaining += 1
+                self.next_seq = max(self.next_seq, seq + 1)
+                position += RECORD_HEADER.size + size
+            if position < len(data):
+                logger.warning(f"Truncating {len(data) - position} torn byte(s) from {path}")
+                self.counters["truncated"] += 1
+                f.truncate(position)
+        if remaining:
+            self.segments[start] = remaining
+        else:
+            os.remove(path)
+
+    ### 추가 ###
+    def _append(self, kind, body, extra_bytes=0, timestamp=None):
+        if self.segment_file is None or self.segment_file.tell() >= self.segment_bytes:
+            if self.segment_file is not None:
+                self.segment_file.close()
+                if self.segments.get(self.segment_start) == 0:  # 이미 모두 전달됨
+                    del self.segments[self.segment_start]
+                    os.remove(self._segment_path(self.segment_start))
+            self.segment_start = self.next_seq
+            self.segment_file = open(self._segment_path(self.segment_start), 'ab')
+            self.segments.setdefault(self.segment_start, 0)
+        seq = self.next_seq
+        self.next_seq += 1
+        timestamp = time.time() if timestamp is None else timestamp
+        offset = self.segment_file.tell() + RECORD_HEADER.size
+        self.segment_file.write(RECORD_HEADER.pack(len(body), seq, timestamp, kind, zlib.crc32(body)) + body)
+        self.segment_file.flush()
+        os.fsync(self.segment_file.fileno())
+        self.records.append(Record(seq, timestamp, kind, self.segment_start, offset, len(body), extra_bytes))
+        self.segments[self.segment_start] += 1
+        self.live_bytes += RECORD_HEADER.size + len(body) + extra_bytes
+        self.counters["enqueued"] += 1
+        self.evict()
+        return seq
+
+    def put_telemetry(self, file_name, data, timestamp=None):
+        """to_server 파일 하나의 스냅샷을 추가합니다."""
+        body = json.dumps({"file": file_name, "data": data}, separators=(',', ':')).encode()
+        return self._append(KIND_TELEMETRY, body, timestamp=timestamp)
+
+    def put_image(self, path):
+        """이미지 파일을 큐 디렉토리로 옮기고 추가합니다."""
+        name = f"{self.next_seq:012d}_{os.path.basename(path)}"
+        target = os.path.join(self.image_dir, name)
+        shutil.move(path, target)
+        return self._append(KIND_IMAGE, name.encode(), os.path.getsize(target), os.path.getmtime(target))
+
+    ### 읽기/확인 ###
+    def read(self, record):
+        """레코드 본문을 반환합니다: 텔레메트리는 dict, 이미지는 큐 안의 파일 경로."""
+        with open(self._segment_path(record.segment), 'rb') as f:
+            f.seek(record.offset)
+            body = f.read(record.size)
+        if record.kind == KIND_IMAGE:
+            return os.path.join(self.image_dir, body.decode())
+        return json.loads(body)
+
+    def peek_batch(self, limit):
+        """가장 오래된 레코드부터 같은 종류가 이어지는 만큼(최대 limit 개) 반환합니다."""
+        batch = []
+        for record in self.records:
+            if len(batch) >= limit or (batch and record.kind != batch[0].kind):
+                break
+            batch.append(record)
+        return batch
+
+    def _drop_head(self):
+        record = self.records.popleft()
+        self.acked = record.seq
+        self.live_bytes -= RECORD_HEADER.size + record.size + record.extra_bytes
+        if record.kind == KIND_IMAGE:
+            try:
+                os.remove(self.read(record))
+            except OSError:
+                pass
+        self.segments[record.segment] -= 1
+        if self.segments[record.segment] == 0 and record.segment != self.segment_start:
+            del self.segments[record.segment]
+            os.remove(self._segment_path(record.segment))
+        return record
+
+    def _save_cursor(self):
+        write_atomic(os.path.join(self.directory, CURSOR_FILE), str(self.acked).encode())
+
+    def ack(self, seq):
+        """seq 까지 전달되었음을 기록합니다."""
+        count = 0
+        while self.records and self.records[0].seq <= seq:
+            self._drop_head()
+            count += 1
+        if count:
+            self.counters["acked"] += count
+            self._save_cursor()
+
+    def evict(self, now=None):
+        """크기/기간 한도를 넘는 오래된 레코드를 버립니다."""
+        now = time.time() if now is None else now
+        evicted = 0
+        while self.records and (self.live_bytes > self.max_bytes or now - self.records[0].timestamp > self.max_age):
+            reason = "evicted_size" if self.live_bytes > self.max_bytes else "evicted_age"
+            record = self._drop_head()
+            self.counters[reason] += 1
+            evicted += 1
+            logger.warning(f"Outbound queue full, dropped {KIND_NAMES[record.kind]} record {record.seq} ({reason})")
+        if evicted:
+            self._save_cursor()
+
+    def stats(self):
+        depth = collections.Counter(KIND_NAMES[record.kind] for record in self.records)
+        return {
+            "depth": len(self.records),
+            "depth_by_kind": dict(depth),
+            "bytes": self.live_bytes,
+            "oldest_age": round(time.time() - self.records[0].timestamp, 1) if self.records else None,
+            "segments": len(self.segments),
+            **self.counters,
+        }
+
+    def close(self):
+        if self.segment_file is not None:
+            self.segment_file.close()
+            self.segment_file = None
+
+
+### 전달 ###
+class QueueDrainer:
+    """
+    큐를 가장 오래된 레코드부터 묶음 단위로 전달합니다.
+    senders[종류] 는 (레코드, 본문) 목록을 받아 성공 여부를 돌려주는 코루틴 함수입니다.
+    - rate(레코드/초)를 넘지 않도록 묶음 사이에 대기
+    - 실패하면 retry_delay 부터 두 배씩 max_retry_delay 까지 대기 후 같은 묶음을 재시도
+    """
+
+    def __init__(self, queue, senders, batch_size=20, rate=10.0, retry_delay=5.0, max_retry_delay=300.0):
+        self.queue = queue
+        self.senders = senders
+        self.batch_size = batch_size
+        self.rate = rate
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.sent_records = 0
+        self.sent_bytes = 0
+        self.busy_seconds = 0.0
+
+    async def drain(self, should_continue=lambda: True):
+        """큐가 빌 때까지(또는 should_continue() 가 거짓이 될 때까지) 전달합니다."""
+        delay = self.retry_delay
+        while self.queue.records and should_continue():
+            batch = self.queue.peek_batch(self.batch_size)
+            sender = self.senders[batch[0].kind]
+            started = time.monotonic()
+            try:
+                ok = await sender([(record, self.queue.read(record)) for record in batch])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to send {KIND_NAMES[batch[0].kind]} batch: {e}")
+                ok = False
+            elapsed = time.monotonic() - started
+            if not ok:
+                logger.warning(f"Outbound batch of {len(batch)} not delivered, retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+                continue
+            delay = self.retry_delay
+            self.queue.ack(batch[-1].seq)
+            self.sent_records += len(batch)
+            self.sent_bytes += sum(record.size + record.extra_bytes for record in batch)
+            self.busy_seconds += elapsed
+            # 속도 제한: 묶음 크기 / rate 만큼의 시간이 지나도록 대기
+            await asyncio.sleep(max(0.0, len(batch) / self.rate - elapsed))
+
+    def stats(self):
+        seconds = self.busy_seconds or None
+        return {
+            "sent_records": self.sent_records,
+            "sent_bytes": self.sent_bytes,
+            "records_per_s": round(self.sent_records / seconds, 2) if seconds else 0.0,
+            "bytes_per_s": round(self.sent_bytes / seconds, 1) if seconds else 0.0,
+        }
@@ -0,0 +1,286 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import multiprocessing.forkserver
+import os
+import runpy
+import signal
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+SUPERVISOR_SOCKET_PATH = '/tmp/ims_supervisor.sock'  # 작업 실행 요청 소켓
+PRELOAD_MODULES = ['numpy', 'cv2', 'boto3']  # fork 전에 한 번만 import (없는 모듈은 무시)
+
+RESTART_POLICIES = ('always', 'on-failure', 'never')
+STOP_TIMEOUT = 5  # terminate 후 kill 까지 대기(초)
+
+
+def run_script(script, args):
+    """fork 된 작업 프로세스에서 스크립트를 __main__ 으로 실행합니다. sys.exit 코드가 종료 코드가 됩니다."""
+    sys.argv = [script, *args]
+    sys.path.insert(0, os.path.dirname(script))
+    runpy.run_path(script, run_name="__main__")
+
+
+async def stop_process(process, timeout=STOP_TIMEOUT):
+    """asyncio 하위 프로세스를 종료하고 기다립니다. 응답이 없으면 kill."""
+    if process.returncode is not None:
+        return process.returncode
+    process.terminate()
+    try:
+        return await asyncio.wait_for(process.wait(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        return await process.wait()
+
+
+def unix_socket_check(socket_path, timeout=2):
+    """Unix 소켓에 연결되면 정상으로 보는 헬스 체크를 만듭니다."""
+    async def check():
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_unix_connection(socket_path), timeout)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        writer.close()
+        return True
+    return check
+
+
+### 사전 fork 작업 풀 ###
+class WorkerPool:
+    """
+    무거운 모듈(cv2/numpy/boto3)을 미리 import 한 forkserver 에서 작업 프로세스를 fork 합니다.
+    작업마다 인터프리터 시작과 import 비용을 치르지 않아 실행이 수 ms 안에 시작됩니다.
+    """
+
+    def __init__(self, preload=PRELOAD_MODULES, max_workers=2):
+        self.context = multiprocessing.get_context('forkserver')
+        # '__main__' 도 미리 import 하여 작업 프로세스가 main 모듈을 다시 import 하지 않게 함
+        self.context.set_forkserver_preload(['__main__', *preload])
+        self.max_workers = max_workers
+        self.slots = None
+        self.counters = {"started": 0, "failed": 0, "timeouts": 0}
+
+    def warm_up(self):
+        """forkserver 를 미리 띄워 첫 작업에서 import 비용이 생기지 않게 합니다."""
+        started = time.monotonic()
+        multiprocessing.forkserver.ensure_running()
+        logger.info(f"Worker forkserver ready in {time.monotonic() - started:.2f}s")
+
+    async def run(self, script, args=(), timeout=None):
+        """스크립트를 fork 된 작업 프로세스에서 실행하고 종료 코드를 반환합니다."""
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.max_workers)
+        loop = asyncio.get_running_loop()
+        async with self.slots:
+            process = self.context.Process(target=run_script, args=(script, list(args)), name=os.path.basename(script))
+            started = time.monotonic()
+            process.start()
+            self.counters["started"] += 1
+            logger.info(f"Forked worker {process.pid} for {script} in {(time.monotonic() - started) * 1000:.1f} ms")
+            exited = loop.create_future()
+            loop.add_reader(process.sentinel, lambda: exited.done() or exited.set_result(None))
+            try:
+                await asyncio.wait_for(exited, timeout)
+            except asyncio.TimeoutError:
+                self.counters["timeouts"] += 1
+                logger.error(f"Worker {process.pid} for {script} timed out after {timeout}s, terminating")
+                process.terminate()
+            except asyncio.CancelledError:
+                process.terminate()
+                raise
+            finally:
+                loop.remove_reader(process.sentinel)
+                await loop.run_in_executor(None, process.join)
+            if process.exitcode != 0:
+                self.counters["failed"] += 1
+            logger.info(f"Worker {process.pid} for {script} exited with {process.exitcode} "
+                        f"after {time.monotonic() - started:.2f}s")
+            return process.exitcode
+
+
+### 서비스 ###
+class Service:
+    """
+    상주 프로세스 하나의 실행 설정.
+    - restart: 'always'(항상 재시작) / 'on-failure'(0 이 아닌 종료만) / 'never'
+    - 연속 실패 시 backoff 부터 두 배씩 max_backoff 까지 대기, stable_after 초 이상 실행되면 초기화
+    - health_check(비동기 함수)가 health_failures 번 연속 실패하면 프로세스를 재시작
+    """
+
+    def __init__(self, name, argv, restart='always', backoff=1.0, max_backoff=60.0, stable_after=60.0,
+                 health_check=None, health_interval=30.0, health_failures=3):
+        if restart not in RESTART_POLICIES:
+            raise ValueError(f"Unknown restart policy: {restart}")
+        self.name = name
+        self.argv = list(argv)
+        self.restart = restart
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after
+        self.health_check = health_check
+        self.health_interval = health_interval
+        self.health_failures = health_failures
+        self.process = None
+        self.task = None  # 감시 태스크
+        self.starts = 0
+        self.failures = 0  # 연속 실패 횟수
+        self.last_exit = None
+
+    def stats(self):
+        return {"pid": self.process.pid if self.process and self.process.returncode is None else None,
+                "starts": self.starts, "failures": self.failures, "last_exit": self.last_exit}
+
+
+### 감독 프로세스 ###
+class Supervisor:
+    """
+    하나의 asyncio 루프에서 상주 서비스를 실행/감시/재시작하고,
+    등록된 단발 작업(촬영, 업로드, 프로비저닝)을 WorkerPool 로 실행합니다.
+    작업은 SUPERVISOR_SOCKET_PATH 로도 요청할 수 있습니다: {"task": 이름, "args": [...]} 한 줄 → {"returncode": n} 한 줄.
+    """
+
+    def __init__(self, pool=None, socket_path=SUPERVISOR_SOCKET_PATH):
+        self.pool = pool or WorkerPool()
+        self.socket_path = socket_path
+        self.services = {}
+        self.task_scripts = {}  # 작업 이름 -> (스크립트, 제한 시간)
+        self.tasks = set()
+        self.loop = None
+        self.stop_event = None
+        self.server = None
+
+    def register_task(self, name, script, timeout=None):
+        self.task_scripts[name] = (script, timeout)
+
+    def spawn(self, coro):
+        task = self.loop.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def add(self, service):
+        """서비스를 시작하고 감시합니다."""
+        self.services[service.name] = service
+        service.task = self.spawn(self._supervise(service))
+
+    async def remove(self, name):
+        """서비스를 멈추고 감시를 끝냅니다. 없으면 아무것도 하지 않습니다."""
+        service = self.services.pop(name, None)
+        if service is None:
+            return
+        service.task.cancel()
+        await asyncio.gather(service.task, return_exceptions=True)
+        logger.info(f"Service {name} stopped: {service.stats()}")
+
+    async def run_task(self, name, args=()):
+        script, timeout = self.task_scripts[name]
+        return await self.pool.run(script, args, timeout)
+
+    ### 서비스 감시 ###
+    async def _supervise(self, service):
+        while True:
+            started = time.monotonic()
+            try:
+                process = await asyncio.create_subprocess_exec(*service.argv)
+            except OSError as e:
+                logger.error(f"Failed to start {service.name}: {e}")
+                returncode = None
+            else:
+                service.process = process
+                service.starts += 1
+                logger.info(f"Service {service.name} started (pid {process.pid}, start #{service.starts})")
+                health = self.spawn(self._watch_health(service, process)) if service.health_check else None
+                try:
+                    returncode = await process.wait()
+                except asyncio.CancelledError:
+                    await stop_process(process)
+                    raise
+                finally:
+                    if health is not None:
+                        health.cancel()
+                service.last_exit = returncode
+                logger.info(f"Service {service.name} exited with {returncode}")
+            if service.restart == 'never' or (service.restart == 'on-failure' and returncode == 0):
+                return
+            if time.monotonic() - started >= service.stable_after:
+                service.failures = 0
+            service.failures += 1
+            delay = min(service.backoff * 2 ** (service.failures - 1), service.max_backoff)
+            logger.warning(f"Restarting {service.name} in {delay:.1f}s (failure #{service.failures})")
+            await asyncio.sleep(delay)
+
+    async def _watch_health(self, service, process):
+        failed = 0
+        while process.returncode is None:
+            await asyncio.sleep(service.health_interval)
+            try:
+                healthy = await service.health_check()
+            except Exception as e:
+                logger.error(f"Health check for {service.name} raised: {e}")
+                healthy = False
+            failed = 0 if healthy else failed + 1
+            if failed >= service.health_failures:
+                logger.error(f"Service {service.name} failed {failed} health checks, restarting")
+                await stop_process(process)
+                return
+
+    ### 작업 요청 소켓 ###
+    async def handle_client(self, reader, writer):
+        # 어떤 경우에도 응답 한 줄({"returncode"} 또는 {"error"})을 보낸 뒤 연결을 닫음
+        try:
+            request = json.loads(await reader.readline() or b'{}')
+            name = request.get("task")
+            if name not in self.task_scripts:
+                response = {"error": f"unknown task: {name}"}
+            else:
+                started = time.monotonic()
+                returncode = await self.run_task(name, [str(arg) for arg in request.get("args", [])])
+                response = {"returncode": returncode, "elapsed": time.monotonic() - started}
+        except (ValueError, AttributeError) as e:
+            response = {"error": f"bad request: {e}"}
+        except Exception as e:
+            logger.exception(f"Supervisor task request failed: {e}")
+            response = {"error": f"task failed: {e}"}
+        try:
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+        except OSError as e:
+            logger.error(f"Supervisor client error: {e}")
+        finally:
+            writer.close()
+
+    ### 실행 ###
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(signum, self.stop_event.set)
+        await self.loop.run_in_executor(None, self.pool.warm_up)
+        if self.socket_path:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self.server = await asyncio.start_unix_server(self.handle_client, path=self.socket_path)
+            logger.info(f"Supervisor listening on {self.socket_path}")
+
+    async def wait(self):
+        """종료 신호를 받을 때까지 기다린 뒤 모든 서비스를 정리합니다."""
+        try:
+            await self.stop_event.wait()
+            logger.info("Stopping supervisor...")
+        finally:
+            if self.server is not None:
+                self.server.close()
+                await self.server.wait_closed()
+                if os.path.exists(self.socket_path):
+                    os.remove(self.socket_path)
+            tasks = list(self.tasks)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for name, service in self.services.items():
+                logger.info(f"Service {name}: {service.stats()}")
+            logger.info(f"Worker pool: {self.pool.counters}")
@@ -0,0 +1,321 @@
+import sys
+import time
+import base64
+import hashlib
+import logging
+import os
+import json
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+# 로깅 설정
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 경로 설정
+UPLOAD_DIR = "/usr/bin/ims/aws/toS3"  # 업로드할 이미지 디렉토리 (IMS_cam.py 출력)
+UPLOAD_STATE_DIR = "/usr/bin/ims/aws/upload_state"  # 멀티파트 업로드 재개 정보
+UPLOAD_SOCKET_PATH = "/tmp/ims_upload.sock"  # 상주 업로드 서비스 소켓
+UPLOAD_SETTINGS_FILE = "/usr/bin/ims/aws/upload.json"  # 설치 환경별 설정 (UPLOAD_SETTINGS 덮어쓰기)
+PARTIAL_SUFFIXES = (".tmp", ".part")  # 기록 중인 임시 파일 (IMS_cam 은 .part 로 쓴 뒤 이름을 바꿈)
+
+# 업로드 설정
+UPLOAD_SETTINGS = {
+    "bucket": None,               # 필수: UPLOAD_SETTINGS_FILE 에 지정
+    "prefix": "",                 # 객체 키 앞에 붙는 경로 (예: 장치 ID)
+    "region": None,               # 필수: UPLOAD_SETTINGS_FILE 또는 AWS 설정(~/.aws/config, AWS_DEFAULT_REGION)
+    "endpoint_url": None,         # S3 호환 서버 주소 (예: 로컬 테스트용 MinIO/moto)
+    "concurrency": 4,             # 동시에 올리는 파일 수 (= 연결 풀 크기)
+    "multipart_threshold": 8 * 1024 * 1024,  # 이 크기 이상이면 멀티파트 업로드
+    "part_size": 8 * 1024 * 1024,            # 멀티파트 조각 크기 (S3 최소 5MB, 마지막 조각 제외)
+    "min_age": 5,                 # 기록 중인 파일을 올리지 않도록, 이 시간(초) 이상 지난 파일만 업로드
+    "scan_interval": 60,          # 상주 모드에서 디렉토리를 다시 확인하는 주기(초)
+}
+
+
+def load_upload_settings():
+    """UPLOAD_SETTINGS 에 UPLOAD_SETTINGS_FILE 의 값을 덮어써서 반환합니다."""
+    settings = dict(UPLOAD_SETTINGS)
+    if os.path.exists(UPLOAD_SETTINGS_FILE):
+        try:
+            with open(UPLOAD_SETTINGS_FILE, 'r') as f:
+                settings.update(json.load(f))
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Failed to read {UPLOAD_SETTINGS_FILE}: {e}")
+    if not settings["region"]:
+        settings["region"] = boto3.session.Session().region_name
+    return settings
+
+
+def check_upload_settings(settings):
+    """버킷과 리전은 설치 환경마다 달라 기본값이 없습니다. 빠져 있으면 UploadError."""
+    missing = [name for name in ("bucket", "region") if not settings.get(name)]
+    if missing:
+        raise UploadError(f"Missing upload setting(s) {', '.join(missing)}: set them in {UPLOAD_SETTINGS_FILE}"
+                          f" (region may also come from the AWS config)")
+
+
+def md5_digest(data):
+    return hashlib.md5(data).digest()
+
+
+def content_md5(digest):
+    return base64.b64encode(digest).decode()
+
+
+def write_json_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class UploadError(Exception):
+    pass
+
+
+### 업로드 ###
+class Uploader:
+    """
+    S3 업로드 작업기. boto3 클라이언트 하나를 재사용하여 연결(TLS 세션)을 풀에서 다시 씁니다.
+    - 작은 파일: put_object + Content-MD5 (서버가 본문을 검증)
+    - 큰 파일: 멀티파트 업로드, 조각마다 Content-MD5, 진행 상황을 UPLOAD_STATE_DIR 에 기록하여 중단 후 재개
+    - 업로드 후 head_object 로 크기를 확인한 뒤에만 로컬 파일을 삭제
+    """
+
+    def __init__(self, settings=None, client=None, state_dir=UPLOAD_STATE_DIR):
+        self.settings = settings or load_upload_settings()
+        check_upload_settings(self.settings)
+        self.bucket = self.settings["bucket"]
+        self.state_dir = state_dir
+        self.client = client or boto3.client(
+            "s3", region_name=self.settings["region"], endpoint_url=self.settings["endpoint_url"],
+            config=Config(max_pool_connections=self.settings["concurrency"], retries={"max_attempts": 3}))
+        self.pool = ThreadPoolExecutor(max_workers=self.settings["concurrency"], thread_name_prefix="upload")
+        self.in_flight = set()  # 업로드 중인 경로 (같은 파일을 두 번 올리지 않도록)
+        self.lock = threading.Lock()
+        self.counters = {"uploaded": 0, "failed": 0, "bytes": 0, "resumed": 0, "seconds": 0.0}
+
+    def object_key(self, path):
+        name = os.path.basename(path)
+        prefix = self.settings["prefix"].strip("/")
+        return f"{prefix}/{name}" if prefix else name
+
+    def _state_path(self, key):
+        return os.path.join(self.state_dir, key.replace("/", "_") + ".json")
+
+    ### 단일 파일 ###
+    def upload_small(self, path, key):
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = md5_digest(data)
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data, ContentMD5=content_md5(digest))
+        return len(data)
+
+    def upload_multipart(self, path, key):
+        size = os.path.getsize(path)
+        part_size = max(int(self.settings["part_size"]), 5 * 1024 * 1024)
+        state_path = self._state_path(key)
+        state = self._load_state(state_path, path, size, part_size)
+        if state is None:
+            upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=key)["UploadId"]
+            state = {"upload_id": upload_id, "size": size, "mtime": os.path.getmtime(path),
+                     "part_size": part_size, "parts": {}}
+            os.makedirs(self.state_dir, exist_ok=True)
+            write_json_atomic(state_path, state)
+        else:
+            self.counters["resumed"] += 1
+            logger.info(f"Resuming multipart upload of {key}: {len(state['parts'])} part(s) already uploaded")
+        # 조각 본문은 Content-MD5 로 서버가 검증합니다. ETag 는 SSE-KMS/SSE-C 에서 MD5 가 아니므로
+        # 비교하지 않고, 서버가 돌려준 값을 그대로 기록해 완료 요청에 씁니다.
+        parts = []
+        with open(path, 'rb') as f:
+            for number in range(1, (size + part_size - 1) // part_size + 1):
+                data = f.read(part_size)
+                digest = md5_digest(data)
+                done = state["parts"].get(str(number))
+                if done is None or done["md5"] != digest.hex():
+                    response = self.client.upload_part(Bucket=self.bucket, Key=key, UploadId=state["upload_id"],
+                                                       PartNumber=number, Body=data, ContentMD5=content_md5(digest))
+                    done = {"md5": digest.hex(), "etag": response["ETag"].strip('"')}
+                    state["parts"][str(number)] = done
+                    write_json_atomic(state_path, state)
+                parts.append({"PartNumber": number, "ETag": f'"{done["etag"]}"'})
+        self.client.complete_multipart_upload(Bucket=self.bucket, Key=key, UploadId=state["upload_id"],
+                                              MultipartUpload={"Parts": parts})
+        os.remove(state_path)
+        return size
+
+    def _load_state(self, state_path, path, size, part_size):
+        """파일이 바뀌지 않았고 서버에 업로드가 남아 있으면 재개 정보를 반환합니다."""
+        try:
+            with open(state_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (state.get("size"), state.get("mtime"), state.get("part_size")) != (size, os.path.getmtime(path), part_size):
+            return None
+        try:
+            listed = self.client.list_parts(Bucket=self.bucket, Key=self.object_key(path), UploadId=state["upload_id"])
+        except ClientError:
+            return None  # 만료되었거나 취소된 업로드
+        # 서버에 실제로 있는 조각만 인정
+        on_server = {str(part["PartNumber"]): part["ETag"].strip('"') for part in listed.get("Parts", [])}
+        state["parts"] = {number: part for number, part in state["parts"].items()
+                          if isinstance(part, dict) and on_server.get(number) == part.get("etag")}
+        return state
+
+    def upload(self, path):
+        """파일 하나를 올리고, 서버에서 크기를 확인한 뒤 로컬 파일을 삭제합니다. 성공하면 True."""
+        key = self.object_key(path)
+        started = time.monotonic()
+        try:
+            size = os.path.getsize(path)
+            if size >= self.settings["multipart_threshold"]:
+                uploaded = self.upload_multipart(path, key)
+            else:
+                uploaded = self.upload_small(path, key)
+            head = self.client.head_object(Bucket=self.bucket, Key=key)
+            if head["ContentLength"] != uploaded:
+                raise UploadError(f"Size mismatch for {key}: {head['ContentLength']} != {uploaded}")
+            os.remove(path)
+        except (OSError, BotoCoreError, ClientError, UploadError) as e:
+            logger.error(f"Failed to upload {path}: {e}")
+            with self.lock:
+                self.counters["failed"] += 1
+            return False
+        elapsed = time.monotonic() - started
+        with self.lock:
+            self.counters["uploaded"] += 1
+            self.counters["bytes"] += uploaded
+            self.counters["seconds"] += elapsed
+        logger.info(f"Uploaded {path} to s3://{self.bucket}/{key}: {uploaded} bytes in {elapsed:.2f}s")
+        return True
+
+    ### 묶음 ###
+    def pending_files(self, directory=UPLOAD_DIR):
+        """업로드할 파일 목록 (기록이 끝난 파일, 오래된 순)."""
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return []
+        now = time.time()
+        paths = []
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                if name.endswith(PARTIAL_SUFFIXES) or not os.path.isfile(path) or now - os.path.getmtime(path) < self.settings["min_age"]:
+                    continue
+                paths.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+        return [path for _, path in sorted(paths)]
+
+    def upload_batch(self, paths):
+        """파일들을 동시에 올리고 경로 -> 성공 여부를 반환합니다. 이미 올리는 중인 파일은 건너뜁니다."""
+        with self.lock:
+            paths = [path for path in paths if path not in self.in_flight]
+            self.in_flight.update(paths)
+        try:
+            return dict(zip(paths, self.pool.map(self.upload, paths)))
+        finally:
+            with self.lock:
+                self.in_flight.difference_update(paths)
+
+    def stats(self):
+        seconds = self.counters["seconds"]
+        return {**self.counters, "seconds": round(seconds, 2),
+                "bytes_per_s": round(self.counters["bytes"] / seconds, 1) if seconds else 0.0}
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+
+### 상주 업로드 서비스 ###
+def handle_client(conn, uploader, wake):
+    """
+    요청 한 줄(JSON)을 받아 처리합니다.
+    - {"files": [...]}: 지정한 파일을 올리고 결과를 돌려줌
+    - {"wait": false}: 디렉토리 업로드를 예약만 하고 바로 응답 (촬영 직후 알림)
+    - {}: 디렉토리의 파일을 모두 올리고 결과를 돌려줌
+    """
+    with conn, conn.makefile('rwb') as stream:
+        line = stream.readline()
+        if not line:
+            return  # 연결만 확인하는 헬스 체크
+        try:
+            request = json.loads(line)
+            files = [str(path) for path in request.get("files", [])]
+        except (ValueError, AttributeError) as e:
+            stream.write(json.dumps({"error": f"bad request: {e}"}).encode() + b"\n")
+            return
+        if not request.get("wait", True):
+            wake.set()
+            stream.write(json.dumps({"results": {}, "queued": True}).encode() + b"\n")
+            return
+        results = uploader.upload_batch(files or uploader.pending_files())
+        stream.write(json.dumps({"results": results}).encode() + b"\n")
+
+
+def scan_loop(uploader, wake, stop):
+    """알림을 받거나 scan_interval 이 지나면 디렉토리의 파일을 올립니다."""
+    while not stop.is_set():
+        wake.wait(uploader.settings["scan_interval"])
+        wake.clear()
+        paths = uploader.pending_files()
+        if paths:
+            results = uploader.upload_batch(paths)
+            logger.info(f"Uploaded {sum(results.values())}/{len(results)} file(s), totals {uploader.stats()}")
+
+
+def serve(socket_path=UPLOAD_SOCKET_PATH):
+    """S3 연결을 유지한 채 Unix 소켓으로 업로드 요청을 받습니다. 요청마다 스레드에서 처리합니다."""
+    uploader = Uploader()
+    wake, stop = threading.Event(), threading.Event()
+    wake.set()  # 시작할 때 밀린 파일부터 업로드
+    scanner = threading.Thread(target=scan_loop, args=(uploader, wake, stop), name="upload-scan", daemon=True)
+    scanner.start()
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(8)
+    logger.info(f"Upload service listening on {socket_path}")
+    try:
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=handle_client, args=(conn, uploader, wake), daemon=True).start()
+    except KeyboardInterrupt:
+        logger.info("Upload service stopped.")
+    finally:
+        stop.set()
+        wake.set()
+        server.close()
+        os.remove(socket_path)
+        uploader.close()
+        logger.info(f"Upload stats: {uploader.stats()}")
+
+
+if __name__ == "__main__":
+    try:
+        if sys.argv[1:2] == ["--serve"]:
+            serve()
+            sys.exit(0)
+        # 단발 실행: IMS_upload.py [파일...] (없으면 UPLOAD_DIR 전체). 모두 성공하면 0
+        uploader = Uploader()
+    except UploadError as e:
+        # 버킷/리전이 없으면 시작하지 않음 (Uploader 생성 시 확인)
+        logger.error(f"Upload service not started: {e}")
+        sys.exit(2)
+    targets = sys.argv[1:] or uploader.pending_files()
+    results = uploader.upload_batch(targets)
+    uploader.close()
+    logger.info(f"Uploaded {sum(results.values())}/{len(results)} file(s): {uploader.stats()}")
+    sys.exit(0 if all(results.values()) else 1)
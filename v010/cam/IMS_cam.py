@@ -1,132 +1,766 @@
-import sys
-import time
-import logging
-import cv2
-import numpy as np
-import os
-import json
-import subprocess
-
-# 로깅 설정
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-# 경로 설정
-OUTPUT_DIR = "/usr/bin/ims/aws/toS3"  # 결과 이미지가 저장될 디렉토리
-CAM_ERROR_FILE_PATH = "/usr/bin/ims/uart/to_server/cam_error.json"
-
-# 방 번호에 따른 촬영 설정을 딕셔너리로 정의
-room_settings = {
-    '1': {"name": "Room1", "device": "/dev/video6"},
-    '2': {"name": "Room2", "device": "/dev/video8"},
-    '3': {"name": "Room3", "device": "/dev/video10"},
-}
-
-# 왜곡 보정 파라미터 값 설정
-k1, k2, k3, p1, p2 = -0.2, 0.04, 0.0, 0.0, 0.0
-cx, cy = 1082, 812
-angle = 0
-
-def undistort_image(img, camera_matrix, dist_coeffs):
-    h, w = img.shape[:2]
-    new_camera_matrix, roi = cv2.getOptimalNewCameraMatrix(camera_matrix, dist_coeffs, (w, h), 1, (w, h))
-    mapx, mapy = cv2.initUndistortRectifyMap(camera_matrix, dist_coeffs, None, new_camera_matrix, (w, h), 5)
-    dst = cv2.remap(img, mapx, mapy, cv2.INTER_LANCZOS4)
-    x, y, w, h = roi
-    return dst[y:y+h, x:x+w]
-
-def rotate_image(img, angle):
-    h, w = img.shape[:2]
-    center = (w // 2, h // 2)
-    rotation_matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
-    return cv2.warpAffine(img, rotation_matrix, (w, h), flags=cv2.INTER_LINEAR)
-
-def update_camera_error(room_number):
-    error_data = {
-        "main_camera_uart_error": 0,
-        "camera_room1_error": 0,
-        "camera_room2_error": 0,
-        "camera_room3_error": 0
-    }
-
-    # 파일이 존재하면 로드하여 현재 상태 유지
-    if os.path.exists(CAM_ERROR_FILE_PATH):
-        with open(CAM_ERROR_FILE_PATH, 'r') as f:
-            try:
-                error_data.update(json.load(f))
-            except json.JSONDecodeError:
-                logger.error("cam_error.json 파일이 손상되었습니다. 기본 상태로 재설정합니다.")
-
-    # 해당 방의 오류 플래그를 1로 설정
-    error_key = f"camera_room{room_number}_error"
-    if error_key in error_data:
-        error_data[error_key] = 1
-    else:
-        logger.warning(f"Invalid room number: {room_number}")
-
-    with open(CAM_ERROR_FILE_PATH, 'w') as f:
-        json.dump(error_data, f, indent=4)
-    logger.info(f"cam_error.json 업데이트 완료: {error_key} = 1")
-
-def capture_and_correct(room_number):
-    room = room_settings.get(room_number)
-    if room is None:
-        logger.error(f"Invalid room number {room_number}. Cannot capture image.")
-        return
-
-    os.makedirs(OUTPUT_DIR, exist_ok=True)  # 출력 디렉토리 생성
-
-    cap = cv2.VideoCapture(room["device"], cv2.CAP_V4L2)
-    if not cap.isOpened():
-        logger.error(f"Failed to open camera device for {room['name']}.")
-        update_camera_error(room_number)  # 오류 업데이트
-        return
-
-    # 해상도 설정: 2164x1624
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 2164)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 1624)
-    
-    # AE 및 AWB 안정화를 위해 3초 대기
-    time.sleep(3)
-    
-    ret, frame = cap.read()
-    if not ret:
-        logger.error(f"Failed to capture image for {room['name']}.")
-        update_camera_error(room_number)  # 오류 업데이트
-        cap.release()
-        return
-
-    # 자원 해제
-    cap.release()
-
-    # 왜곡 보정 및 회전 처리
-    camera_matrix = np.array([[1000, 0, cx], [0, 1000, cy], [0, 0, 1]])
-    dist_coeffs = np.array([k1, k2, p1, p2, k3])
-    undistorted_img = undistort_image(frame, camera_matrix, dist_coeffs)
-    final_img = rotate_image(undistorted_img, angle)
-    
-    # 파일 저장 (Room#_timestamp 형식)
-    timestamp = time.strftime("%y%m%d%H%M")
-    output_filename = os.path.join(OUTPUT_DIR, f"{room['name']}_{timestamp}.jpg")
-    cv2.imwrite(output_filename, final_img)
-    logger.info(f"Corrected image saved as {output_filename} for {room['name']}")
-
-if __name__ == "__main__":
-    # 인자가 없는 경우 방 1, 2, 3 모두 촬영, 있는 경우 해당 인자를 우선 촬영
-    if len(sys.argv) < 2:
-        logger.info("No specific room numbers provided. Capturing all rooms (1, 2, 3).")
-        room_numbers = ["1", "2", "3"]
-    else:
-        room_numbers = sys.argv[1:]
-
-    for room_number in room_numbers:
-        capture_and_correct(room_number)
-
-    try:
-        logger.info("Starting IMS_S3.py for S3 upload...")
-        subprocess.run(["python", "/usr/bin/ims/aws/IMS_S3.py"], check=True)
-        logger.info("IMS_S3.py executed successfully.")
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Failed to execute IMS_S3.py: {e}")
-
-    sys.exit(0)
+import sys
+import time
+import hashlib
+import logging
+import os
+import json
+import socket
+import subprocess
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# 로깅 설정
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# cv2/numpy 는 촬영/보정 경로에서만 load_imaging() 으로 import
+# (상주 카메라 서비스로 요청만 넘기는 실행은 import 비용을 치르지 않음)
+cv2 = None
+np = None
+
+# 경로 설정
+OUTPUT_DIR = "/usr/bin/ims/aws/toS3"  # 결과 이미지가 저장될 디렉토리
+CAM_ERROR_FILE_PATH = "/usr/bin/ims/uart/to_server/cam_error.json"
+UPLOAD_SCRIPT = "/usr/bin/ims/aws/IMS_upload.py"
+UPLOAD_SOCKET_PATH = "/tmp/ims_upload.sock"  # 상주 업로드 서비스 소켓
+CAM_SOCKET_PATH = "/tmp/ims_cam.sock"  # 상주 카메라 서비스 소켓
+SUPERVISOR_SOCKET_PATH = "/tmp/ims_supervisor.sock"  # main.py 감독 프로세스 소켓
+REMAP_CACHE_DIR = "/usr/bin/ims/cam/remap_cache"  # 왜곡 보정 remap 테이블 캐시
+CORRECTION_DIR = "/usr/bin/ims/cam/corrections"  # passthrough 이미지의 보정 파라미터 (업로드 대상이 아니므로 toS3 밖에 둠)
+CORRECTION_MAX_AGE = 30 * 24 * 3600  # 보정하지 않은 채 남은 보정 파라미터 파일 보관 기간(초)
+JPEG_SETTINGS_FILE = "/usr/bin/ims/cam/jpeg.json"  # 설치 환경별 JPEG 설정 (JPEG_SETTINGS 덮어쓰기)
+
+# 카메라 세션 설정
+CAPTURE_WIDTH, CAPTURE_HEIGHT = 2164, 1624
+CAM_KEEP_WARM = False        # True 면 장치를 계속 열어 둠
+CAM_IDLE_TIMEOUT = 30        # 마지막 촬영 후 장치를 닫기까지 시간(초)
+AE_MAX_WAIT = 3.0            # AE/AWB 안정화 최대 대기(초), 기존 고정 대기 시간
+AE_WARMUP_FRAMES = 10        # 장치를 연 뒤 안정 여부를 판단하기 전에 읽는 최소 프레임 수 (시작 직후 같은 어두운 프레임 제외)
+AE_STABLE_FRAMES = 5         # 안정 여부를 판단하는 최근 프레임 구간
+AE_TOLERANCE = 1.5           # 구간 안 채널 평균 밝기의 최대-최소 허용치 (0~255, 느린 AE 변화도 누적되어 걸림)
+
+# 다중 방 촬영 파이프라인 설정
+CAM_MAX_STREAMS = 2          # 동시에 스트리밍하는 장치 수 (PX30 USB 대역폭 한도)
+CAM_WORKERS = 2              # 보정/인코딩 작업 스레드 수
+
+# JPEG 인코딩 설정 (기본값은 기존 cv2.imwrite 결과와 같음)
+JPEG_SETTINGS = {
+    "quality": 95,           # 최대 품질 (target_bytes 가 있으면 탐색 상한)
+    "progressive": False,
+    "optimize": False,       # 허프만 테이블 최적화
+    "sampling": "420",       # 크로마 서브샘플링: "420" / "422" / "444"
+    "target_bytes": 0,       # 0 보다 크면 이 크기 이하가 되는 가장 높은 품질을 이진 탐색
+    "min_quality": 50,       # 탐색 하한
+    "thumbnail_width": 0,    # 0 보다 크면 이 폭의 썸네일(_thumb.jpg)도 저장
+    "thumbnail_quality": 80,
+}
+
+# 방 번호에 따른 촬영 설정을 딕셔너리로 정의
+# passthrough: True 면 카메라의 MJPEG 프레임을 디코딩/보정/재인코딩 없이 그대로 저장
+#              (보정 파라미터는 CORRECTION_DIR 에 <이미지>.correction.json 으로 저장, 보정은 나중에 --correct 또는 서버에서)
+room_settings = {
+    '1': {"name": "Room1", "device": "/dev/video6", "passthrough": False},
+    '2': {"name": "Room2", "device": "/dev/video8", "passthrough": False},
+    '3': {"name": "Room3", "device": "/dev/video10", "passthrough": False},
+}
+
+# 왜곡 보정 파라미터 값 설정
+k1, k2, k3, p1, p2 = -0.2, 0.04, 0.0, 0.0, 0.0
+cx, cy = 1082, 812
+focal_length = 1000
+angle = 0
+
+def camera_parameters():
+    camera_matrix = np.array([[focal_length, 0, cx], [0, focal_length, cy], [0, 0, 1]], dtype=np.float64)
+    dist_coeffs = np.array([k1, k2, p1, p2, k3], dtype=np.float64)
+    return camera_matrix, dist_coeffs
+
+# 보정 품질: 'lanczos'(기존), 'cubic', 'linear' 순으로 빠름
+# cv2 상수 표는 상수 이름으로 적고 load_imaging() 에서 값으로 바꿈
+REMAP_QUALITY = 'lanczos'
+INTERPOLATION = {
+    'lanczos': 'INTER_LANCZOS4',
+    'cubic': 'INTER_CUBIC',
+    'linear': 'INTER_LINEAR',
+}
+# 90도 단위 회전은 remap 에 합치지 않고 cv2.rotate 로 처리 (getRotationMatrix2D 와 같은 반시계 방향)
+ROTATE_CODES = {
+    90: 'ROTATE_90_COUNTERCLOCKWISE',
+    180: 'ROTATE_180',
+    270: 'ROTATE_90_CLOCKWISE',
+}
+
+def load_imaging():
+    """cv2/numpy 를 import 하고 상수 표를 채웁니다. 처음 한 번만 실제로 import 합니다."""
+    global cv2, np
+    if cv2 is not None:
+        return
+    started = time.monotonic()
+    import cv2
+    import numpy as np
+    for table in (INTERPOLATION, ROTATE_CODES, SAMPLING_FACTORS):
+        for key, name in table.items():
+            table[key] = getattr(cv2, name, None)
+    logger.info(f"Loaded cv2/numpy in {(time.monotonic() - started) * 1000:.0f} ms")
+
+### 보정 remap 테이블 캐시 ###
+_correction_maps = {}  # (캐시 키) -> (map1, map2, 회전 코드)
+
+def correction_cache_key(camera_matrix, dist_coeffs, size, angle, alpha=1):
+    """보정 파라미터 + 해상도 + alpha + 회전 각도로 캐시 키(해시)를 만듭니다."""
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(camera_matrix, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(dist_coeffs, dtype=np.float64).tobytes())
+    digest.update(f"{size[0]}x{size[1]}:{alpha}:{float(angle) % 360}".encode())
+    return digest.hexdigest()[:16]
+
+def build_correction_maps(camera_matrix, dist_coeffs, size, angle, alpha=1):
+    """
+    왜곡 보정 → ROI 자르기 → 회전을 하나로 합친 고정소수점(CV_16SC2 + CV_16UC1) remap 테이블을 만듭니다.
+    - ROI 밖은 계산하지 않도록 보정 맵을 먼저 자름
+    - 임의 각도 회전은 보정 맵 자체를 회전시켜 합성 (영상 밖은 -1 → 검은색 테두리)
+    - 0/90/180/270 도는 회전 코드만 반환 (0 이면 None)
+    """
+    new_camera_matrix, roi = cv2.getOptimalNewCameraMatrix(camera_matrix, dist_coeffs, size, alpha, size)
+    mapx, mapy = cv2.initUndistortRectifyMap(camera_matrix, dist_coeffs, None, new_camera_matrix, size, cv2.CV_32FC1)
+    x, y, w, h = roi
+    mapx = np.ascontiguousarray(mapx[y:y+h, x:x+w])
+    mapy = np.ascontiguousarray(mapy[y:y+h, x:x+w])
+
+    normalized = float(angle) % 360
+    rotate_code = None
+    if normalized in ROTATE_CODES:
+        rotate_code = ROTATE_CODES[normalized]
+    elif normalized != 0:
+        rotation_matrix = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
+        mapx = cv2.warpAffine(mapx, rotation_matrix, (w, h), flags=cv2.INTER_LINEAR, borderValue=-1)
+        mapy = cv2.warpAffine(mapy, rotation_matrix, (w, h), flags=cv2.INTER_LINEAR, borderValue=-1)
+    map1, map2 = cv2.convertMaps(mapx, mapy, cv2.CV_16SC2)
+    return map1, map2, rotate_code
+
+def get_correction_maps(camera_matrix, dist_coeffs, size, angle=0):
+    """
+    remap 테이블을 메모리 → 디스크(.npy, mmap 으로 로드) → 새로 계산 순서로 찾습니다.
+    새로 계산한 테이블은 REMAP_CACHE_DIR 에 저장하여 다음 실행에서 재사용합니다.
+    """
+    key = correction_cache_key(camera_matrix, dist_coeffs, size, angle)
+    cached = _correction_maps.get(key)
+    if cached is not None:
+        return cached
+    prefix = os.path.join(REMAP_CACHE_DIR, f"correction_{key}")
+    normalized = float(angle) % 360
+    try:
+        map1 = np.load(f"{prefix}_map1.npy", mmap_mode='r')
+        map2 = np.load(f"{prefix}_map2.npy", mmap_mode='r')
+        rotate_code = ROTATE_CODES.get(normalized)
+        logger.info(f"Loaded correction maps {key} from {REMAP_CACHE_DIR}")
+    except (OSError, ValueError):
+        started = time.monotonic()
+        map1, map2, rotate_code = build_correction_maps(camera_matrix, dist_coeffs, size, angle)
+        logger.info(f"Built correction maps {key} in {time.monotonic() - started:.2f}s")
+        try:
+            os.makedirs(REMAP_CACHE_DIR, exist_ok=True)
+            for suffix, array in (("map1", map1), ("map2", map2)):
+                tmp_path = f"{prefix}_{suffix}.tmp.npy"
+                np.save(tmp_path, array)
+                os.replace(tmp_path, f"{prefix}_{suffix}.npy")
+        except OSError as e:
+            logger.warning(f"Could not store correction maps in {REMAP_CACHE_DIR}: {e}")
+    _correction_maps[key] = (map1, map2, rotate_code)
+    return map1, map2, rotate_code
+
+def correct_image(img, camera_matrix, dist_coeffs, angle=0, quality=None):
+    """왜곡 보정, ROI 자르기, 회전을 remap 한 번(+ 90도 단위면 cv2.rotate)으로 처리합니다."""
+    h, w = img.shape[:2]
+    map1, map2, rotate_code = get_correction_maps(camera_matrix, dist_coeffs, (w, h), angle)
+    dst = cv2.remap(img, map1, map2, INTERPOLATION[quality or REMAP_QUALITY])
+    if rotate_code is not None:
+        dst = cv2.rotate(dst, rotate_code)
+    return dst
+
+_cam_error_lock = threading.Lock()  # 여러 방을 동시에 촬영할 때 cam_error.json 보호
+
+def update_camera_error(room_number):
+    with _cam_error_lock:
+        _update_camera_error(room_number)
+
+def _update_camera_error(room_number):
+    error_data = {
+        "main_camera_uart_error": 0,
+        "camera_room1_error": 0,
+        "camera_room2_error": 0,
+        "camera_room3_error": 0
+    }
+
+    # 파일이 존재하면 로드하여 현재 상태 유지
+    if os.path.exists(CAM_ERROR_FILE_PATH):
+        with open(CAM_ERROR_FILE_PATH, 'r') as f:
+            try:
+                error_data.update(json.load(f))
+            except json.JSONDecodeError:
+                logger.error("cam_error.json 파일이 손상되었습니다. 기본 상태로 재설정합니다.")
+
+    # 해당 방의 오류 플래그를 1로 설정
+    error_key = f"camera_room{room_number}_error"
+    if error_key in error_data:
+        error_data[error_key] = 1
+    else:
+        logger.warning(f"Invalid room number: {room_number}")
+
+    with open(CAM_ERROR_FILE_PATH, 'w') as f:
+        json.dump(error_data, f, indent=4)
+    logger.info(f"cam_error.json 업데이트 완료: {error_key} = 1")
+
+### 카메라 세션 ###
+def is_encoded_frame(frame):
+    """CAP_PROP_CONVERT_RGB=0 으로 받은 MJPEG 원본 버퍼(1차원 바이트 배열)인지 확인합니다."""
+    return frame.ndim == 1 or (frame.ndim == 2 and frame.shape[0] == 1)
+
+def frame_brightness(frame):
+    """축소 샘플링한 B, G, R 채널 평균 (AE 는 밝기, AWB 는 채널 비율 변화로 나타남)"""
+    if is_encoded_frame(frame):
+        # MJPEG 은 1/8 크기로만 디코딩 (DCT 축소라 전체 디코딩보다 훨씬 가벼움)
+        frame = cv2.imdecode(frame.reshape(-1), cv2.IMREAD_REDUCED_COLOR_8)
+        if frame is None:
+            return np.zeros(3)
+        return frame[::2, ::2].reshape(-1, 3).mean(axis=0)
+    return frame[::16, ::16].reshape(-1, frame.shape[2]).mean(axis=0)
+
+class CameraSession:
+    """V4L2 장치 하나를 열어 두고 AE/AWB 가 안정된 프레임을 돌려주는 세션."""
+
+    def __init__(self, device, passthrough=False):
+        self.device = device
+        self.passthrough = passthrough
+        self.cap = None
+        self.last_used = 0
+        self.frames_read = 0  # 장치를 연 뒤 읽은 프레임 수
+
+    def open(self):
+        if self.cap is not None and self.cap.isOpened():
+            return True
+        self.cap = cv2.VideoCapture(self.device, cv2.CAP_V4L2)
+        self.frames_read = 0
+        if not self.cap.isOpened():
+            self.cap = None
+            return False
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, CAPTURE_WIDTH)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, CAPTURE_HEIGHT)
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # 오래된 프레임이 쌓이지 않도록
+        if self.passthrough:
+            # 카메라의 MJPEG 버퍼를 디코딩하지 않고 그대로 받음
+            self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
+            if not self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0):
+                logger.warning(f"{self.device} does not support raw MJPEG capture, frames will be decoded")
+        return True
+
+    def read_converged(self, max_wait=AE_MAX_WAIT):
+        """
+        장치를 연 뒤 AE_WARMUP_FRAMES 프레임 이상 읽었고, 최근 AE_STABLE_FRAMES 프레임의 채널 평균
+        최대-최소 차이가 AE_TOLERANCE 안이면 그 프레임을 반환합니다.
+        max_wait 안에 안정되지 않으면 마지막 프레임을 반환합니다.
+        """
+        started = time.monotonic()
+        window = deque(maxlen=AE_STABLE_FRAMES)
+        frame = None
+        while True:
+            ret, next_frame = self.cap.read()
+            if not ret:
+                return frame
+            frame = next_frame
+            self.frames_read += 1
+            window.append(frame_brightness(frame))
+            elapsed = time.monotonic() - started
+            if (self.frames_read >= AE_WARMUP_FRAMES and len(window) == AE_STABLE_FRAMES
+                    and np.ptp(window, axis=0).max() < AE_TOLERANCE):
+                logger.info(f"AE/AWB converged on {self.device} in {elapsed:.2f}s")
+                return frame
+            if elapsed >= max_wait:
+                logger.warning(f"AE/AWB did not converge on {self.device} within {max_wait}s")
+                return frame
+
+    def capture(self):
+        """프레임 하나를 촬영합니다. 실패하면 None."""
+        if not self.open():
+            return None
+        frame = self.read_converged()
+        self.last_used = time.monotonic()
+        if frame is None:
+            self.close()  # 다음 촬영 때 장치를 새로 엶
+        return frame
+
+    def close(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+class CameraManager:
+    """
+    방별 카메라 세션을 관리합니다.
+    - 서로 다른 방은 동시에 촬영 가능, 동시 스트리밍 장치 수는 max_streams 로 제한
+    - 사용하지 않는 장치는 CAM_IDLE_TIMEOUT 후 닫음
+    """
+
+    def __init__(self, keep_warm=CAM_KEEP_WARM, idle_timeout=CAM_IDLE_TIMEOUT, max_streams=CAM_MAX_STREAMS):
+        self.keep_warm = keep_warm
+        self.idle_timeout = idle_timeout
+        self.sessions = {number: CameraSession(room["device"], room.get("passthrough", False))
+                         for number, room in room_settings.items()}
+        self.locks = {number: threading.Lock() for number in room_settings}
+        self.stream_slots = threading.BoundedSemaphore(max_streams)
+
+    def capture(self, room_number):
+        with self.locks[room_number], self.stream_slots:
+            session = self.sessions[room_number]
+            frame = session.capture()
+            if not self.keep_warm and self.idle_timeout <= 0:
+                session.close()
+            return frame
+
+    def close_idle(self):
+        if self.keep_warm:
+            return
+        now = time.monotonic()
+        for number, session in self.sessions.items():
+            with self.locks[number]:
+                if session.cap is not None and now - session.last_used >= self.idle_timeout:
+                    logger.info(f"Closing idle camera {session.device}")
+                    session.close()
+
+    def close(self):
+        for number, session in self.sessions.items():
+            with self.locks[number]:
+                session.close()
+
+def acquire_frame(room_number, manager=None):
+    """방의 프레임을 촬영합니다. 실패하면 cam_error.json 을 갱신하고 None."""
+    room = room_settings[room_number]
+    if manager is None:
+        session = CameraSession(room["device"], room.get("passthrough", False))
+        frame = session.capture()
+        session.close()  # 자원 해제
+    else:
+        frame = manager.capture(room_number)
+    if frame is None:
+        logger.error(f"Failed to capture image for {room['name']}.")
+        update_camera_error(room_number)  # 오류 업데이트
+    return frame
+
+def capture_and_correct(room_number, manager=None):
+    """방을 촬영하여 보정된 이미지를 저장하고 파일 경로를 반환합니다. 실패하면 None."""
+    if room_number not in room_settings:
+        logger.error(f"Invalid room number {room_number}. Cannot capture image.")
+        return None
+    frame = acquire_frame(room_number, manager)
+    if frame is None:
+        return None
+    return correct_and_save(room_number, frame)
+
+### JPEG 인코딩 ###
+SAMPLING_FACTORS = {  # 없는 cv2 버전에서는 None
+    "420": "IMWRITE_JPEG_SAMPLING_FACTOR_420",
+    "422": "IMWRITE_JPEG_SAMPLING_FACTOR_422",
+    "444": "IMWRITE_JPEG_SAMPLING_FACTOR_444",
+}
+
+def load_jpeg_settings():
+    """JPEG_SETTINGS 에 JPEG_SETTINGS_FILE 의 값을 덮어써서 반환합니다."""
+    settings = dict(JPEG_SETTINGS)
+    if os.path.exists(JPEG_SETTINGS_FILE):
+        try:
+            with open(JPEG_SETTINGS_FILE, 'r') as f:
+                settings.update(json.load(f))
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Failed to read {JPEG_SETTINGS_FILE}, using defaults: {e}")
+    return settings
+
+def jpeg_params(quality, settings):
+    params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    if settings.get("progressive"):
+        params += [cv2.IMWRITE_JPEG_PROGRESSIVE, 1]
+    if settings.get("optimize"):
+        params += [cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+    sampling = SAMPLING_FACTORS.get(str(settings.get("sampling", "420")))
+    if sampling is not None and hasattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR"):
+        params += [cv2.IMWRITE_JPEG_SAMPLING_FACTOR, sampling]
+    return params
+
+def encode_jpeg(img, settings):
+    """
+    설정에 따라 JPEG 으로 인코딩하고 (데이터, 사용한 품질, 인코딩 횟수)를 반환합니다.
+    target_bytes 가 있으면 그 크기 이하가 되는 가장 높은 품질을 이진 탐색합니다.
+    """
+    def encode(quality):
+        ok, buf = cv2.imencode(".jpg", img, jpeg_params(quality, settings))
+        if not ok:
+            raise RuntimeError("JPEG encoding failed")
+        return buf
+
+    quality = int(settings["quality"])
+    target = int(settings.get("target_bytes") or 0)
+    data = encode(quality)
+    attempts = 1
+    if target <= 0 or len(data) <= target:
+        return data, quality, attempts
+
+    # 상한에서 이미 초과했으므로 [min_quality, quality - 1] 에서 탐색, 모두 초과하면 min_quality 사용
+    low, high = int(settings.get("min_quality", 50)), quality - 1
+    best = None
+    while low <= high:
+        middle = (low + high) // 2
+        candidate = encode(middle)
+        attempts += 1
+        if len(candidate) <= target:
+            best = (candidate, middle)
+            low = middle + 1
+        else:
+            high = middle - 1
+    if best is None:
+        minimum = int(settings.get("min_quality", 50))
+        logger.warning(f"Cannot reach {target} bytes even at quality {minimum}")
+        best = (encode(minimum), minimum)
+        attempts += 1
+    return best[0], best[1], attempts
+
+def write_file_atomic(path, data):
+    """업로드 쪽에서 쓰다 만 파일을 보지 않도록 임시 파일에 쓴 뒤 이름을 바꿉니다."""
+    tmp_path = f"{path}.part"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def save_jpeg(output_filename, img, settings=None):
+    """이미지를 설정에 맞게 저장하고 인코딩 지표(시간, 크기, 품질)를 반환합니다."""
+    settings = settings or load_jpeg_settings()
+    started = time.perf_counter()
+    data, quality, attempts = encode_jpeg(img, settings)
+    encode_ms = (time.perf_counter() - started) * 1000
+    write_file_atomic(output_filename, data.tobytes())
+    metrics = {"file": output_filename, "bytes": len(data), "quality": quality,
+               "attempts": attempts, "encode_ms": round(encode_ms, 1)}
+
+    thumbnail_width = int(settings.get("thumbnail_width") or 0)
+    if 0 < thumbnail_width < img.shape[1]:
+        height = round(img.shape[0] * thumbnail_width / img.shape[1])
+        thumbnail = cv2.resize(img, (thumbnail_width, height), interpolation=cv2.INTER_AREA)
+        ok, thumb_data = cv2.imencode(".jpg", thumbnail, jpeg_params(settings.get("thumbnail_quality", 80), settings))
+        if ok:
+            thumbnail_filename = output_filename[:-len(".jpg")] + "_thumb.jpg"
+            write_file_atomic(thumbnail_filename, thumb_data.tobytes())
+            metrics["thumbnail_bytes"] = len(thumb_data)
+    return metrics
+
+def correction_sidecar_path(jpeg_path):
+    """passthrough 이미지의 보정 파라미터 파일 경로 (이미지 파일 이름 기준)."""
+    return os.path.join(CORRECTION_DIR, os.path.basename(jpeg_path)[:-len(".jpg")] + ".correction.json")
+
+def prune_correction_sidecars(now=None):
+    """CORRECTION_MAX_AGE 보다 오래된 보정 파라미터 파일을 지웁니다 (보정 없이 업로드된 이미지의 것)."""
+    now = time.time() if now is None else now
+    try:
+        with os.scandir(CORRECTION_DIR) as entries:
+            for entry in entries:
+                if entry.name.endswith(".correction.json") and now - entry.stat().st_mtime > CORRECTION_MAX_AGE:
+                    os.remove(entry.path)
+    except OSError as e:
+        logger.warning(f"Could not prune {CORRECTION_DIR}: {e}")
+
+def save_passthrough(output_filename, frame):
+    """
+    MJPEG 원본을 그대로 저장하고, 나중에 보정할 수 있도록 보정 파라미터를 CORRECTION_DIR 에 기록합니다.
+    보정 파라미터는 업로드 후에도 남도록 toS3 밖에 둡니다.
+    """
+    camera_matrix, dist_coeffs = camera_parameters()
+    correction = {
+        "camera_matrix": camera_matrix.tolist(),
+        "dist_coeffs": dist_coeffs.tolist(),
+        "angle": angle,
+        "corrected": False,
+    }
+    os.makedirs(CORRECTION_DIR, exist_ok=True)
+    prune_correction_sidecars()
+    # 이미지보다 먼저 기록: 이미지가 보이는 시점에는 항상 보정 파라미터가 있음
+    write_file_atomic(correction_sidecar_path(output_filename), json.dumps(correction, indent=4).encode())
+    write_file_atomic(output_filename, frame.tobytes())
+    return {"file": output_filename, "bytes": frame.size, "quality": None, "attempts": 0, "encode_ms": 0.0}
+
+def correct_saved_image(jpeg_path):
+    """
+    passthrough 로 저장된 이미지를 나중에 보정합니다 (같은 경로에 덮어씀).
+    CORRECTION_DIR 에 보정 파라미터가 있으면 그 값을 사용합니다.
+    """
+    load_imaging()
+    img = cv2.imread(jpeg_path)
+    if img is None:
+        logger.error(f"Cannot read {jpeg_path}")
+        return None
+    camera_matrix, dist_coeffs = camera_parameters()
+    image_angle = angle
+    sidecar = correction_sidecar_path(jpeg_path)
+    if os.path.exists(sidecar):
+        with open(sidecar, 'r') as f:
+            correction = json.load(f)
+        camera_matrix = np.array(correction["camera_matrix"], dtype=np.float64)
+        dist_coeffs = np.array(correction["dist_coeffs"], dtype=np.float64)
+        image_angle = correction.get("angle", angle)
+    metrics = save_jpeg(jpeg_path, correct_image(img, camera_matrix, dist_coeffs, image_angle))
+    if os.path.exists(sidecar):
+        os.remove(sidecar)
+    logger.info(f"Corrected {jpeg_path}: {metrics['bytes']} bytes")
+    return metrics
+
+def correct_and_save(room_number, frame):
+    """프레임을 보정하여 저장하고 파일 경로를 반환합니다. MJPEG 원본이면 그대로 저장합니다."""
+    room = room_settings[room_number]
+    os.makedirs(OUTPUT_DIR, exist_ok=True)  # 출력 디렉토리 생성
+    timestamp = time.strftime("%y%m%d%H%M")
+    output_filename = os.path.join(OUTPUT_DIR, f"{room['name']}_{timestamp}.jpg")
+
+    if is_encoded_frame(frame):
+        metrics = save_passthrough(output_filename, frame)
+        logger.info(f"Passthrough image saved as {output_filename} for {room['name']}: {metrics['bytes']} bytes")
+        return output_filename
+
+    # 왜곡 보정 및 회전 처리
+    camera_matrix, dist_coeffs = camera_parameters()
+    final_img = correct_image(frame, camera_matrix, dist_coeffs, angle)
+    
+    # 파일 저장 (Room#_timestamp 형식)
+    metrics = save_jpeg(output_filename, final_img)
+    logger.info(f"Corrected image saved as {output_filename} for {room['name']}: "
+                f"{metrics['bytes']} bytes, quality {metrics['quality']}, encoded in {metrics['encode_ms']} ms "
+                f"({metrics['attempts']} attempt(s))")
+    return output_filename
+
+def capture_rooms(room_numbers, manager, workers=None):
+    """
+    여러 방을 파이프라인으로 촬영합니다.
+    - 각 방의 장치 열기/AE 안정화를 동시에 진행 (CAM_MAX_STREAMS 까지)
+    - 프레임을 받는 즉시 보정/저장을 작업 풀에 넘겨 다음 방 촬영과 겹침
+    방 번호 -> 저장 경로(실패 시 None) 를 반환합니다.
+    """
+    load_imaging()
+    results = {}
+    valid = []
+    for room_number in room_numbers:
+        if room_number in room_settings and room_number not in valid:
+            valid.append(room_number)
+        elif room_number not in room_settings:
+            logger.error(f"Invalid room number {room_number}. Cannot capture image.")
+            results[room_number] = None
+    if not valid:
+        return results
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=len(valid), thread_name_prefix="acquire") as acquire_pool, \
+            ThreadPoolExecutor(max_workers=workers or CAM_WORKERS, thread_name_prefix="correct") as correct_pool:
+        def acquire_then_submit(room_number):
+            frame = acquire_frame(room_number, manager)
+            return None if frame is None else correct_pool.submit(correct_and_save, room_number, frame)
+
+        acquisitions = {room_number: acquire_pool.submit(acquire_then_submit, room_number) for room_number in valid}
+        for room_number, acquisition in acquisitions.items():
+            correction = acquisition.result()
+            results[room_number] = None if correction is None else correction.result()
+    logger.info(f"Captured rooms {valid} in {time.monotonic() - started:.2f}s")
+    return results
+
+def request_camera_service(request, socket_path=CAM_SOCKET_PATH):
+    """상주 카메라 서비스에 작업을 넘기고 결과를 반환합니다. 서비스가 없으면 OSError."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        conn.connect(socket_path)
+        with conn.makefile('rwb') as stream:
+            stream.write(json.dumps(request).encode() + b"\n")
+            stream.flush()
+            response = json.loads(stream.readline() or b'{}')
+    if "results" not in response:
+        raise ValueError(response.get("error", "no response"))
+    return response["results"]
+
+def run_in_camera_service(request):
+    """
+    상주 카메라 서비스가 있으면 작업을 넘기고 성공 여부를 반환합니다 (cv2 를 import 하지 않음).
+    서비스가 없으면 None 을 반환하여 이 프로세스에서 처리하게 합니다.
+    """
+    try:
+        results = request_camera_service(request)
+    except (OSError, ValueError) as e:
+        logger.info(f"Camera service unavailable ({e}), running in this process")
+        return None
+    logger.info(f"Camera service handled request: {results}")
+    return bool(results) and all(results.values())
+
+def notify_upload_service(socket_path=UPLOAD_SOCKET_PATH):
+    """상주 업로드 서비스에 새 이미지가 있음을 알립니다 (업로드를 기다리지 않음). 서비스가 없으면 OSError."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        conn.connect(socket_path)
+        with conn.makefile('rwb') as stream:
+            stream.write(json.dumps({"wait": False}).encode() + b"\n")
+            stream.flush()
+            stream.readline()
+
+def supervisor_running(socket_path=SUPERVISOR_SOCKET_PATH):
+    """감독 프로세스(main.py) 소켓에 연결되는지 확인합니다."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.connect(socket_path)
+        return True
+    except OSError:
+        return False
+
+def upload_to_s3():
+    """
+    촬영한 이미지의 업로드를 요청하고 바로 돌아옵니다 (업로드 완료를 기다리지 않음).
+    - 상주 업로드 서비스가 있으면 알림만 보냄
+    - 감독 프로세스만 있으면 건너뜀 (오프라인/프로비저닝 전: outbox 가 수집, 온라인이 되면 업로드 서비스가 디렉토리를 다시 확인)
+    - 둘 다 없으면 IMS_upload.py 를 분리된 프로세스로 실행
+    """
+    try:
+        notify_upload_service()
+        logger.info("Notified upload service of new images.")
+        return
+    except OSError as e:
+        logger.info(f"Upload service unavailable ({e})")
+    if supervisor_running():
+        logger.info(f"Leaving images in {OUTPUT_DIR} for the outbox / next upload scan.")
+        return
+    try:
+        subprocess.Popen(["python3", UPLOAD_SCRIPT], start_new_session=True,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        logger.info("Started IMS_upload.py in the background.")
+    except OSError as e:
+        logger.error(f"Failed to start IMS_upload.py: {e}")
+
+### 상주 카메라 서비스 ###
+def handle_client(conn, manager):
+    """
+    요청 한 줄(JSON)을 받아 처리하고 결과 한 줄을 돌려줍니다.
+    - {"rooms": ["1", ...], "upload": true}: 촬영 (기본으로 촬영 후 업로드)
+    - {"correct": ["/path/a.jpg", ...]}: passthrough 이미지 보정
+    """
+    with conn, conn.makefile('rwb') as stream:
+        line = stream.readline()
+        if not line:
+            return  # 연결만 확인하는 헬스 체크
+        try:
+            request = json.loads(line)
+            rooms = [str(room) for room in request.get("rooms", [])]
+            corrections = [str(path) for path in request.get("correct", [])]
+        except (ValueError, AttributeError) as e:
+            stream.write(json.dumps({"error": f"bad request: {e}"}).encode() + b"\n")
+            return
+        started = time.monotonic()
+        if corrections:
+            results = {path: correct_saved_image(path) is not None for path in corrections}
+        else:
+            results = capture_rooms(rooms, manager)
+        elapsed = time.monotonic() - started
+        logger.info(f"Request for {corrections or rooms} finished in {elapsed:.2f}s")
+        # 저장이 끝나면 바로 응답 (IMS_uart 가 LED 를 끄고 다음 촬영을 진행), 업로드 요청은 그 다음
+        stream.write(json.dumps({"results": results, "elapsed": elapsed}).encode() + b"\n")
+        stream.flush()
+        if not corrections and request.get("upload", True) and any(results.values()):
+            upload_to_s3()
+
+def serve(socket_path=CAM_SOCKET_PATH):
+    """카메라 장치와 cv2 를 상주시킨 채 Unix 소켓으로 촬영/보정 요청을 받습니다."""
+    load_imaging()
+    manager = CameraManager()
+    # 첫 촬영 전에 remap 테이블을 미리 준비
+    get_correction_maps(*camera_parameters(), (CAPTURE_WIDTH, CAPTURE_HEIGHT), angle)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(4)
+    server.settimeout(max(1, min(CAM_IDLE_TIMEOUT, 5)))
+    logger.info(f"Camera service listening on {socket_path}")
+    try:
+        while True:
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                manager.close_idle()
+                continue
+            conn.settimeout(None)
+            try:
+                handle_client(conn, manager)  # 촬영은 한 번에 하나씩
+            except OSError as e:
+                logger.error(f"Camera service client error: {e}")
+    except KeyboardInterrupt:
+        logger.info("Camera service stopped.")
+    finally:
+        manager.close()
+        server.close()
+        os.remove(socket_path)
+
+### 벤치마크 ###
+def benchmark_undistort(iterations=5):
+    """
+    기존 방식(촬영마다 테이블 생성 → remap → 자르기 → warpAffine)과
+    캐시된 단일 remap 방식의 이미지당 처리 시간을 보정 품질별로 비교합니다.
+    """
+    load_imaging()
+    camera_matrix, dist_coeffs = camera_parameters()
+    size = (CAPTURE_WIDTH, CAPTURE_HEIGHT)
+    img = np.random.randint(0, 256, (CAPTURE_HEIGHT, CAPTURE_WIDTH, 3), dtype=np.uint8)
+
+    def original_pipeline():
+        new_camera_matrix, roi = cv2.getOptimalNewCameraMatrix(camera_matrix, dist_coeffs, size, 1, size)
+        mapx, mapy = cv2.initUndistortRectifyMap(camera_matrix, dist_coeffs, None, new_camera_matrix, size, cv2.CV_32FC1)
+        dst = cv2.remap(img, mapx, mapy, cv2.INTER_LANCZOS4)
+        x, y, w, h = roi
+        dst = dst[y:y+h, x:x+w]
+        rotation_matrix = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
+        cv2.warpAffine(dst, rotation_matrix, (w, h), flags=cv2.INTER_LINEAR)
+
+    cases = [("original", original_pipeline)]
+    for quality in INTERPOLATION:
+        cases.append((f"fused-{quality}", lambda q=quality: correct_image(img, camera_matrix, dist_coeffs, angle, q)))
+    results = {}
+    for name, func in cases:
+        func()  # 준비 (캐시 생성 포함)
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        results[name] = (time.perf_counter() - started) / iterations
+    baseline = results["original"]
+    for name, elapsed in results.items():
+        print(f"{name:>16}: {elapsed * 1000:7.1f} ms per capture ({(baseline - elapsed) / baseline * 100:+.0f}% saved)")
+    return results
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--serve"]:
+        serve()
+        sys.exit(0)
+    if sys.argv[1:2] == ["--correct"]:
+        # passthrough 로 저장된 이미지를 나중에 보정: IMS_cam.py --correct <jpg>...
+        jpeg_paths = [os.path.abspath(path) for path in sys.argv[2:]]
+        if run_in_camera_service({"correct": jpeg_paths}) is None:
+            for jpeg_path in jpeg_paths:
+                correct_saved_image(jpeg_path)
+        sys.exit(0)
+    if sys.argv[1:2] == ["--benchmark"]:
+        benchmark_undistort(int(sys.argv[2]) if len(sys.argv) > 2 else 5)
+        sys.exit(0)
+
+    # 인자가 없는 경우 방 1, 2, 3 모두 촬영, 있는 경우 해당 인자를 우선 촬영
+    if len(sys.argv) < 2:
+        logger.info("No specific room numbers provided. Capturing all rooms (1, 2, 3).")
+        room_numbers = ["1", "2", "3"]
+    else:
+        room_numbers = sys.argv[1:]
+
+    # 상주 카메라 서비스가 있으면 촬영(+업로드)을 넘기고 종료
+    handled = run_in_camera_service({"rooms": room_numbers})
+    if handled is not None:
+        sys.exit(0 if handled else 1)
+
+    manager = CameraManager(idle_timeout=0)  # 한 번 촬영 후 바로 장치 해제
+    capture_rooms(room_numbers, manager)
+    manager.close()
+
+    upload_to_s3()
+
+    sys.exit(0)
@@ -1,69 +1,225 @@
-import subprocess
+import asyncio
+import json
 import os
-import logging
-import urllib.request
 import time
+import logging
+
+from IMS_supervisor import Supervisor, Service, WorkerPool, unix_socket_check, PRELOAD_MODULES
+from IMS_network import ConnectivityMonitor
+from IMS_outbox import OutboundQueue, QueueDrainer, KIND_TELEMETRY, KIND_IMAGE, write_atomic
 
 # 로깅 설정
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# 인터넷 연결 확인 함수
-def is_internet_connected():
-    try:
-        # 구글에 요청을 보내 인터넷 연결 확인
-        urllib.request.urlopen("http://www.google.com", timeout=1)
+UART_SCRIPT = '/usr/bin/ims/uart/IMS_uart.py'
+CAM_SCRIPT = '/usr/bin/ims/cam/IMS_cam.py'
+CAM_SOCKET_PATH = '/tmp/ims_cam.sock'  # 상주 카메라 서비스 소켓 (헬스 체크)
+UPLOAD_SCRIPT = '/usr/bin/ims/aws/IMS_upload.py'
+UPLOAD_SOCKET_PATH = '/tmp/ims_upload.sock'  # 상주 업로드 서비스 소켓
+FLEET_PROVISIONING_SCRIPT = '/usr/bin/ims/aws/IMS_fleet_provisioning.py'
+MQTT_SCRIPT = '/usr/bin/ims/aws/IMS_mqtt.py'
+
+# 오프라인 동안 보관할 텔레메트리/이미지 큐
+OUTBOX_DIR = '/usr/bin/ims/outbox'
+OUTBOX_MAX_BYTES = 256 * 1024 * 1024  # 세그먼트 + 이미지 합계 한도
+OUTBOX_MAX_AGE = 7 * 24 * 3600  # 이보다 오래된 레코드는 버림(초)
+OUTBOX_STATS_FILE = '/usr/bin/ims/outbox_stats.json'  # 큐 깊이/전달 속도 (None 이면 기록 안 함)
+OUTBOX_COLLECT_INTERVAL = 60  # 오프라인일 때 스냅샷/이미지 수집 주기(초)
+TELEMETRY_DIR = '/usr/bin/ims/uart/to_server'
+TELEMETRY_FILES = ('sensor1.json', 'sensor2.json', 'actuator.json', 'alarm.json', 'error.json')
+IMAGE_DIR = '/usr/bin/ims/aws/toS3'
+IMAGE_MIN_AGE = 5  # 기록 중인 파일을 옮기지 않도록, 이 시간(초) 이상 지난 파일만 수집
+PARTIAL_SUFFIXES = ('.tmp', '.part')  # 기록 중인 임시 파일 (IMS_cam 은 .part 로 쓴 뒤 이름을 바꿈)
+# 밀린 텔레메트리 묶음을 MQTT 발행 쪽에 넘기는 디렉토리. 발행 쪽은 telemetry_<순번>.json 을 발행한 뒤 삭제하고,
+# 삭제되어야 전달된 것으로 보고 큐에서 확인(ack) 함. 한 번에 한 묶음만 넘기므로 디렉토리는 커지지 않음
+TELEMETRY_BACKLOG_DIR = '/usr/bin/ims/aws/backlog'
+TELEMETRY_HANDOFF_TIMEOUT = 30  # 발행 쪽이 묶음 파일을 가져가기를 기다리는 시간(초), 넘으면 나중에 다시 시도
+TELEMETRY_HANDOFF_POLL = 0.5  # 묶음 파일이 삭제되었는지 확인하는 간격(초)
+DRAIN_BATCH_SIZE = 20  # 한 번에 전달하는 레코드 수
+DRAIN_RATE = 5.0  # 최대 전달 속도(레코드/초), 연결 직후 회선을 독점하지 않도록
+
+WORKER_COUNT = 3  # 동시에 실행하는 단발 작업 수 (촬영 작업이 업로드 작업을 요청하므로 2 이상)
+
+### 클라우드 서비스 ###
+class CloudServices:
+    """
+    인터넷 연결 상태에 따라 클라우드 서비스를 시작/중지합니다.
+    - 온라인: 플릿 프로비저닝(처음 한 번, 실패하면 다음 온라인 때 다시)이 끝나면 MQTT/업로드 서비스 시작
+    - 오프라인: MQTT/업로드 서비스 중지
+    """
+
+    def __init__(self, supervisor):
+        self.supervisor = supervisor
+        self.provisioned = False
+        self.starting = None
+
+    async def on_connectivity_change(self, online):
+        if online:
+            if self.starting is None or self.starting.done():
+                self.starting = self.supervisor.spawn(self.start())
+            return
+        if self.starting is not None:
+            self.starting.cancel()
+        await self.supervisor.remove('mqtt')
+        await self.supervisor.remove('upload')
+
+    async def start(self):
+        if not self.provisioned:
+            if await self.supervisor.run_task('fleet_provisioning') != 0:
+                logger.error("Fleet provisioning failed. MQTT process will not start.")
+                return
+            self.provisioned = True
+        # 플릿 프로비저닝이 완료되면 MQTT 실행
+        self.supervisor.add(Service('mqtt', ['python3', MQTT_SCRIPT]))
+        # S3 연결을 유지하는 상주 업로드 서비스 (촬영 후 알림을 받아 묶음으로 업로드)
+        self.supervisor.add(Service('upload', ['python3', UPLOAD_SCRIPT, '--serve'],
+                                    health_check=unix_socket_check(UPLOAD_SOCKET_PATH), health_interval=60))
+
+### 저장 후 전달 ###
+class Outbox:
+    """
+    오프라인 동안 텔레메트리 스냅샷과 촬영 이미지를 OutboundQueue 에 모으고,
+    연결되면 오래된 것부터 묶음 단위로 속도를 제한하여 전달합니다.
+    - 텔레메트리: TELEMETRY_BACKLOG_DIR 에 묶음 파일로 넘기고, MQTT 발행 쪽이 발행 후 삭제하면 확인
+      (가져가지 않으면 큐에 남아 OutboundQueue 의 크기/기간 한도를 따름)
+    - 이미지: toS3 로 되돌린 뒤 업로드 서비스(없으면 업로드 작업)가 모두 올렸다고 확인하면 확인
+    """
+
+    def __init__(self, supervisor, monitor):
+        self.supervisor = supervisor
+        self.monitor = monitor
+        self.queue = OutboundQueue(OUTBOX_DIR, OUTBOX_MAX_BYTES, OUTBOX_MAX_AGE)
+        self.drainer = QueueDrainer(self.queue, {KIND_TELEMETRY: self.send_telemetry, KIND_IMAGE: self.send_images},
+                                    DRAIN_BATCH_SIZE, DRAIN_RATE)
+        self.wakeup = asyncio.Event()
+        self.snapshot_mtimes = {}  # 파일명 -> 마지막으로 수집한 변경 시각
+
+    def on_connectivity_change(self, online):
+        self.wakeup.set()
+
+    def collect(self):
+        """바뀐 텔레메트리 파일과 toS3 의 이미지를 큐에 넣습니다."""
+        for file_name in TELEMETRY_FILES:
+            path = os.path.join(TELEMETRY_DIR, file_name)
+            try:
+                mtime = os.path.getmtime(path)
+                if self.snapshot_mtimes.get(file_name) == mtime:
+                    continue
+                with open(path, 'r') as f:
+                    self.queue.put_telemetry(file_name, json.load(f), mtime)
+                self.snapshot_mtimes[file_name] = mtime
+            except (OSError, ValueError) as e:
+                logger.warning(f"Cannot snapshot {path}: {e}")
+        try:
+            names = [name for name in os.listdir(IMAGE_DIR) if not name.endswith(PARTIAL_SUFFIXES)]
+        except OSError:
+            return
+        now = time.time()
+        paths = sorted((os.path.join(IMAGE_DIR, name) for name in names), key=os.path.getmtime)
+        for path in paths:
+            if os.path.isfile(path) and now - os.path.getmtime(path) >= IMAGE_MIN_AGE:
+                self.queue.put_image(path)
+
+    async def send_telemetry(self, items):
+        os.makedirs(TELEMETRY_BACKLOG_DIR, exist_ok=True)
+        batch = [dict(body, timestamp=record.timestamp) for record, body in items]
+        name = f"telemetry_{items[0][0].seq:012d}.json"
+        # 이전 시도에서 남은 다른 묶음은 지움 (그 레코드는 큐에 남아 있거나 이미 버려짐)
+        for stale in os.listdir(TELEMETRY_BACKLOG_DIR):
+            if stale != name and stale.startswith('telemetry_'):
+                os.remove(os.path.join(TELEMETRY_BACKLOG_DIR, stale))
+        path = os.path.join(TELEMETRY_BACKLOG_DIR, name)
+        write_atomic(path, json.dumps(batch).encode())
+        # 발행 쪽이 발행 후 삭제해야 전달된 것으로 봄
+        deadline = time.monotonic() + TELEMETRY_HANDOFF_TIMEOUT
+        while os.path.exists(path):
+            if time.monotonic() >= deadline:
+                logger.warning(f"Telemetry batch {name} not picked up by the MQTT publisher, keeping it queued")
+                return False
+            await asyncio.sleep(TELEMETRY_HANDOFF_POLL)
         return True
-    except urllib.request.URLError as e:
-        logger.warning(f"Internet connection error: {e}")
-        return False
+
+    async def send_images(self, items):
+        targets = []
+        for record, path in items:
+            target = os.path.join(IMAGE_DIR, os.path.basename(path).split('_', 1)[1])
+            try:
+                os.link(path, target)
+            except FileExistsError:
+                pass  # 이전 시도에서 이미 되돌림
+            targets.append(target)
+        try:
+            results = await self.request_upload(targets)
+            return bool(results) and all(results.values())
+        except (OSError, ValueError) as e:
+            logger.warning(f"Upload service unavailable ({e}), running upload task")
+        return await self.supervisor.run_task('upload', targets) == 0
+
+    async def request_upload(self, paths):
+        """상주 업로드 서비스에 파일 업로드를 요청하고 경로 -> 성공 여부를 반환합니다."""
+        reader, writer = await asyncio.open_unix_connection(UPLOAD_SOCKET_PATH)
+        try:
+            writer.write(json.dumps({"files": paths}).encode() + b"\n")
+            await writer.drain()
+            response = json.loads(await reader.readline() or b'{}')
+        finally:
+            writer.close()
+        if "results" not in response:
+            raise ValueError(response.get("error", "no response"))
+        return response["results"]
+
+    def export_stats(self):
+        if OUTBOX_STATS_FILE:
+            stats = {"online": self.monitor.online, **self.queue.stats(), **self.drainer.stats(),
+                     "updated": time.strftime("%Y-%m-%d %H:%M:%S")}
+            write_atomic(OUTBOX_STATS_FILE, json.dumps(stats, indent=4).encode())
+
+    async def run(self):
+        try:
+            while True:
+                self.wakeup.clear()
+                if self.monitor.online:
+                    if self.queue.records:
+                        logger.info(f"Draining outbound queue: {self.queue.stats()}")
+                        await self.drainer.drain(lambda: self.monitor.online)
+                        logger.info(f"Outbound queue drained: {self.drainer.stats()}")
+                else:
+                    self.collect()
+                self.export_stats()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), OUTBOX_COLLECT_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.queue.close()
+            logger.info(f"Outbound queue stats: {self.queue.stats()}")
+
+async def run():
+    supervisor = Supervisor(WorkerPool(PRELOAD_MODULES, WORKER_COUNT))
+    # 단발 작업은 cv2/numpy/boto3 를 미리 import 한 프로세스에서 fork 하여 실행
+    supervisor.register_task('cam', CAM_SCRIPT, timeout=300)
+    supervisor.register_task('upload', UPLOAD_SCRIPT, timeout=600)
+    supervisor.register_task('fleet_provisioning', FLEET_PROVISIONING_SCRIPT, timeout=300)
+    await supervisor.start()
+
+    supervisor.add(Service('uart', ['python3', UART_SCRIPT]))
+    # 상주 카메라 서비스 (카메라 장치와 cv2 를 유지하여 촬영마다 재시작하지 않음)
+    supervisor.add(Service('cam', ['python3', CAM_SCRIPT, '--serve'],
+                           health_check=unix_socket_check(CAM_SOCKET_PATH), health_interval=60))
+    # 인터넷 연결 상태가 바뀌는 즉시 프로비저닝/MQTT 를 시작하거나 멈춤
+    monitor = ConnectivityMonitor()
+    monitor.subscribe(CloudServices(supervisor).on_connectivity_change)
+    # 오프라인 동안 모은 텔레메트리/이미지는 연결되면 순서대로 전달
+    outbox = Outbox(supervisor, monitor)
+    monitor.subscribe(outbox.on_connectivity_change)
+    supervisor.spawn(monitor.run())
+    supervisor.spawn(outbox.run())
+    await supervisor.wait()
+    logger.info("All processes terminated.")
 
 def main():
-    # UART 실행
-    uart_process = subprocess.Popen(['python3', '/usr/bin/ims/uart/IMS_uart.py'])
-    logger.info("UART process started.")
-    
-    internet_connected = False
-    provisioning_process = None  # 초기화
-    mqtt_process = None  # 초기화
-
-    time.sleep(15)
-    while not internet_connected:
-        # 인터넷 연결 확인
-        if is_internet_connected():
-            logger.info("Internet connection established.")
-            internet_connected = True  # 연결이 되면 플래그를 True로 설정
-
-            # 플릿 프로비저닝 실행
-            provisioning_process = subprocess.Popen(['python3', '/usr/bin/ims/aws/IMS_fleet_provisioning.py'])
-            provisioning_process.wait()  # 플릿 프로비저닝이 완료될 때까지 대기
-
-            # 플릿 프로비저닝이 완료되면 MQTT 실행
-            if provisioning_process.returncode == 0:  # 0이면 성공적으로 완료됨
-                mqtt_process = subprocess.Popen(['python3', '/usr/bin/ims/aws/IMS_mqtt.py'])
-                logger.info("MQTT process started.")
-            else:
-                logger.error("Fleet provisioning failed. MQTT process will not start.")
-        else:
-            logger.info("No internet connection. Retrying in 30 seconds...")
-            time.sleep(30)  # 30초 대기
-
-    try:
-        # 모든 프로세스가 종료될 때까지 대기
-        while True:
-            if uart_process.poll() is not None:
-                logger.info("UART process has ended.")
-                break
-            time.sleep(1)  # CPU 사용량을 줄이기 위해 대기
-    except KeyboardInterrupt:
-        logger.info("Program interrupted by user.")
-    finally:
-        uart_process.terminate()  # UART 프로세스를 종료
-        if provisioning_process:
-            provisioning_process.terminate()  # 플릿 프로비저닝 프로세스를 종료
-        if mqtt_process:
-            mqtt_process.terminate()  # MQTT 프로세스를 종료
-        logger.info("All processes terminated.")
+    asyncio.run(run())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,107 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 프로토콜 상수
+START_CODE = 0xD1
+SET_INFO_RECEIVE = 0x40  # MCU -> 메인보드
+SET_INFO_SEND = 0x10     # 메인보드 -> MCU
+HEADER_LENGTH = 3        # Start Code, Set Info, Quantity
+FIELD_LENGTH = 4         # ID_ADDR(2) + VALUE(2)
+
+
+def calculate_checksum(data):
+    """체크섬 계산 (XOR 연산)"""
+    checksum = 0
+    for byte in data:
+        checksum ^= byte
+    return checksum
+
+
+def frame_length(quantity):
+    """Quantity 로부터 체크섬을 포함한 전체 프레임 길이를 계산합니다."""
+    return HEADER_LENGTH + quantity * FIELD_LENGTH + 1
+
+
+### 스트리밍 프레임 디코더 ###
+class FrameDecoder:
+    """
+    수신 바이트를 누적하면서 완성된 프레임을 잘라내는 디코더.
+    - 0xD1 Start Code 를 찾아 프레임 경계를 맞춤
+    - Set Info / XOR 체크섬 검증
+    - 검증 실패 시 Start Code 한 바이트만 버리고 다시 탐색(뒤따르는 정상 바이트는 보존)
+    """
+
+    def __init__(self, set_info=SET_INFO_RECEIVE):
+        self.set_info = set_info
+        self.buffer = bytearray()
+        self.counters = {
+            "frames": 0,          # 정상 프레임
+            "bad_header": 0,      # Set Info 불일치
+            "bad_checksum": 0,    # 체크섬 불일치
+            "short": 0,           # 수신 중단으로 잘린 프레임
+            "resynced": 0,        # Start Code 재탐색 횟수
+            "discarded_bytes": 0, # 프레임 밖에서 버려진 바이트
+        }
+
+    def _drop(self, count):
+        del self.buffer[:count]
+        self.counters["discarded_bytes"] += count
+
+    def _resync(self):
+        """현재 Start Code 를 버리고 다음 Start Code 위치로 이동합니다."""
+        self.counters["resynced"] += 1
+        self._drop(1)
+
+    def feed(self, data):
+        """수신 바이트를 추가하고 완성된 프레임(bytes) 목록을 반환합니다."""
+        self.buffer += data
+        frames = []
+        while self.buffer:
+            start = self.buffer.find(START_CODE)
+            if start < 0:
+                self._drop(len(self.buffer))
+                break
+            if start > 0:
+                logger.debug(f"Skipping {start} byte(s) before start code")
+                self._drop(start)
+
+            if len(self.buffer) < HEADER_LENGTH:
+                break
+            if self.buffer[1] != self.set_info:
+                logger.warning(f"Invalid Set Info: {self.buffer[1]:02X}. Resynchronising.")
+                self.counters["bad_header"] += 1
+                self._resync()
+                continue
+
+            length = frame_length(self.buffer[2])
+            if len(self.buffer) < length:
+                break
+
+            frame = bytes(self.buffer[:length])
+            calculated = calculate_checksum(frame[:-1])
+            if frame[-1] != calculated:
+                logger.error(f"Checksum error: Received {frame[-1]:02X}, Calculated {calculated:02X}.")
+                self.counters["bad_checksum"] += 1
+                self._resync()
+                continue
+
+            del self.buffer[:length]
+            self.counters["frames"] += 1
+            frames.append(frame)
+        return frames
+
+    def expire(self):
+        """
+        수신이 멈췄을 때(read 타임아웃) 호출합니다.
+        미완성 프레임은 잘린 것으로 보고 Start Code 를 버린 뒤 남은 바이트를 다시 검사합니다.
+        """
+        if not self.buffer:
+            return []
+        logger.warning(f"Short frame: {len(self.buffer)} byte(s) pending after timeout")
+        self.counters["short"] += 1
+        frames = []
+        while self.buffer:
+            self._resync()
+            frames += self.feed(b"")
+        return frames
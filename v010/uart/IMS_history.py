@@ -0,0 +1,171 @@
+import mmap
+import os
+import struct
+import sys
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DIR = '/usr/bin/ims/uart/history'
+MAPPING_TABLE_FILE = '/usr/bin/ims/uart/mapping_table.json'
+
+# 해상도(초) -> 보관 칸 수: 1분 단위 24시간, 1시간 단위 30일
+RESOLUTIONS = {60: 1440, 3600: 720}
+
+MAGIC = b'IMSH'
+VERSION = 1
+HEADER = struct.Struct('<4sHHII')  # magic, version, 레지스터 수, 해상도, 칸 수
+SLOT = struct.Struct('<IIHHI')     # bucket 번호, 개수, 최소, 최대, 합계
+
+
+def _align(size, alignment=16):
+    return (size + alignment - 1) // alignment * alignment
+
+
+### 링 버퍼 파일 ###
+class RingFile:
+    """
+    레지스터별 고정 크기 링 버퍼를 하나의 mmap 파일에 담습니다.
+    칸 하나는 한 구간(bucket = epoch // 해상도)의 최소/최대/합계/개수이며, 재시작 후에도 유지됩니다.
+    """
+
+    def __init__(self, path, registers, resolution, slots, create=True):
+        self.path = path
+        self.registers = list(registers)
+        self.index = {register: i for i, register in enumerate(self.registers)}
+        self.resolution = resolution
+        self.slots = slots
+        self.samples = 0  # 이번 실행에서 반영한 값 수
+        self.data_offset = _align(HEADER.size + 2 * len(self.registers))
+        size = self.data_offset + len(self.registers) * slots * SLOT.size
+
+        header = self._header()
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            existing = os.pread(fd, self.data_offset, 0)
+            if existing != header or os.fstat(fd).st_size != size:
+                if not create:
+                    raise ValueError(f"History file {path} does not match the current register layout")
+                if existing:
+                    logger.warning(f"History layout changed for {path}, starting a new history")
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.pwrite(fd, header, 0)
+            self.mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def _header(self):
+        header = HEADER.pack(MAGIC, VERSION, len(self.registers), self.resolution, self.slots)
+        header += struct.pack(f'<{len(self.registers)}H', *self.registers)
+        return header.ljust(self.data_offset, b'\0')
+
+    def _slot_offset(self, register_index, bucket):
+        return self.data_offset + (register_index * self.slots + bucket % self.slots) * SLOT.size
+
+    def add(self, register, value, timestamp):
+        register_index = self.index.get(register)
+        if register_index is None:
+            return
+        self.samples += 1
+        bucket = int(timestamp) // self.resolution
+        offset = self._slot_offset(register_index, bucket)
+        slot_bucket, count, minimum, maximum, total = SLOT.unpack_from(self.mm, offset)
+        if slot_bucket != bucket or count == 0:
+            SLOT.pack_into(self.mm, offset, bucket, 1, value, value, value)
+        else:
+            SLOT.pack_into(self.mm, offset, bucket, count + 1, min(minimum, value), max(maximum, value),
+                           min(total + value, 0xFFFFFFFF))
+
+    def query(self, register, start, end):
+        """[start, end) 구간의 (시각, 최소, 최대, 평균) numpy 배열을 시간순으로 반환합니다."""
+        import numpy as np  # 조회할 때만 필요
+
+        dtype = np.dtype([('bucket', '<u4'), ('count', '<u4'), ('min', '<u2'), ('max', '<u2'), ('sum', '<u4')])
+        register_index = self.index.get(register)
+        if register_index is None:
+            empty = np.empty(0)
+            return empty, empty, empty, empty
+        ring = np.frombuffer(self.mm, dtype=dtype, count=self.slots,
+                             offset=self.data_offset + register_index * self.slots * SLOT.size)
+        first, last = int(start) // self.resolution, int(end) // self.resolution
+        selected = ring[(ring['count'] > 0) & (ring['bucket'] >= first) & (ring['bucket'] < last)]
+        selected = np.sort(selected, order='bucket')
+        times = selected['bucket'].astype(np.int64) * self.resolution
+        averages = selected['sum'] / selected['count']
+        return times, selected['min'].copy(), selected['max'].copy(), averages
+
+    def close(self):
+        self.mm.flush()
+        self.mm.close()
+
+
+### 센서 이력 ###
+class SensorHistory:
+    """UART 로 받은 센서 레지스터 값을 1분/1시간 단위로 요약하여 보관합니다."""
+
+    def __init__(self, directory, registers, resolutions=None, create=True):
+        os.makedirs(directory, exist_ok=True)
+        self.registers = sorted(set(registers))
+        self.rings = {
+            resolution: RingFile(os.path.join(directory, f"history_{resolution}s.dat"),
+                                 self.registers, resolution, slots, create)
+            for resolution, slots in (resolutions or RESOLUTIONS).items()
+        }
+
+    def record(self, fields, timestamp=None):
+        """(레지스터, 값) 목록을 모든 해상도의 링에 반영합니다."""
+        timestamp = time.time() if timestamp is None else timestamp
+        fields = list(fields)  # iter_fields 는 한 번만 순회되므로 링마다 다시 쓸 수 있게 복사
+        for ring in self.rings.values():
+            for register, value in fields:
+                ring.add(register, value, timestamp)
+
+    def query(self, register, start=None, end=None, resolution=60):
+        """레지스터의 구간 요약을 (시각, 최소, 최대, 평균) numpy 배열로 반환합니다."""
+        end = time.time() if end is None else end
+        if start is None:
+            start = end - RESOLUTIONS.get(resolution, 1440) * resolution
+        return self.rings[resolution].query(register, start, end + resolution)
+
+    def samples(self):
+        """해상도별로 이번 실행에서 반영한 값 수. 모든 링이 같은 값을 받으므로 수가 같아야 합니다."""
+        return {resolution: ring.samples for resolution, ring in self.rings.items()}
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+
+
+def history_registers(mapping_table, files):
+    """매핑 테이블에서 지정한 파일(sensor1.json 등)에 저장되는 레지스터 번호를 모읍니다."""
+    return [int(id_addr, 16) for id_addr, mapping in mapping_table.items() if mapping.get("file") in files]
+
+
+if __name__ == "__main__":
+    # 사용법: python3 IMS_history.py <key> [hours] [resolution초]
+    import json
+
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2:
+        print("Usage: IMS_history.py <key> [hours] [resolution_seconds]")
+        sys.exit(1)
+    key = sys.argv[1]
+    hours = float(sys.argv[2]) if len(sys.argv) > 2 else 1
+    resolution = int(sys.argv[3]) if len(sys.argv) > 3 else 60
+
+    with open(MAPPING_TABLE_FILE, 'r') as file:
+        mapping_table = json.load(file)
+    registers = {mapping["key"]: int(id_addr, 16) for id_addr, mapping in mapping_table.items()}
+    if key not in registers:
+        print(f"Unknown key: {key}")
+        sys.exit(1)
+    # 조회만 하므로 레이아웃이 다르면 새로 만들지 않고 오류로 처리
+    history = SensorHistory(HISTORY_DIR, history_registers(mapping_table, ("sensor1.json", "sensor2.json")),
+                            create=False)
+    times, minimums, maximums, averages = history.query(registers[key], time.time() - hours * 3600,
+                                                        resolution=resolution)
+    for t, lo, hi, avg in zip(times, minimums, maximums, averages):
+        print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(t))}  min={lo}  max={hi}  avg={avg:.1f}")
+    history.close()
@@ -0,0 +1,196 @@
+import asyncio
+import heapq
+import itertools
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 우선순위 (작을수록 먼저)
+PRIORITY_REQUEST = 0    # 서버 request.json 요청 촬영
+PRIORITY_SCHEDULED = 1  # 스케줄 촬영
+
+PRIORITY_NAMES = {PRIORITY_REQUEST: "request", PRIORITY_SCHEDULED: "scheduled"}
+
+MAX_IDLE_WAIT = 60  # 다음 스케줄까지 한 번에 기다리는 최대 시간(초)
+
+
+class CaptureJob:
+    """방 하나의 촬영 작업. 같은 방의 작업은 하나로 합쳐집니다."""
+
+    def __init__(self, room, priority, enqueued_at):
+        self.room = room
+        self.priority = priority
+        self.enqueued_at = enqueued_at  # time.time() (request.json 이면 파일 기록 시각)
+        self.generation = 0  # 우선순위가 바뀌면 증가, 힙의 오래된 항목을 무시하는 데 사용
+        self.coalesced = 0
+
+
+### 촬영 작업 큐 ###
+class CaptureQueue:
+    """
+    asyncio 이벤트 루프에서 동작하는 촬영 작업 큐.
+    - 우선순위 힙: 요청 촬영이 대기 중인 스케줄 촬영보다 먼저 실행 (진행 중인 촬영은 끝까지 진행)
+    - 같은 방의 대기 작업은 하나로 합치고, 더 높은 우선순위와 더 이른 대기 시작 시각을 유지
+      (대기 작업은 방마다 최대 하나이므로 큐 깊이는 방 수를 넘지 않음)
+    - 반복 작업은 실행 시각 힙에 두고, 실행 시점에 스케줄의 다음 시각으로 다시 예약
+    - 같은 우선순위로 대기 중인 방들은 한 번에 실행 (LED 대기 시간 공유)
+    run_job(rooms, priority) 는 촬영을 수행하는 코루틴 함수입니다.
+    """
+
+    def __init__(self, run_job, on_stats=None):
+        self.run_job = run_job
+        self.on_stats = on_stats  # 작업이 끝날 때마다 stats() 를 전달받는 콜백 (예: 파일로 내보내기)
+        self.pending = {}  # 방 번호 -> CaptureJob
+        self.ready = []  # (우선순위, 순번, 세대, 방 번호)
+        self.recurring = []  # (실행 시각 time.time(), 순번, 방 번호, CaptureSchedule)
+        self.sequence = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.running = None  # 실행 중인 방 목록
+        self.counters = {"submitted": 0, "coalesced": 0, "completed": 0, "failed": 0}
+        self.wait_ms = {name: {"last": 0.0, "max": 0.0, "total": 0.0, "count": 0} for name in PRIORITY_NAMES.values()}
+        self.max_depth_seen = 0
+
+    ### 작업 추가 ###
+    def submit(self, rooms, priority, enqueued_at=None):
+        """방 목록을 작업으로 추가합니다. 추가(또는 합쳐진) 방 수를 반환합니다."""
+        enqueued_at = time.time() if enqueued_at is None else enqueued_at
+        accepted = 0
+        for room in rooms:
+            self.counters["submitted"] += 1
+            job = self.pending.get(room)
+            if job is not None:
+                # 이미 대기 중인 방: 하나로 합침
+                job.coalesced += 1
+                self.counters["coalesced"] += 1
+                job.enqueued_at = min(job.enqueued_at, enqueued_at)
+                if priority < job.priority:
+                    job.priority = priority
+                    job.generation += 1
+                    self._push(job)
+                logger.info(f"Coalesced {PRIORITY_NAMES[priority]} capture for Room {room} into pending job")
+                accepted += 1
+                continue
+            job = CaptureJob(room, priority, enqueued_at)
+            self.pending[room] = job
+            self._push(job)
+            accepted += 1
+        self.max_depth_seen = max(self.max_depth_seen, len(self.pending))
+        if accepted:
+            self.wakeup.set()
+        return accepted
+
+    def _push(self, job):
+        heapq.heappush(self.ready, (job.priority, next(self.sequence), job.generation, job.room))
+
+    def schedule(self, room, schedule):
+        """
+        schedule(IMS_schedule.CaptureSchedule) 에 따라 스케줄 촬영을 반복합니다.
+        같은 방의 기존 스케줄은 교체합니다. 다음 실행 시각이 없으면 False.
+        """
+        self.unschedule(room)
+        due = schedule.next_after(time.time())
+        if due is None:
+            logger.warning(f"Capture schedule for Room {room} never fires: {schedule.describe()}")
+            return False
+        heapq.heappush(self.recurring, (due, next(self.sequence), room, schedule))
+        self.wakeup.set()
+        return True
+
+    def unschedule(self, room=None):
+        """방(또는 전체)의 반복 스케줄을 제거합니다. 이미 대기 중인 작업은 그대로 둡니다."""
+        self.recurring = [entry for entry in self.recurring if room is not None and entry[2] != room]
+        heapq.heapify(self.recurring)
+
+    def schedule_for(self, room):
+        """방에 설정된 스케줄 (없으면 None)."""
+        for entry in self.recurring:
+            if entry[2] == room:
+                return entry[3]
+        return None
+
+    def _fire_due(self, now):
+        """실행 시각이 된 반복 작업을 큐에 넣고 다음 실행을 예약합니다."""
+        while self.recurring and self.recurring[0][0] <= now:
+            due, _, room, schedule = heapq.heappop(self.recurring)
+            self.submit([room], PRIORITY_SCHEDULED)
+            # 밀린 실행은 건너뛰고 현재 시각 이후로 재예약
+            due = schedule.next_after(now)
+            if due is not None:
+                heapq.heappush(self.recurring, (due, next(self.sequence), room, schedule))
+
+    def _pop_batch(self):
+        """가장 높은 우선순위의 대기 작업들을 꺼냅니다."""
+        batch = []
+        while self.ready:
+            priority, _, generation, room = self.ready[0]
+            job = self.pending.get(room)
+            if job is None or job.generation != generation:
+                heapq.heappop(self.ready)  # 합쳐지거나 버려진 항목
+                continue
+            if batch and priority != batch[0].priority:
+                break
+            heapq.heappop(self.ready)
+            batch.append(self.pending.pop(room))
+        return batch
+
+    ### 실행 ###
+    async def run(self):
+        """작업을 하나씩(같은 우선순위 묶음 단위로) 실행합니다. 취소될 때까지 동작합니다."""
+        while True:
+            self._fire_due(time.time())
+            batch = self._pop_batch()
+            if not batch:
+                self.wakeup.clear()
+                # 벽시계 기준이므로 시각이 바뀌어도(NTP) 너무 오래 잠들지 않도록 제한
+                timeout = min(self.recurring[0][0] - time.time(), MAX_IDLE_WAIT) if self.recurring else None
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run_batch(batch)
+
+    async def _run_batch(self, batch):
+        priority = batch[0].priority
+        rooms = sorted(job.room for job in batch)
+        now = time.time()
+        wait = self.wait_ms[PRIORITY_NAMES[priority]]
+        for job in batch:
+            waited = (now - job.enqueued_at) * 1000
+            wait["last"] = waited
+            wait["max"] = max(wait["max"], waited)
+            wait["total"] += waited
+            wait["count"] += 1
+        logger.info(f"Running {PRIORITY_NAMES[priority]} capture for rooms {rooms}, "
+                    f"waited {wait['last']:.0f} ms, {len(self.pending)} job(s) still queued")
+        self.running = rooms
+        try:
+            ok = await self.run_job(rooms, priority)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Capture job for rooms {rooms} failed: {e}")
+            ok = False
+        finally:
+            self.running = None
+        self.counters["completed" if ok is not False else "failed"] += 1
+        if self.on_stats is not None:
+            try:
+                self.on_stats(self.stats())
+            except Exception as e:
+                logger.error(f"Failed to export capture queue stats: {e}")
+
+    def stats(self):
+        """큐 깊이, 대기 시간(ms), 카운터를 반환합니다."""
+        return {
+            "depth": len(self.pending),
+            "max_depth": self.max_depth_seen,
+            "running": self.running,
+            "next_scheduled_in": round(self.recurring[0][0] - time.time(), 1) if self.recurring else None,
+            "wait_ms": {name: {"last": round(wait["last"], 1), "max": round(wait["max"], 1),
+                               "avg": round(wait["total"] / wait["count"], 1) if wait["count"] else 0.0}
+                        for name, wait in self.wait_ms.items()},
+            **self.counters,
+            "updated": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
@@ -0,0 +1,123 @@
+import os
+import struct
+import threading
+import time
+import zlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 레코드: 길이(4) + CRC32(4) + 수신 시각(8, epoch 초) + 원본 프레임
+RECORD_HEADER = struct.Struct('<IId')
+MAX_RECORD_LENGTH = 0x10000
+
+# fsync 정책
+FSYNC_ALWAYS = 'always'  # 프레임마다 기록 + fsync
+FSYNC_BATCH = 'batch'    # 묶어서 기록 후 한 번 fsync (그룹 커밋)
+FSYNC_NEVER = 'never'    # 묶어서 기록, fsync 는 OS 에 맡김
+
+
+def encode_record(timestamp, frame):
+    body = struct.pack('<d', timestamp) + frame
+    return struct.pack('<II', len(frame), zlib.crc32(body)) + body
+
+
+def read_records(path):
+    """
+    저널 파일의 (수신 시각, 프레임) 을 순서대로 반환하고, 마지막 정상 레코드 끝 위치를 함께 돌려줍니다.
+    전원 차단 등으로 잘리거나 손상된 꼬리는 그 위치에서 읽기를 멈춥니다.
+    """
+    records = []
+    valid_length = 0
+    try:
+        with open(path, 'rb') as journal_file:
+            data = journal_file.read()
+    except FileNotFoundError:
+        return records, 0
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        length, crc, timestamp = RECORD_HEADER.unpack_from(data, offset)
+        end = offset + RECORD_HEADER.size + length
+        if length > MAX_RECORD_LENGTH or end > len(data):
+            break
+        if zlib.crc32(data[offset + 8:end]) != crc:
+            break
+        records.append((timestamp, data[offset + RECORD_HEADER.size:end]))
+        offset = valid_length = end
+    if valid_length < len(data):
+        logger.warning(f"Ignoring {len(data) - valid_length} byte(s) of torn journal tail in {path}")
+    return records, valid_length
+
+
+### 텔레메트리 저널 ###
+class TelemetryJournal:
+    """
+    수신 프레임을 시각과 함께 추가 전용 파일에 기록하는 저널.
+    - append 는 메모리에 모으고, commit 이 한 번의 write(+fsync)로 기록 (그룹 커밋)
+    - compact 는 JSON 스냅샷이 디스크에 기록된 뒤 호출하여 저널을 비움
+    """
+
+    def __init__(self, path, fsync_policy=FSYNC_BATCH, commit_interval=1.0, max_batch=64):
+        if fsync_policy not in (FSYNC_ALWAYS, FSYNC_BATCH, FSYNC_NEVER):
+            raise ValueError(f"Unknown fsync policy: {fsync_policy}")
+        self.path = path
+        self.fsync_policy = fsync_policy
+        self.commit_interval = commit_interval  # 그룹 커밋 최대 지연(초)
+        self.max_batch = max_batch
+        self.pending = []
+        self.lock = threading.Lock()
+        self.fd = None
+        self.stats = {"records": 0, "commits": 0, "fsyncs": 0, "bytes": 0, "compactions": 0}
+
+    def open(self):
+        """저널을 열고 기존 레코드를 반환합니다. 손상된 꼬리는 잘라냅니다."""
+        records, valid_length = read_records(self.path)
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        if os.fstat(self.fd).st_size != valid_length:
+            os.ftruncate(self.fd, valid_length)
+        logger.info(f"Telemetry journal {self.path} opened with {len(records)} record(s) to replay")
+        return records
+
+    def append(self, frame, timestamp=None):
+        """프레임을 저널에 추가합니다. 즉시 기록해야 하면 True 를 반환합니다."""
+        record = encode_record(time.time() if timestamp is None else timestamp, frame)
+        with self.lock:
+            self.pending.append(record)
+            due = self.fsync_policy == FSYNC_ALWAYS or len(self.pending) >= self.max_batch
+        if due:
+            self.commit()
+        return due
+
+    def commit(self):
+        """모아 둔 레코드를 한 번에 기록합니다."""
+        with self.lock:
+            if not self.pending or self.fd is None:
+                return
+            data = b''.join(self.pending)
+            os.write(self.fd, data)
+            if self.fsync_policy != FSYNC_NEVER:
+                os.fsync(self.fd)
+                self.stats["fsyncs"] += 1
+            self.stats["records"] += len(self.pending)
+            self.stats["commits"] += 1
+            self.stats["bytes"] += len(data)
+            self.pending = []
+
+    def compact(self):
+        """
+        JSON 스냅샷이 모든 레코드를 반영한 뒤 호출합니다.
+        아직 기록하지 않은 레코드도 스냅샷에 이미 반영되었으므로 함께 버립니다.
+        """
+        with self.lock:
+            if self.fd is None:
+                return
+            self.pending = []
+            os.ftruncate(self.fd, 0)
+            self.stats["compactions"] += 1
+
+    def close(self):
+        self.commit()
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
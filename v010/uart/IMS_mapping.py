@@ -0,0 +1,141 @@
+import json
+import os
+import struct
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+REGISTER_COUNT = 0x10000  # ID_ADDR 는 2바이트
+FIELD_STRUCT = struct.Struct('>HH')  # ID_ADDR, VALUE (빅엔디안)
+
+
+### 매핑 테이블 컴파일 ###
+def compile_mapping_table(mapping_table):
+    """
+    "00AB" 형태의 문자열 키를 가진 매핑 테이블을 65536 칸 배열로 변환합니다.
+    각 칸에는 (파일명, 키) 튜플이 들어가며, 매핑이 없으면 None 입니다.
+    """
+    dispatch = [None] * REGISTER_COUNT
+    for id_addr, mapping in mapping_table.items():
+        try:
+            register = int(id_addr, 16)
+        except ValueError:
+            logger.warning(f"Ignoring invalid ID_ADDR {id_addr!r} in mapping table")
+            continue
+        if not 0 <= register < REGISTER_COUNT:
+            logger.warning(f"Ignoring out-of-range ID_ADDR {id_addr!r} in mapping table")
+            continue
+        key = mapping.get("key")
+        file_name = mapping.get("file")
+        if not key or not file_name:
+            logger.warning(f"Ignoring incomplete mapping for ID_ADDR {id_addr}")
+            continue
+        dispatch[register] = (file_name, key)
+    return dispatch
+
+
+def compile_send_mapping_table(send_mapping_table):
+    """송신 매핑 테이블을 레지스터 순으로 정렬된 (레지스터 번호, 키) 목록으로 변환합니다."""
+    return sorted((int(address, 16), mapping["key"]) for address, mapping in send_mapping_table.items())
+
+
+def validate_mapping_table(mapping_table, name):
+    """매핑 테이블 형식을 검사합니다. 문제가 있으면 ValueError 를 발생시킵니다."""
+    if not isinstance(mapping_table, dict) or not mapping_table:
+        raise ValueError(f"{name}: mapping table must be a non-empty object")
+    seen = {}
+    for id_addr, mapping in mapping_table.items():
+        try:
+            register = int(id_addr, 16)
+        except ValueError:
+            raise ValueError(f"{name}: invalid ID_ADDR {id_addr!r}")
+        if not 0 <= register < REGISTER_COUNT or len(id_addr) != 4:
+            raise ValueError(f"{name}: ID_ADDR {id_addr!r} must be 4 hex digits")
+        if not isinstance(mapping, dict) or not mapping.get("key") or not mapping.get("file"):
+            raise ValueError(f"{name}: ID_ADDR {id_addr} needs both 'key' and 'file'")
+        if register in seen:
+            raise ValueError(f"{name}: ID_ADDR {id_addr} duplicates {seen[register]}")
+        seen[register] = id_addr
+
+
+def load_mapping_file(mapping_file):
+    """매핑 테이블 파일을 읽고 검증합니다. 실패하면 예외를 발생시킵니다."""
+    with open(mapping_file, 'r') as file:
+        mapping_table = json.load(file)
+    validate_mapping_table(mapping_table, os.path.basename(mapping_file))
+    return mapping_table
+
+
+### 매핑 테이블 핫 리로드 ###
+class MappingTables:
+    """
+    수신/송신 매핑 테이블을 함께 보관합니다.
+    reload() 는 두 파일을 모두 읽고 검증한 뒤에만 참조를 한 번에 교체하므로,
+    수신 처리는 항상 완전한 테이블 한 쌍만 보게 됩니다 (읽기와 교체 모두 이벤트 루프에서 실행).
+    """
+
+    def __init__(self, receive_file, send_file):
+        self.receive_file = receive_file
+        self.send_file = send_file
+        self.tables = ([None] * REGISTER_COUNT, [])  # (수신 dispatch, 송신 (레지스터, 키) 목록)
+        self.reload_count = 0
+
+    @property
+    def receive(self):
+        return self.tables[0]
+
+    @property
+    def send(self):
+        return self.tables[1]
+
+    def reload(self, changed_at=None):
+        """
+        매핑 테이블을 다시 읽어 교체합니다. 성공하면 True.
+        changed_at 에 파일 변경 시각(time.time())을 주면 변경부터 교체까지의 지연을 기록합니다.
+        """
+        started = time.monotonic()
+        try:
+            receive_table = load_mapping_file(self.receive_file)
+            send_table = load_mapping_file(self.send_file)
+        except (OSError, ValueError) as e:
+            # json.JSONDecodeError 도 ValueError 의 하위 클래스
+            logger.error(f"Mapping table reload rejected, keeping previous tables: {e}")
+            return False
+        self.tables = (compile_mapping_table(receive_table), compile_send_mapping_table(send_table))
+        self.reload_count += 1
+        elapsed_ms = (time.monotonic() - started) * 1000
+        message = f"Mapping tables loaded ({len(receive_table)} receive, {len(send_table)} send) in {elapsed_ms:.1f} ms"
+        if changed_at is not None:
+            message += f", {(time.time() - changed_at) * 1000:.1f} ms after file change"
+        logger.info(message)
+        return True
+
+    def on_files_changed(self, names):
+        """DirectoryWatcher 콜백: 변경된 매핑 파일의 mtime 을 기준으로 리로드합니다. 성공하면 True."""
+        paths = [os.path.join(os.path.dirname(self.receive_file), name) for name in names]
+        mtimes = [os.path.getmtime(path) for path in paths if os.path.exists(path)]
+        return self.reload(changed_at=max(mtimes) if mtimes else None)
+
+
+### 프레임 필드 디코딩 ###
+def iter_fields(frame):
+    """검증된 프레임에서 (ID_ADDR, VALUE) 정수 쌍을 순회합니다."""
+    quantity = frame[2]
+    return FIELD_STRUCT.iter_unpack(memoryview(frame)[3:3 + quantity * FIELD_STRUCT.size])
+
+
+def resolve_fields(frame, dispatch):
+    """
+    프레임을 한 번에 디코딩하여 저장소 반영용 (파일명, 키, 값) 목록과
+    매핑이 없는 ID_ADDR 목록을 반환합니다.
+    """
+    updates = []
+    unmapped = []
+    for register, value in iter_fields(frame):
+        target = dispatch[register]
+        if target is None:
+            unmapped.append(register)
+        else:
+            updates.append((target[0], target[1], value))
+    return updates, unmapped
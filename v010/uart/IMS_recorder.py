@@ -0,0 +1,200 @@
+import ast
+import os
+import struct
+import sys
+import threading
+import time
+import logging
+
+from IMS_frame import FrameDecoder, SET_INFO_SEND
+
+logger = logging.getLogger(__name__)
+
+# 파일 헤더: 매직, 버전, 예약, 녹화 시작 시각(time.time()), 시작 monotonic
+FILE_MAGIC = b'IMSL'
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct('<4sHHdd')
+# 레코드 헤더: 시작 후 경과 시간(us), 방향, 길이
+RECORD_HEADER = struct.Struct('<QBI')
+
+RX = 0  # MCU -> 메인보드
+TX = 1  # 메인보드 -> MCU
+DIRECTION_NAMES = {RX: "RX", TX: "TX"}
+
+RECORD_FLUSH_INTERVAL = 1.0  # 기록할 때 마지막 flush 후 이 시간(초)이 지났으면 파일로 내보냄
+FRAME_TIMEOUT = 1  # IMS_uart.TIMEOUT 과 같게: 녹화 간격이 이보다 길면 미완성 프레임을 정리
+
+
+### 녹화 ###
+class LinkRecorder:
+    """
+    MCU 링크의 원시 RX/TX 바이트를 monotonic 시각과 함께 바이너리 파일에 기록합니다.
+    - 버퍼에 모아 RECORD_FLUSH_INTERVAL 간격으로 내보냄 (fsync 하지 않음, 진단용)
+    - max_bytes 를 넘으면 <파일>.1 로 교체하고 새 파일에 이어서 기록 (최근 두 파일 유지)
+    - 시작할 때 이전 녹화가 있으면 먼저 <파일>.1 로 옮김 (재시작 직전, 예를 들어 장애를 일으킨 트래픽 보존)
+    """
+
+    def __init__(self, path, max_bytes=16 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.file = None
+        self.started = None
+        self.last_flush = 0.0
+        self.counters = {"rx_bytes": 0, "tx_bytes": 0, "records": 0, "rotations": 0}
+        if os.path.exists(path) and os.path.getsize(path) > FILE_HEADER.size:
+            os.replace(path, f"{path}.1")
+            logger.info(f"Kept previous link capture as {path}.1")
+        self._open()
+
+    def _open(self):
+        self.file = open(self.path, 'wb')
+        self.started = time.monotonic()
+        self.file.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, 0, time.time(), self.started))
+        self.last_flush = self.started
+
+    def _rotate(self):
+        self.file.close()
+        os.replace(self.path, f"{self.path}.1")
+        self.counters["rotations"] += 1
+        self._open()
+
+    def record(self, direction, data):
+        if not data:
+            return
+        with self.lock:
+            if self.file is None:
+                return
+            if self.file.tell() >= self.max_bytes:
+                self._rotate()
+            now = time.monotonic()
+            self.file.write(RECORD_HEADER.pack(int((now - self.started) * 1e6), direction, len(data)) + bytes(data))
+            self.counters["rx_bytes" if direction == RX else "tx_bytes"] += len(data)
+            self.counters["records"] += 1
+            if now - self.last_flush >= RECORD_FLUSH_INTERVAL:
+                self.file.flush()
+                self.last_flush = now
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+### 읽기 ###
+def read_capture(path):
+    """녹화 파일에서 (녹화 시작 후 경과 초, 방향, 바이트) 를 순서대로 읽습니다. 끝이 잘린 레코드는 무시합니다."""
+    with open(path, 'rb') as f:
+        header = f.read(FILE_HEADER.size)
+        if len(header) < FILE_HEADER.size:
+            raise ValueError(f"{path} is too short to be a link capture")
+        magic, version, _, _, _ = FILE_HEADER.unpack(header)
+        if magic != FILE_MAGIC or version != FILE_VERSION:
+            raise ValueError(f"{path} is not a link capture (magic {magic!r}, version {version})")
+        while True:
+            head = f.read(RECORD_HEADER.size)
+            if len(head) < RECORD_HEADER.size:
+                return
+            elapsed_us, direction, length = RECORD_HEADER.unpack(head)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            yield elapsed_us / 1e6, direction, data
+
+
+def is_capture_file(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(FILE_MAGIC)) == FILE_MAGIC
+    except OSError:
+        return False
+
+
+def import_log(log_path, capture_path, interval=0.1):
+    """
+    DEBUG 로그의 "Received raw data: b'...'" 줄을 녹화 파일로 변환합니다 (old/Seiral.txt 형식).
+    로그에는 시각이 없으므로 interval 초 간격으로 기록합니다.
+    """
+    count = 0
+    with open(log_path, 'r', errors='replace') as log, open(capture_path, 'wb') as out:
+        out.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, 0, time.time(), 0.0))
+        for line in log:
+            _, marker, literal = line.partition("Received raw data: ")
+            if not marker:
+                continue
+            try:
+                data = ast.literal_eval(literal.strip())
+            except (ValueError, SyntaxError):
+                continue
+            if isinstance(data, bytes) and data:
+                out.write(RECORD_HEADER.pack(int(count * interval * 1e6), RX, len(data)) + data)
+                count += 1
+    return count
+
+
+### 재생 ###
+def replay(path, speed=0.0, on_frames=None, direction=RX, timeout=FRAME_TIMEOUT):
+    """
+    녹화된 바이트를 디코더에 다시 넣습니다.
+    speed 는 재생 배속 (1 = 원래 속도, 10 = 10배, 0 = 대기 없이 최대 속도).
+    on_frames(프레임 목록) 가 있으면 디코딩된 프레임마다 호출합니다. 통계를 반환합니다.
+    녹화 간격이 timeout 보다 길면 IMS_uart 처럼 미완성 프레임을 정리하므로 배속과 관계없이 결과가 같습니다.
+    """
+    decoder = FrameDecoder() if direction == RX else FrameDecoder(set_info=SET_INFO_SEND)
+    frames = 0
+    total_bytes = 0
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    previous = None
+    for elapsed, record_direction, data in read_capture(path):
+        if record_direction != direction:
+            continue
+        if speed > 0:
+            delay = elapsed / speed - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+        decoded = []
+        if previous is not None and elapsed - previous >= timeout and decoder.buffer:
+            decoded += decoder.expire()
+        previous = elapsed
+        decoded += decoder.feed(data)
+        total_bytes += len(data)
+        frames += len(decoded)
+        if decoded and on_frames is not None:
+            on_frames(decoded)
+    frames += len(decoder.expire())
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    return {
+        "frames": frames,
+        "bytes": total_bytes,
+        "seconds": round(wall, 3),
+        "frames_per_s": round(frames / wall, 1) if wall else 0.0,
+        "cpu_us_per_frame": round(cpu / frames * 1e6, 2) if frames else None,
+        "counters": decoder.counters,
+    }
+
+
+def dump(path):
+    for elapsed, direction, data in read_capture(path):
+        print(f"{elapsed:12.6f} {DIRECTION_NAMES.get(direction, direction)} {data.hex(' ').upper()}")
+
+
+if __name__ == "__main__":
+    # IMS_recorder.py dump <녹화 파일>
+    # IMS_recorder.py replay <녹화 파일> [배속] [rx|tx]   (배속 0 = 최대 속도)
+    # IMS_recorder.py import-log <로그 파일> <녹화 파일>
+    logging.basicConfig(level=logging.WARNING)
+    command, args = (sys.argv[1], sys.argv[2:]) if len(sys.argv) > 1 else (None, [])
+    if command == "dump" and len(args) == 1:
+        dump(args[0])
+    elif command == "replay" and 1 <= len(args) <= 3:
+        speed = float(args[1]) if len(args) > 1 else 0.0
+        direction = TX if len(args) > 2 and args[2].lower() == "tx" else RX
+        print(replay(args[0], speed, direction=direction))
+    elif command == "import-log" and len(args) == 2:
+        print(f"Imported {import_log(args[0], args[1])} RX record(s) into {args[1]}")
+    else:
+        print(f"Usage: {sys.argv[0]} dump <capture> | replay <capture> [speed] [rx|tx] | import-log <log> <capture>")
+        sys.exit(2)
@@ -0,0 +1,213 @@
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+# cron 필드 범위: 분, 시, 일, 월, 요일(0=일요일, 7 도 일요일)
+CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+MAX_SEARCH_DAYS = 366 * 4  # 다음 실행 시각을 찾는 최대 범위 (2월 29일 등)
+MAX_WINDOW_STEPS = 64  # 창(window) 밖 시각을 건너뛰는 최대 횟수
+
+
+def parse_cron_field(text, low, high):
+    """cron 필드 하나('*', '*/n', 'a-b', 'a-b/n', 'a,b,c')를 값 집합으로 변환합니다."""
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            step = int(step_text)
+            if step <= 0:
+                raise ValueError(f"Invalid cron step: {text}")
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(value) for value in part.split('-', 1))
+        else:
+            start = int(part)
+            end = high if step != 1 else start
+        if not low <= start <= end <= high:
+            raise ValueError(f"Cron field {text} out of range {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+def parse_clock(text):
+    """'HH:MM' 을 자정부터의 분으로 변환합니다."""
+    hour, minute = (int(value) for value in str(text).split(':', 1))
+    if not (0 <= hour <= 23 and 0 <= minute <= 59):
+        raise ValueError(f"Invalid time of day: {text}")
+    return hour * 60 + minute
+
+
+def parse_light_off(value):
+    """
+    서버의 led_off_time 값을 자정부터의 분으로 변환합니다. 알 수 없으면 None.
+    'HH:MM' 문자열, 시(0~23), 또는 HHMM 정수(예: 2200) 를 받습니다.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        if isinstance(value, str) and ':' in value:
+            return parse_clock(value)
+        number = int(value)
+    except (TypeError, ValueError):
+        return None
+    if 0 <= number <= 23:
+        return number * 60
+    hour, minute = divmod(number, 100)
+    if 0 <= hour <= 23 and 0 <= minute <= 59:
+        return hour * 60 + minute
+    return None
+
+
+def parse_window(text):
+    """'HH:MM-HH:MM' 을 (시작 분, 끝 분) 으로 변환합니다. 끝이 시작보다 작으면 자정을 넘는 창."""
+    start, end = str(text).split('-', 1)
+    return parse_clock(start), parse_clock(end)
+
+
+def photoperiod_window(daylength, light_off):
+    """
+    LED 점등 구간을 (시작 분, 끝 분) 으로 반환합니다.
+    daylength 는 점등 시간(시), light_off 는 소등 시각(자정부터의 분). 알 수 없으면 None.
+    """
+    try:
+        hours = int(daylength)
+    except (TypeError, ValueError):
+        return None
+    if not 0 < hours < 24:
+        return None  # 0 은 미설정, 24 는 항상 점등
+    return (light_off - hours * 60) % 1440, light_off
+
+
+def minute_of_day(moment):
+    return moment.hour * 60 + moment.minute + moment.second / 60
+
+
+def in_window(moment, window):
+    start, end = window
+    minute = minute_of_day(moment)
+    if start <= end:
+        return start <= minute < end
+    return minute >= start or minute < end
+
+
+def next_window_start(moment, window):
+    """moment 이후(또는 같은 시각) 처음으로 창이 열리는 시각."""
+    start = moment.replace(hour=window[0] // 60, minute=window[0] % 60, second=0, microsecond=0)
+    return start if start >= moment else start + datetime.timedelta(days=1)
+
+
+### 촬영 스케줄 ###
+class CaptureSchedule:
+    """
+    방 하나의 촬영 스케줄. cron 식 또는 interval(초, 자정 기준 정렬) 중 하나를 사용하며,
+    window(시각 구간)가 있으면 그 안의 시각만 실행합니다.
+    photoperiod 가 참이면 window 는 LED 점등 구간이며, 그 시각에는 LED 를 강제로 켜지 않아도 됩니다.
+    """
+
+    def __init__(self, cron=None, interval=None, window=None, photoperiod=False):
+        if (cron is None) == (interval is None):
+            raise ValueError("Capture schedule needs exactly one of cron or interval")
+        self.cron = cron
+        self.interval = int(interval) if interval is not None else None
+        if self.interval is not None and self.interval <= 0:
+            raise ValueError(f"Invalid capture interval: {interval}")
+        self.window = window
+        self.photoperiod = photoperiod
+        if cron is not None:
+            fields = cron.split()
+            if len(fields) != 5:
+                raise ValueError(f"Cron expression needs 5 fields: {cron}")
+            self.minutes, self.hours, self.days, self.months, weekdays = (
+                parse_cron_field(text, low, high) for text, (low, high) in zip(fields, CRON_FIELDS))
+            self.weekdays = {day % 7 for day in weekdays}
+            # 일/요일이 둘 다 제한되면 둘 중 하나만 맞아도 실행 (cron 규칙)
+            self.day_or_weekday = fields[2] != '*' and fields[4] != '*'
+
+    def __eq__(self, other):
+        return isinstance(other, CaptureSchedule) and self.describe() == other.describe()
+
+    def describe(self):
+        rule = f"cron '{self.cron}'" if self.cron is not None else f"every {self.interval} s"
+        if self.window is not None:
+            start, end = self.window
+            rule += f" within {start // 60:02d}:{start % 60:02d}-{end // 60:02d}:{end % 60:02d}"
+            if self.photoperiod:
+                rule += " (photoperiod)"
+        return rule
+
+    def _day_matches(self, day):
+        if day.month not in self.months:
+            return False
+        day_ok = day.day in self.days
+        weekday_ok = (day.isoweekday() % 7) in self.weekdays
+        return day_ok or weekday_ok if self.day_or_weekday else day_ok and weekday_ok
+
+    def _next_cron(self, moment):
+        """moment 이후의 첫 cron 시각 (분 단위)."""
+        moment = moment.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        day = moment.replace(hour=0, minute=0)
+        for _ in range(MAX_SEARCH_DAYS):
+            if self._day_matches(day):
+                for hour in sorted(self.hours):
+                    for minute in sorted(self.minutes):
+                        candidate = day.replace(hour=hour, minute=minute)
+                        if candidate >= moment:
+                            return candidate
+            day += datetime.timedelta(days=1)
+        return None
+
+    def _next_interval(self, moment):
+        """moment 이후의 첫 interval 배수 시각 (자정 기준)."""
+        midnight = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+        elapsed = (moment - midnight).total_seconds()
+        candidate = midnight + datetime.timedelta(seconds=(elapsed // self.interval + 1) * self.interval)
+        next_midnight = midnight + datetime.timedelta(days=1)
+        return min(candidate, next_midnight)  # 하루 길이로 나누어떨어지지 않아도 매일 자정에 다시 정렬
+
+    def next_after(self, timestamp):
+        """timestamp(time.time()) 이후 다음 실행 시각을 반환합니다. 없으면 None."""
+        moment = datetime.datetime.fromtimestamp(timestamp)
+        next_slot = self._next_cron if self.cron is not None else self._next_interval
+        for _ in range(MAX_WINDOW_STEPS):
+            candidate = next_slot(moment)
+            if candidate is None:
+                return None
+            if self.window is None or in_window(candidate, self.window):
+                return candidate.timestamp()
+            # 창이 열리는 시각 직전부터 다시 찾음
+            moment = next_window_start(candidate, self.window) - datetime.timedelta(microseconds=1)
+        return None
+
+    def active(self, timestamp):
+        """timestamp 가 창 안인지 (창이 없으면 항상 참)."""
+        return self.window is None or in_window(datetime.datetime.fromtimestamp(timestamp), self.window)
+
+
+def schedule_from_config(config, daylength=None, light_off=None, default_interval=3600):
+    """
+    capture_schedule.json 의 room{n} 값을 CaptureSchedule 로 변환합니다.
+    - 문자열: cron 식 (예: "0 */2 * * *")
+    - dict: {"cron": ...} 또는 {"interval": 초}, 선택적으로 "window": "HH:MM-HH:MM",
+      "photoperiod": true/false (기본 true, window 가 없을 때 LED 점등 구간에 맞춤), "light_off": "HH:MM"
+    - True/1: default_interval 마다, 점등 구간에 맞춤
+    photoperiod 구간은 daylength(시)와 light_off(자정부터의 분)로 계산합니다.
+    """
+    if isinstance(config, str):
+        config = {"cron": config}
+    elif config is True or config == 1:
+        config = {"interval": default_interval}
+    if not isinstance(config, dict):
+        raise ValueError(f"Unsupported capture schedule: {config!r}")
+    window = None
+    photoperiod = False
+    if "window" in config:
+        window = parse_window(config["window"])
+    elif config.get("photoperiod", True):
+        off = parse_clock(config["light_off"]) if "light_off" in config else light_off
+        window = photoperiod_window(daylength, off) if off is not None else None
+        photoperiod = window is not None
+    return CaptureSchedule(cron=config.get("cron"), interval=config.get("interval"),
+                           window=window, photoperiod=photoperiod)
@@ -0,0 +1,93 @@
+import threading
+import time
+import logging
+
+from IMS_frame import calculate_checksum, START_CODE, SET_INFO_SEND
+from IMS_mapping import FIELD_STRUCT
+from IMS_recorder import TX
+
+logger = logging.getLogger(__name__)
+
+MAX_FIELDS_PER_FRAME = 0xFF  # Quantity 는 1바이트
+
+
+def build_frames(fields):
+    """(레지스터, 값) 목록을 Quantity 한도 안에서 가장 적은 수의 D1/10 프레임으로 묶습니다."""
+    frames = []
+    for start in range(0, len(fields), MAX_FIELDS_PER_FRAME):
+        chunk = fields[start:start + MAX_FIELDS_PER_FRAME]
+        frame = bytearray([START_CODE, SET_INFO_SEND, len(chunk)])
+        for register, value in chunk:
+            frame += FIELD_STRUCT.pack(register, value)
+        frame.append(calculate_checksum(frame))
+        frames.append(bytes(frame))
+    return frames
+
+
+### MCU 명령 송신 ###
+class CommandSender:
+    """
+    서버 설정을 MCU 로 보내는 송신기.
+    - 레지스터별로 마지막으로 전송한 값을 기억하여 바뀐 레지스터만 전송
+    - 여러 JSON 을 하나로 합쳐 한 번에 전송
+    - 같은 값은 resend_interval 동안만 생략하고, 그 뒤에는 다시 전송
+    MCU 는 D1/10 프레임에 응답(ack)하지 않고 송신 레지스터의 현재 값도 보고하지 않으므로,
+    "MCU 가 가진 값" 대신 마지막으로 보낸 값을 기준으로 합니다. MCU 가 그 사이 스스로 상태를 바꿨을 수
+    있으므로 생략 기간은 짧게(한 번의 일괄 전송에 겹친 중복 정도) 두고, MCU 재시작이 의심되면 invalidate().
+    recorder(IMS_recorder.LinkRecorder) 가 있으면 보낸 프레임을 TX 로 기록합니다.
+    """
+
+    def __init__(self, ser, resend_interval=5, recorder=None):
+        self.ser = ser
+        self.resend_interval = resend_interval
+        self.recorder = recorder
+        self.last_sent = {}  # 레지스터 -> (값, 전송 시각)
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        """기억한 값을 모두 지워 다음 전송 때 전체를 다시 보내게 합니다."""
+        with self.lock:
+            self.last_sent.clear()
+
+    def _changed_fields(self, send_table, json_data, now):
+        fields = []
+        for register, key in send_table:
+            if key not in json_data:
+                continue
+            try:
+                value = int(json_data[key])
+            except (TypeError, ValueError) as e:
+                logger.error(f"Error converting value {json_data[key]} for {key}: {e}")
+                continue
+            if not 0 <= value <= 0xFFFF:
+                logger.error(f"Value {value} for {key} does not fit in 2 bytes, skipping")
+                continue
+            previous = self.last_sent.get(register)
+            if previous and previous[0] == value and now - previous[1] < self.resend_interval:
+                continue
+            fields.append((register, value))
+        return fields
+
+    def send(self, send_table, json_documents):
+        """
+        JSON 문서 목록을 순서대로 합쳐(뒤의 값 우선) 바뀐 레지스터만 전송합니다.
+        send_table 은 compile_send_mapping_table 의 결과이며, 전송한 레지스터 수를 반환합니다.
+        """
+        merged = {}
+        for json_data in json_documents:
+            merged.update(json_data)
+        with self.lock:
+            now = time.monotonic()
+            fields = self._changed_fields(send_table, merged, now)
+            if not fields:
+                logger.info(f"No changed registers to send ({len(merged)} key(s) received).")
+                return 0
+            for frame in build_frames(fields):
+                self.ser.write(frame)
+                if self.recorder is not None:
+                    self.recorder.record(TX, frame)
+                logger.info(f"Sent data to MCU: {frame.hex()}")
+            for register, value in fields:
+                self.last_sent[register] = (value, now)
+        logger.info(f"Sent {len(fields)} changed register(s) out of {len(merged)} key(s).")
+        return len(fields)
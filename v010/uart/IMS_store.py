@@ -0,0 +1,139 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+### 파일 유틸리티 ###
+def atomic_write_json(file_path, data):
+    """임시 파일에 기록한 뒤 rename 으로 교체하여 JSON 파일을 원자적으로 저장합니다."""
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, 'w') as json_file:
+        json.dump(data, json_file, indent=4)
+        json_file.flush()
+        os.fsync(json_file.fileno())
+    os.replace(tmp_path, file_path)
+
+
+### 상태 저장소 ###
+class StateStore:
+    """
+    to_server JSON 문서들을 메모리에 보관하는 저장소.
+    - 프레임 단위로 값을 일괄 반영(apply)
+    - 변경된 파일만 원자적으로 기록, 파일마다 마지막 기록 후 기록 주기(file_intervals, 없으면 flush_interval)가
+      지났으면 바로 쓰고 아니면 주기가 찰 때까지 모아서 한 번에 기록
+    - 지연 기록은 apply 를 호출한 이벤트 루프의 타이머(call_later)로 처리하여
+      기록과 on_flush 가 모두 이벤트 루프 안에서 실행됨 (루프가 없으면 바로 기록)
+    """
+
+    def __init__(self, base_directory, flush_interval=0, file_intervals=None):
+        self.base_directory = base_directory
+        self.flush_interval = flush_interval  # 0 이면 apply 마다 즉시 기록
+        self.file_intervals = dict(file_intervals or {})  # 파일명 -> 기록 주기(초), 예: 알람은 짧게
+        self.documents = {}  # 파일명 -> dict
+        self.dirty = {}  # 파일명 -> 기록 예정 시각 (monotonic)
+        self.lock = threading.RLock()
+        self.last_written = {}  # 파일명 -> 마지막 기록 시각 (monotonic)
+        self.flush_handle = None  # 지연 기록 타이머 (asyncio.TimerHandle)
+        self.on_flush = None  # 모든 변경이 기록된 뒤 호출 (예: 저널 압축)
+
+    def _path(self, file_name):
+        return os.path.join(self.base_directory, file_name)
+
+    def _document(self, file_name):
+        """문서를 반환합니다. 처음 접근 시 디스크에서 한 번만 읽어옵니다."""
+        document = self.documents.get(file_name)
+        if document is None:
+            try:
+                with open(self._path(file_name), 'r') as json_file:
+                    document = json.load(json_file)
+            except (FileNotFoundError, json.JSONDecodeError) as e:
+                logger.warning(f"Starting {file_name} from empty document: {e}")
+                document = {}
+            self.documents[file_name] = document
+        return document
+
+    def get(self, file_name, key, default=None):
+        """메모리에 있는 값을 읽습니다."""
+        with self.lock:
+            return self._document(file_name).get(key, default)
+
+    def snapshot(self, file_name):
+        """문서의 복사본을 반환합니다."""
+        with self.lock:
+            return dict(self._document(file_name))
+
+    def apply(self, updates):
+        """(파일명, 키, 값) 목록을 한 번에 반영하고 기록 주기가 된 파일을 기록합니다. 바뀐 (파일명, 키) 목록을 반환합니다."""
+        changed = []
+        with self.lock:
+            now = time.monotonic()
+            for file_name, key, value in updates:
+                document = self._document(file_name)
+                if document.get(key) != value or key not in document:
+                    document[key] = value
+                    changed.append((file_name, key))
+                    if file_name not in self.dirty:
+                        interval = self._interval(file_name)
+                        self.dirty[file_name] = self.last_written.get(file_name, -interval) + interval
+            if not self.dirty:
+                return changed
+            if min(self.dirty.values()) <= now:
+                self.flush_due()
+            else:
+                self._schedule()
+        return changed
+
+    def _interval(self, file_name):
+        return self.file_intervals.get(file_name, self.flush_interval)
+
+    def _schedule(self):
+        """가장 이른 기록 예정 시각에 flush_due 가 실행되도록 타이머를 맞춥니다."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        delay = max(min(self.dirty.values()) - time.monotonic(), 0)
+        if self.flush_handle is not None:
+            if self.flush_handle.when() <= loop.time() + delay:
+                return
+            self.flush_handle.cancel()
+        self.flush_handle = loop.call_later(delay, self.flush_due)
+
+    def flush_due(self):
+        """기록 예정 시각이 지난 파일만 기록하고 남은 파일은 다시 예약합니다."""
+        with self.lock:
+            now = time.monotonic()
+            self.flush([file_name for file_name, due in self.dirty.items() if due <= now])
+            if self.dirty:
+                self._schedule()
+
+    def flush(self, file_names=None):
+        """변경된(dirty) 파일을 디스크에 기록합니다. file_names 가 없으면 전부 기록합니다."""
+        with self.lock:
+            if self.flush_handle is not None:
+                self.flush_handle.cancel()
+                self.flush_handle = None
+            for file_name in sorted(self.dirty if file_names is None else file_names):
+                file_path = self._path(file_name)
+                try:
+                    atomic_write_json(file_path, self.documents[file_name])
+                    logger.info(f"Data successfully saved to {file_path}")
+                except Exception as e:
+                    logger.error(f"Error saving data to {file_path}: {e}")
+                    # 다음 주기(최소 1초 뒤)에 다시 시도
+                    self.dirty[file_name] = time.monotonic() + max(self._interval(file_name), 1)
+                    continue
+                del self.dirty[file_name]
+                self.last_written[file_name] = time.monotonic()
+            if not self.dirty and self.on_flush is not None:
+                self.on_flush()
+
+    def close(self):
+        """남은 변경 사항을 기록합니다."""
+        self.flush()
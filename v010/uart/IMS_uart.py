@@ -1,11 +1,21 @@
 import serial
+import asyncio
 import json
 import os
-import threading
+import signal
 import time
-import subprocess
 import logging
-import queue
+
+from IMS_store import StateStore, atomic_write_json
+from IMS_frame import FrameDecoder, START_CODE, SET_INFO_RECEIVE
+from IMS_mapping import MappingTables, resolve_fields, iter_fields
+from IMS_watch import DirectoryWatcher
+from IMS_sender import CommandSender
+from IMS_journal import TelemetryJournal
+from IMS_history import SensorHistory, HISTORY_DIR
+from IMS_jobs import CaptureQueue, PRIORITY_REQUEST, PRIORITY_SCHEDULED
+from IMS_schedule import schedule_from_config, parse_clock, parse_light_off
+from IMS_recorder import LinkRecorder, RX
 
 # 로깅 설정
 logging.basicConfig(level=logging.DEBUG)
@@ -14,7 +24,7 @@ logger = logging.getLogger(__name__)
 # 전역 변수 및 설정
 SERIAL_PORT = '/dev/ttyS3'
 BAUD_RATE = 115200
-TIMEOUT = 1
+TIMEOUT = 1  # 미완성 프레임을 버리기 전 대기 시간(초)
 
 MAPPING_TABLE_FILE = '/usr/bin/ims/uart/mapping_table.json'
 SEND_MAPPING_TABLE_FILE = '/usr/bin/ims/uart/send_mapping_table.json'
@@ -26,9 +36,47 @@ LED_SET_JSON_PATH = os.path.join(BASE_DIRECTORY, 'set.json')
 ALARM_JSON_PATH = os.path.join(BASE_DIRECTORY, 'alarm.json')
 ACTUATOR_JSON_PATH = os.path.join(BASE_DIRECTORY, 'actuator.json')
 
-running = True
-request_in_progress = False  # 요청 촬영 상태 플래그
-task_queue = queue.Queue()  # 스케줄 작업 큐
+# 수신 프레임 저널 (None 이면 사용 안 함). 스냅샷 사이의 값은 저널이 보존
+JOURNAL_FILE = '/usr/bin/ims/uart/telemetry.journal'
+JOURNAL_FSYNC_POLICY = 'batch'  # 'always' / 'batch' / 'never'
+JOURNAL_COMMIT_INTERVAL = 1.0  # 그룹 커밋 최대 지연(초)
+
+# 1분/1시간 단위 이력을 남길 to_server 파일 (빈 튜플이면 사용 안 함)
+HISTORY_FILES = ('sensor1.json', 'sensor2.json')
+
+# to_server 파일(스냅샷) 기록 주기(초). 0 이면 수신 프레임마다 한 번씩 기록
+STATE_FLUSH_INTERVAL = 30 if JOURNAL_FILE else 0
+# 서버가 바로 봐야 하는 파일(알람, 액추에이터 상태)은 짧은 주기로 기록 (나머지 센서 파일은 STATE_FLUSH_INTERVAL)
+STATE_FILE_FLUSH_INTERVALS = {os.path.basename(ALARM_JSON_PATH): 1, os.path.basename(ACTUATOR_JSON_PATH): 1}
+# 같은 값을 MCU 로 다시 보내지 않고 생략하는 기간(초). MCU 는 ack 를 보내지 않으므로 짧게 유지
+COMMAND_RESEND_INTERVAL = 5
+# 수신이 이 시간(초) 이상 끊겼다가 다시 들어오면 MCU 재시작/재연결로 보고 송신 기록을 초기화
+MCU_SILENCE_RESET = 30
+# MCU 가 상태 프레임(actuator 값 포함)을 보내는 주기(초). MCU 펌웨어 설정과 같게 유지
+MCU_REPORT_INTERVAL = 2
+# LED 켜짐 보고를 기다리는 최대 시간(초): 명령 전달 후 상태 보고 LED_CONFIRM_REPORTS 번 분량
+LED_CONFIRM_REPORTS = 3
+LED_SETTLE_TIMEOUT = MCU_REPORT_INTERVAL * LED_CONFIRM_REPORTS
+
+CAM_SCRIPT = '/usr/bin/ims/cam/IMS_cam.py'
+CAM_SOCKET_PATH = '/tmp/ims_cam.sock'  # 상주 카메라 서비스 (IMS_cam.py --serve)
+SUPERVISOR_SOCKET_PATH = '/tmp/ims_supervisor.sock'  # main.py 감독 프로세스 (미리 import 된 작업 프로세스)
+
+# 방별 촬영 스케줄: {"room1": cron 식 또는 {...}, ..., "led_off_time": 서버 값}
+# 서버는 from_server/capture_schedule.json 으로 보내고(합친 뒤 삭제), 직접 수정해도 바로 반영
+CAPTURE_SCHEDULE_FILE = '/usr/bin/ims/uart/capture_schedule.json'
+ROOMS = (1, 2, 3)  # 촬영/스케줄 대상 방 번호
+SET_FILE_NAME = os.path.basename(LED_SET_JSON_PATH)
+SCHEDULE_SET_KEYS = ("mode_set_room", "daylength_set_room")  # 방별 스케줄에 쓰이는 set.json 키 (뒤에 방 번호)
+CAPTURE_INTERVAL = 3600  # 스케줄 촬영 기본 주기(초), room{n} 스케줄이 없고 mode_set_room{n} == 1 일 때
+LIGHT_OFF_TIME = '22:00'  # 서버의 led_off_time 을 아직 받지 못했을 때의 LED 소등 시각, 점등 구간 = 소등 - daylength_set_room{n}
+CAPTURE_STATS_FILE = '/usr/bin/ims/uart/capture_queue.json'  # 큐 깊이/대기 시간 (None 이면 기록 안 함)
+LINK_CAPTURE_FILE = None  # MCU 링크 원시 RX/TX 녹화 파일 (예: '/usr/bin/ims/uart/link.imsl', None 이면 녹화 안 함)
+LINK_CAPTURE_MAX_BYTES = 16 * 1024 * 1024  # 녹화 파일 최대 크기, 넘으면 <파일>.1 로 교체
+
+frame_decoder = FrameDecoder()  # UART 수신 프레임 디코더
+state_store = StateStore(BASE_DIRECTORY, flush_interval=STATE_FLUSH_INTERVAL,
+                         file_intervals=STATE_FILE_FLUSH_INTERVALS)  # to_server 상태 저장소
 
 ### 유틸리티 함수 ###
 def load_json_file(file_path):
@@ -42,19 +90,22 @@ def load_json_file(file_path):
 
 def save_data_to_file(file_path, key, value):
     """지정된 JSON 파일에 데이터를 저장합니다."""
+    save_values_to_file(file_path, {key: value})
+
+def save_values_to_file(file_path, values):
+    """지정된 JSON 파일에 여러 값을 한 번에 저장합니다."""
     try:
-        data = load_json_file(file_path)
-        data[key] = value
-        with open(file_path, 'w') as json_file:
-            json.dump(data, json_file, indent=4)
+        data = load_json_file(file_path) if os.path.exists(file_path) else {}
+        data.update(values)
+        atomic_write_json(file_path, data)
         logging.info(f"Data successfully saved to {file_path}")
     except Exception as e:
         logging.error(f"Error saving data to {file_path}: {e}")
 
-def initialize_serial(port, baud_rate, timeout):
-    """시리얼 포트를 초기화합니다."""
+def initialize_serial(port, baud_rate):
+    """시리얼 포트를 초기화합니다. 이벤트 루프에서 읽으므로 read 는 논블로킹(timeout=0)으로 엽니다."""
     try:
-        ser = serial.Serial(port, baud_rate, timeout=timeout)
+        ser = serial.Serial(port, baud_rate, timeout=0)
         if not ser.is_open:
             ser.open()
         logging.info(f"Serial port {port} initialized successfully.")
@@ -63,183 +114,518 @@ def initialize_serial(port, baud_rate, timeout):
         logging.error(f'Failed to open serial port: {e}')
         exit(1)
 
-def calculate_checksum(data):
-    """체크섬 계산 (XOR 연산)"""
-    checksum = 0
-    for byte in data:
-        checksum ^= byte
-    return checksum
-
-def convert_value_to_bytes(value, length=2):
-    """주어진 값을 바이트로 변환합니다."""
-    try:
-        return int(value).to_bytes(length, byteorder='big')
-    except ValueError as e:
-        logger.error(f"Error converting value {value} to bytes: {e}")
-        return None
-
-def load_mapping_table(mapping_file):
-    """매핑 테이블 JSON 파일을 로드합니다."""
-    try:
-        with open(mapping_file, 'r') as file:
-            return json.load(file)
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        logger.error(f"Failed to load mapping table {mapping_file}: {e}")
-        return {}
-
 ### UART 데이터 송수신 ###
 def process_received_data(data, mapping_table):
-    """수신된 데이터를 처리하고 매핑 테이블에 따라 필요한 작업을 수행합니다."""
+    """수신된 프레임을 컴파일된 매핑 테이블(compile_mapping_table)에 따라 처리하고 바뀐 (파일명, 키) 목록을 반환합니다."""
     try:
         startcode = data[0]
         set_info = data[1]
-        quantity = data[2]
 
-        if startcode != 0xD1 or set_info != 0x40:
+        if startcode != START_CODE or set_info != SET_INFO_RECEIVE:
             logger.warning(f"Invalid packet header: {startcode:02X}, {set_info:02X}")
-            return False
+            return []
 
-        extracted_data = []
-        for i in range(quantity):
-            id_addr = f"{data[3 + i * 4]:02X}{data[4 + i * 4]:02X}"
-            hex_value = f"{data[5 + i * 4]:02X}{data[6 + i * 4]:02X}"
-            dec_value = int(hex_value, 16)
-            extracted_data.append((id_addr, dec_value))
-
-        for id_addr, dec_value in extracted_data:
-            mapping = mapping_table.get(id_addr)
-            if mapping:
-                key = mapping.get("key")
-                file_name = mapping.get("file")
-                file_path = os.path.join(BASE_DIRECTORY, file_name)
-                save_data_to_file(file_path, key, dec_value)
-                logger.info(f"Processed ID_ADDR {id_addr} with value {dec_value}")
-            else:
-                logger.warning(f"No mapping found for ID_ADDR {id_addr}")
-        return True
+        # 컴파일된 매핑 테이블로 프레임 전체를 한 번에 변환하여 저장소에 반영
+        updates, unmapped = resolve_fields(data, mapping_table)
+        for register in unmapped:
+            logger.warning(f"No mapping found for ID_ADDR {register:04X}")
+        logger.info(f"Processed {len(updates)} field(s) from frame")
+        return state_store.apply(updates)
     except Exception as e:
         logger.error(f"Error processing received data: {e}")
-        return False
+        return []
 
-def receive_data_and_save(ser, mapping_table):
-    """시리얼 포트로부터 데이터를 수신하고 처리합니다."""
-    global running
-    while running:
-        try:
-            header_data = ser.read(3)
-            if header_data:
-                quantity = header_data[2]
-                data_length = 3 + quantity * 4 + 1
-                remaining_data = ser.read(data_length - 3)
-                received_data = header_data + remaining_data
-                process_received_data(received_data, mapping_table)
-        except Exception as e:
-            logger.error(f"Error receiving data: {e}")
-
-### LED 제어 및 촬영 ###
+### LED 제어 ###
 def set_led_state(room, state, setting_json_path):
     """LED 상태를 설정하고 JSON 파일을 업데이트합니다."""
     led_key = f"led_room{room}_a/m"
     control_key = f"led_control_room{room}"
-    save_data_to_file(setting_json_path, led_key, state)
-    save_data_to_file(setting_json_path, control_key, 100 if state else 0)
+    save_values_to_file(setting_json_path, {led_key: state, control_key: 100 if state else 0})
     logger.info(f"LED {'ON' if state else 'OFF'} for Room {room}")
 
-def capture_room_image(rooms):
-    """지정된 방의 이미지를 촬영합니다."""
-    subprocess.run(['python3', '/usr/bin/ims/cam/IMS_cam.py'] + [str(room) for room in rooms], check=True)
-    logger.info(f"Captured images for rooms: {', '.join(map(str, rooms))}")
-
-def control_led_for_capture(room):
-    """LED를 제어하고 지정된 방의 이미지를 촬영합니다."""
-    setting_json_path = os.path.join(SERVER_JSON_DIR, 'setting.json')
-    if not os.path.exists(setting_json_path):
-        with open(setting_json_path, 'w') as f:
-            json.dump({}, f)
-    set_led_state(room, 1, setting_json_path)
-    time.sleep(3)
-    capture_room_image([room])
-    time.sleep(15)
-    set_led_state(room, 0, setting_json_path)
-
-### 요청 처리 ###
-def check_for_requests(ser):
-    """request.json 파일을 처리하여 요청 촬영을 수행."""
-    global request_in_progress
-    request_file = os.path.join(SERVER_JSON_DIR, "request.json")
-    if os.path.exists(request_file):
-        request_in_progress = True  # 요청 촬영 시작
+### UART 서비스 ###
+class UartService:
+    """
+    하나의 asyncio 이벤트 루프에서 동작하는 UART 서비스.
+    - RX: 시리얼 fd 를 add_reader 로 감시, 프레임 타임아웃은 call_later 타이머
+    - TX: from_server 디렉토리 이벤트(inotify) 콜백에서 바로 전송
+    - 촬영: 요청/스케줄 촬영 모두 CaptureQueue 우선순위 큐에 넣고, 큐 태스크가 한 번에 하나씩 실행
+    """
+
+    def __init__(self, ser):
+        self.ser = ser
+        self.mapping_tables = MappingTables(MAPPING_TABLE_FILE, SEND_MAPPING_TABLE_FILE)
+        self.recorder = None
+        if LINK_CAPTURE_FILE:
+            self.recorder = LinkRecorder(LINK_CAPTURE_FILE, LINK_CAPTURE_MAX_BYTES)
+        self.command_sender = CommandSender(ser, resend_interval=COMMAND_RESEND_INTERVAL, recorder=self.recorder)
+        self.loop = None
+        self.stop_event = None
+        self.capture_queue = None
+        self.schedule_config = {}  # CAPTURE_SCHEDULE_FILE 내용
+        self.expire_handle = None
+        self.last_rx = None  # 마지막 수신 시각 (monotonic)
+        self.journal = None
+        if JOURNAL_FILE:
+            self.journal = TelemetryJournal(JOURNAL_FILE, JOURNAL_FSYNC_POLICY, JOURNAL_COMMIT_INTERVAL)
+        self.commit_handle = None
+        self.history = None
+        self.watchers = []
+        self.tasks = set()
+        self.actuator_waiters = []  # (방 번호 집합, 기대 값, future): 수신 프레임으로 상태가 맞춰지면 완료
+
+    ### RX ###
+    def on_serial_readable(self):
+        """시리얼 fd 에 데이터가 도착하면 이벤트 루프가 호출합니다."""
         try:
-            request_data = load_json_file(request_file)
-            if "camera_no" in request_data:
-                rooms = [int(r.strip()) for r in request_data["camera_no"].split(",") if r.strip().isdigit()]
-                for room in rooms:
-                    control_led_for_capture(room)  # 요청은 조건 무시하고 즉시 촬영
-            os.remove(request_file)
-            logger.info(f"Processed request.json")
+            received_data = self.ser.read(self.ser.in_waiting or 1)
+        except serial.SerialException as e:
+            logger.error(f"Error receiving data: {e}")
+            self.loop.remove_reader(self.ser.fileno())
+            self.stop_event.set()
+            return
+        if self.recorder is not None:
+            self.recorder.record(RX, received_data)
+        now = time.monotonic()
+        if self.last_rx is not None and now - self.last_rx >= MCU_SILENCE_RESET:
+            logger.warning(f"MCU link was silent for {now - self.last_rx:.0f}s, resending all settings on next change")
+            self.command_sender.invalidate()
+        self.last_rx = now
+        if self.expire_handle is not None:
+            self.expire_handle.cancel()
+            self.expire_handle = None
+        self.dispatch_frames(frame_decoder.feed(received_data))
+        # 미완성 프레임이 남아 있으면 TIMEOUT 후 정리
+        if frame_decoder.buffer:
+            self.expire_handle = self.loop.call_later(TIMEOUT, self.on_frame_timeout)
+
+    def on_frame_timeout(self):
+        self.expire_handle = None
+        self.dispatch_frames(frame_decoder.expire())
+
+    def dispatch_frames(self, frames):
+        # 매핑 테이블은 프레임마다 최신 것을 사용 (핫 리로드)
+        for frame in frames:
+            # 저장소 반영 후 저널에 추가: 스냅샷 압축과 겹쳐도 프레임이 빠지지 않음
+            changed = process_received_data(frame, self.mapping_tables.receive)
+            if any(file_name == SET_FILE_NAME and key.startswith(SCHEDULE_SET_KEYS) for file_name, key in changed):
+                self.setup_room_capture_schedule()  # set.json 의 모드/점등 시간이 바뀐 경우만 재예약
+            if self.actuator_waiters:
+                self.check_actuator_waiters()
+            if self.history is not None:
+                self.history.record(iter_fields(frame))
+            if self.journal is not None and not self.journal.append(frame) and self.commit_handle is None:
+                self.commit_handle = self.loop.call_later(self.journal.commit_interval, self.commit_journal)
+
+    def commit_journal(self):
+        self.commit_handle = None
+        try:
+            self.journal.commit()
+        except OSError as e:
+            logger.error(f"Failed to commit telemetry journal: {e}")
+
+    def replay_journal(self):
+        """이전 실행에서 스냅샷에 반영되지 못한 프레임을 저장소에 다시 적용합니다."""
+        records = self.journal.open()
+        for timestamp, frame in records:
+            process_received_data(frame, self.mapping_tables.receive)
+        state_store.on_flush = self.journal.compact
+        if records:
+            state_store.flush()
+
+    def update_history(self):
+        """HISTORY_FILES 에 저장되는 레지스터로 이력을 열고, 매핑이 바뀌어 레지스터가 달라졌으면 다시 엽니다."""
+        if not HISTORY_FILES:
+            return
+        registers = sorted(register for register, target in enumerate(self.mapping_tables.receive)
+                           if target is not None and target[0] in HISTORY_FILES)
+        if self.history is not None:
+            if self.history.registers == registers:
+                return
+            logger.info(f"History registers changed ({len(self.history.registers)} -> {len(registers)}), reopening")
+            self.history.close()
+        self.history = SensorHistory(HISTORY_DIR, registers)
+
+    def on_mapping_files_changed(self, names):
+        """DirectoryWatcher 콜백: 매핑 테이블을 교체하고 이력 레지스터도 새 테이블에 맞춥니다."""
+        if self.mapping_tables.on_files_changed(names):
+            self.update_history()
+
+    ### TX ###
+    def handle_server_files(self, file_names):
+        """
+        from_server 디렉토리 감시 콜백.
+        - request.json 은 촬영 작업 큐로 넘김 (촬영이 길어도 설정 전송이 막히지 않도록)
+        - capture_schedule.json 은 CAPTURE_SCHEDULE_FILE 에 합친 뒤 삭제
+        - 그 외 JSON 은 하나로 합쳐 바뀐 레지스터만 MCU 로 전송한 뒤 삭제 (led_off_time 은 스케줄 설정에도 기록)
+        """
+        pending = []  # (파일명, 경로, 변경 시각, 내용)
+        for file_name in file_names:
+            file_path = os.path.join(SERVER_JSON_DIR, file_name)
+            try:
+                written_at = os.path.getmtime(file_path)
+            except FileNotFoundError:
+                continue  # 이미 처리되어 삭제됨
+            if file_name == "request.json":
+                self.submit_request(file_path, written_at)
+                continue
+            if file_name == os.path.basename(CAPTURE_SCHEDULE_FILE):
+                self.update_schedule_config(load_json_file(file_path))
+                os.remove(file_path)
+                continue
+            logger.info(f"Processing server JSON file: {file_name}")
+            json_data = load_json_file(file_path)
+            if "led_off_time" in json_data:
+                self.update_schedule_config({"led_off_time": json_data["led_off_time"]})
+            pending.append((file_name, file_path, written_at, json_data))
+
+        if not pending:
+            return
+        try:
+            self.command_sender.send(self.mapping_tables.send, [json_data for _, _, _, json_data in pending])
+        except Exception as e:
+            logger.error(f"Error sending server JSON files to MCU: {e}")
+            return
+        for file_name, file_path, written_at, _ in pending:
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+            latency_ms = (time.time() - written_at) * 1000
+            logger.info(f"Server JSON file {file_name} processed and removed, {latency_ms:.1f} ms after it was written.")
+
+    ### 촬영 ###
+    async def request_camera_service(self, rooms):
+        """상주 카메라 서비스에 촬영을 요청합니다. 서비스가 없으면 OSError."""
+        reader, writer = await asyncio.open_unix_connection(CAM_SOCKET_PATH)
+        try:
+            writer.write(json.dumps({"rooms": [str(room) for room in rooms]}).encode() + b"\n")
+            await writer.drain()
+            response = json.loads(await reader.readline() or b'{}')
         finally:
-            request_in_progress = False  # 요청 촬영 완료
+            writer.close()
+        results = response.get("results", {})
+        return bool(results) and all(results.values())
 
-            # 요청 촬영 완료 후, 큐에서 보류된 작업 처리
-            while not task_queue.empty():
-                room = task_queue.get()
-                logger.info(f"Resuming scheduled capture for Room {room}")
-                check_conditions_and_capture(room)
+    async def capture_room_image(self, rooms):
+        """
+        지정된 방의 이미지를 촬영합니다. 상주 카메라 서비스가 없으면 감독 프로세스의 작업 프로세스에서,
+        그것도 없으면 새 인터프리터로 IMS_cam.py 를 실행합니다.
+        """
+        try:
+            ok = await self.request_camera_service(rooms)
+            logger.info(f"Captured images for rooms via camera service: {', '.join(map(str, rooms))} (ok={ok})")
+            return ok
+        except (OSError, ValueError) as e:
+            logger.warning(f"Camera service unavailable ({e}), running IMS_cam.py")
+        try:
+            returncode = await self.request_supervisor_task("cam", rooms)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Supervisor unavailable ({e}), launching IMS_cam.py")
+            returncode = await self.launch_cam_script(rooms)
+        if returncode != 0:
+            logger.error(f"IMS_cam.py exited with {returncode} for rooms: {', '.join(map(str, rooms))}")
+            return False
+        logger.info(f"Captured images for rooms: {', '.join(map(str, rooms))}")
+        return True
 
-### 스케줄 촬영 ###
-def check_conditions_and_capture(room):
-    """
-    스케줄 작업 시 조건 확인:
-    - 요청 촬영 중이면 작업을 큐에 보관.
-    - 요청 촬영 완료 후 순차적으로 처리.
-    """
-    global request_in_progress
-    if request_in_progress:
-        logger.info(f"Request in progress. Adding Room {room} to task queue.")
-        task_queue.put(room)  # 요청 중일 경우 큐에 작업 추가
-        return
-
-    # 조건 확인
-    alarm_data = load_json_file(ALARM_JSON_PATH)
-    if alarm_data.get("door_open_alarm") == 1:
-        logger.info(f"door_open_alarm is 1. Skipping scheduled capture for Room {room}.")
-        return
-
-    actuator_data = load_json_file(ACTUATOR_JSON_PATH)
-    led_key = f"led_room{room}"
-    if actuator_data.get(led_key) == 0:
-        logger.info(f"{led_key} is 0. Skipping scheduled capture for Room {room}.")
-        return
-
-    # 조건 충족 시 촬영 진행
-    control_led_for_capture(room)
-
-def setup_room_capture_schedule():
-    """set.json 파일을 확인하여 스케줄을 설정."""
-    set_data = load_json_file(LED_SET_JSON_PATH)
-    for room in range(1, 4):  # Room 1, 2, 3
-        mode_key = f"mode_set_room{room}"
-        if set_data.get(mode_key) == 1:
-            logger.info(f"Scheduling capture for Room {room} every hour.")
-            threading.Timer(3600, lambda: check_conditions_and_capture(room)).start()
+    async def request_supervisor_task(self, task, args):
+        """감독 프로세스에 작업 실행을 요청하고 종료 코드를 반환합니다. 감독 프로세스가 없으면 OSError."""
+        reader, writer = await asyncio.open_unix_connection(SUPERVISOR_SOCKET_PATH)
+        try:
+            writer.write(json.dumps({"task": task, "args": [str(arg) for arg in args]}).encode() + b"\n")
+            await writer.drain()
+            response = json.loads(await reader.readline() or b'{}')
+        finally:
+            writer.close()
+        if "returncode" not in response:
+            raise ValueError(response.get("error", "no response"))
+        return response["returncode"]
+
+    async def launch_cam_script(self, rooms):
+        process = await asyncio.create_subprocess_exec('python3', CAM_SCRIPT, *[str(room) for room in rooms])
+        try:
+            returncode = await process.wait()
+        except asyncio.CancelledError:
+            process.kill()
+            raise
+        return returncode
+
+    def led_states_reached(self, rooms, state):
+        actuator = state_store.snapshot(os.path.basename(ACTUATOR_JSON_PATH))
+        return all(bool(actuator.get(f"led_room{room}")) == bool(state) for room in rooms)
+
+    def check_actuator_waiters(self):
+        """수신 프레임이 반영된 뒤 LED 상태를 기다리는 작업을 깨웁니다."""
+        waiting = []
+        for rooms, state, future in self.actuator_waiters:
+            if future.done():
+                continue
+            if self.led_states_reached(rooms, state):
+                future.set_result(True)
+            else:
+                waiting.append((rooms, state, future))
+        self.actuator_waiters = waiting
+
+    async def wait_for_led_state(self, rooms, state, timeout):
+        """MCU 가 방들의 LED 상태를 state 로 보고할 때까지 기다립니다. 시간 초과 시 False."""
+        if self.led_states_reached(rooms, state):
+            return True
+        future = self.loop.create_future()
+        self.actuator_waiters.append((set(rooms), state, future))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.actuator_waiters = [waiter for waiter in self.actuator_waiters if waiter[2] is not future]
+
+    async def control_led_for_capture(self, rooms):
+        """
+        LED를 제어하고 지정된 방들의 이미지를 촬영합니다.
+        여러 방은 LED 를 함께 켜고 한 번의 요청으로 촬영하여 대기 시간이 방마다 반복되지 않게 합니다.
+        고정 대기 대신 MCU 가 LED 켜짐을 보고할 때까지(최대 LED_SETTLE_TIMEOUT) 기다리고,
+        이미지가 저장되면 바로 LED 를 끕니다.
+        LED 켜짐이 확인되지 않은 방은 어두운 이미지가 올라가지 않도록 촬영하지 않고 실패로 처리합니다.
+        """
+        setting_json_path = os.path.join(SERVER_JSON_DIR, 'setting.json')
+        for room in rooms:
+            set_led_state(room, 1, setting_json_path)
+        started = time.monotonic()
+        try:
+            if await self.wait_for_led_state(rooms, 1, LED_SETTLE_TIMEOUT):
+                logger.info(f"LED on confirmed for rooms {rooms} after {(time.monotonic() - started) * 1000:.0f} ms")
+                confirmed = list(rooms)
+            else:
+                confirmed = [room for room in rooms if self.led_states_reached([room], 1)]
+                skipped = [room for room in rooms if room not in confirmed]
+                logger.error(f"No LED on feedback for rooms {skipped} within {LED_SETTLE_TIMEOUT} s, "
+                             f"skipping their capture")
+            ok = len(confirmed) == len(rooms)
+            if confirmed:
+                ok = await self.capture_room_image(confirmed) and ok
+        finally:
+            for room in rooms:
+                set_led_state(room, 0, setting_json_path)
+        logger.info(f"LED held for {time.monotonic() - started:.1f} s for rooms {rooms}")
+        return ok
+
+    ### 촬영 작업 ###
+    def submit_request(self, file_path, written_at):
+        """request.json 을 읽고 삭제한 뒤 요청 촬영 작업으로 넣습니다 (조건 무시, 스케줄 촬영보다 우선)."""
+        request_data = load_json_file(file_path)
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        if "camera_no" not in request_data:
+            logger.info("request.json has no camera_no, nothing to capture")
+            return
+        rooms = [int(r.strip()) for r in str(request_data["camera_no"]).split(",") if r.strip().isdigit()]
+        invalid = [room for room in rooms if room not in ROOMS]
+        if invalid:
+            logger.error(f"Ignoring unknown room number(s) {invalid} in request.json")
+            rooms = [room for room in rooms if room in ROOMS]
+        if rooms:
+            self.capture_queue.submit(rooms, PRIORITY_REQUEST, enqueued_at=written_at)
+        logger.info(f"Queued request.json for rooms {rooms}, {(time.time() - written_at) * 1000:.1f} ms after it was written.")
+
+    def scheduled_capture_allowed(self, room):
+        """
+        스케줄 작업 시 조건 확인 (저장소의 최신 값 사용):
+        - door_open_alarm 이 1 이거나 LED 가 꺼져 있으면 건너뜀.
+        """
+        if state_store.get(os.path.basename(ALARM_JSON_PATH), "door_open_alarm") == 1:
+            logger.info(f"door_open_alarm is 1. Skipping scheduled capture for Room {room}.")
+            return False
+
+        led_key = f"led_room{room}"
+        if state_store.get(os.path.basename(ACTUATOR_JSON_PATH), led_key) == 0:
+            logger.info(f"{led_key} is 0. Skipping scheduled capture for Room {room}.")
+            return False
+        return True
+
+    async def run_capture_job(self, rooms, priority):
+        """
+        CaptureQueue 가 호출: 스케줄 촬영은 조건을 확인한 방만 촬영합니다.
+        점등 구간에 맞춘 스케줄이고 LED 가 이미 켜져 있으면 LED 를 강제로 켜지 않고 바로 촬영합니다.
+        """
+        if priority == PRIORITY_SCHEDULED:
+            rooms = [room for room in rooms if self.scheduled_capture_allowed(room)]
+            if not rooms:
+                return None
+            now = time.time()
+            lit = [room for room in rooms if self.led_on_by_photoperiod(room, now)]
+            rooms = [room for room in rooms if room not in lit]
+            ok = True
+            if lit:
+                logger.info(f"Rooms {lit} are lit by photoperiod, capturing without LED override")
+                ok = await self.capture_room_image(lit)
+            if rooms:
+                ok = await self.control_led_for_capture(rooms) and ok
+            return ok
+        return await self.control_led_for_capture(rooms)
+
+    def led_on_by_photoperiod(self, room, now):
+        """점등 구간 스케줄이고 지금이 점등 구간이며 MCU 가 LED 를 켜짐으로 보고했는지."""
+        schedule = self.capture_queue.schedule_for(room)
+        if schedule is None or not schedule.photoperiod or not schedule.active(now):
+            return False
+        return bool(state_store.get(os.path.basename(ACTUATOR_JSON_PATH), f"led_room{room}"))
+
+    def export_capture_stats(self, stats):
+        if CAPTURE_STATS_FILE:
+            atomic_write_json(CAPTURE_STATS_FILE, stats)
+
+    def spawn(self, coro):
+        """태스크를 만들고 종료 시 목록에서 제거합니다."""
+        task = self.loop.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    ### 촬영 스케줄 설정 ###
+    def load_schedule_config(self):
+        if not os.path.exists(CAPTURE_SCHEDULE_FILE):
+            self.schedule_config = {}
+            return
+        config = load_json_file(CAPTURE_SCHEDULE_FILE)
+        if not isinstance(config, dict):
+            logger.error(f"{CAPTURE_SCHEDULE_FILE} must contain an object, ignoring it")
+            config = {}
+        self.schedule_config = config
+
+    def update_schedule_config(self, values):
+        """값을 CAPTURE_SCHEDULE_FILE 에 합쳐 저장하고 스케줄에 반영합니다. 값이 null 이면 키를 지웁니다."""
+        if not isinstance(values, dict):
+            logger.error(f"Ignoring capture schedule update that is not an object: {values!r}")
+            return
+        self.load_schedule_config()
+        config = dict(self.schedule_config)
+        for key, value in values.items():
+            if value is None:
+                config.pop(key, None)
+            else:
+                config[key] = value
+        if config == self.schedule_config:
+            return
+        try:
+            atomic_write_json(CAPTURE_SCHEDULE_FILE, config)
+        except OSError as e:
+            logger.error(f"Failed to save {CAPTURE_SCHEDULE_FILE}: {e}")
+        self.schedule_config = config
+        self.setup_room_capture_schedule()
+
+    def on_schedule_file_changed(self, names):
+        """DirectoryWatcher 콜백: 스케줄 설정 파일을 직접 수정한 경우."""
+        self.load_schedule_config()
+        self.setup_room_capture_schedule()
+
+    def light_off_minutes(self):
+        """서버가 보낸 led_off_time (없거나 알 수 없으면 LIGHT_OFF_TIME) 을 자정부터의 분으로 반환합니다."""
+        value = self.schedule_config.get("led_off_time")
+        minutes = parse_light_off(value)
+        if minutes is None:
+            if value is not None:
+                logger.warning(f"Unrecognised led_off_time {value!r}, using {LIGHT_OFF_TIME}")
+            return parse_clock(LIGHT_OFF_TIME)
+        return minutes
+
+    def room_capture_schedule(self, set_data, room):
+        """
+        방의 촬영 스케줄을 만듭니다.
+        - CAPTURE_SCHEDULE_FILE 의 room{n}: cron 식 또는 {"interval"/"cron", "window", "photoperiod", "light_off"}
+        - 없으면 set.json 의 mode_set_room{n} == 1 일 때 CAPTURE_INTERVAL 마다
+        점등 구간은 daylength_set_room{n}(시)과 led_off_time 으로 계산합니다.
+        """
+        config = self.schedule_config.get(f"room{room}")
+        if config is None:
+            if set_data.get(f"mode_set_room{room}") != 1:
+                return None
+            config = {"interval": CAPTURE_INTERVAL}
+        try:
+            return schedule_from_config(config, set_data.get(f"daylength_set_room{room}"),
+                                        self.light_off_minutes(), CAPTURE_INTERVAL)
+        except ValueError as e:
+            logger.error(f"Invalid capture schedule for Room {room}: {e}")
+            return None
+
+    def setup_room_capture_schedule(self):
+        """
+        스케줄 설정과 set.json 을 확인하여 방별 스케줄을 설정. 바뀐 방만 다시 예약합니다.
+        시작할 때, 스케줄 설정이 바뀔 때, 수신 프레임이 SCHEDULE_SET_KEYS 값을 바꿀 때만 호출합니다.
+        """
+        set_data = state_store.snapshot(SET_FILE_NAME)
+        for room in ROOMS:
+            schedule = self.room_capture_schedule(set_data, room)
+            if schedule == self.capture_queue.schedule_for(room):
+                continue
+            if schedule is None:
+                logger.info(f"Removing capture schedule for Room {room}.")
+                self.capture_queue.unschedule(room)
+            elif self.capture_queue.schedule(room, schedule):
+                logger.info(f"Scheduling capture for Room {room}: {schedule.describe()}.")
+
+    ### 실행 ###
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        self.capture_queue = CaptureQueue(self.run_capture_job, self.export_capture_stats)
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(signum, self.stop_event.set)
+
+        self.mapping_tables.reload()
+        self.update_history()
+        if self.journal is not None:
+            self.replay_journal()
+        # 매핑 파일이 바뀌면 재시작 없이 테이블 교체
+        self.watchers.append(DirectoryWatcher(
+            os.path.dirname(MAPPING_TABLE_FILE), self.on_mapping_files_changed,
+            names=[os.path.basename(MAPPING_TABLE_FILE), os.path.basename(SEND_MAPPING_TABLE_FILE)],
+            initial_scan=False).attach(self.loop))
+        # 스케줄 설정 파일을 직접 수정하면 바로 반영
+        self.load_schedule_config()
+        self.watchers.append(DirectoryWatcher(
+            os.path.dirname(CAPTURE_SCHEDULE_FILE), self.on_schedule_file_changed,
+            names=[os.path.basename(CAPTURE_SCHEDULE_FILE)], initial_scan=False).attach(self.loop))
+        # from_server 디렉토리를 이벤트 기반으로 감시 (inotify, 불가 시 폴링)
+        self.watchers.append(DirectoryWatcher(
+            SERVER_JSON_DIR, self.handle_server_files, suffix='.json').attach(self.loop))
+        self.loop.add_reader(self.ser.fileno(), self.on_serial_readable)
+        self.spawn(self.capture_queue.run())
+        self.setup_room_capture_schedule()  # 스케줄 설정
+        try:
+            await self.stop_event.wait()
+            logger.info("Stopping UART service...")
+        finally:
+            self.loop.remove_reader(self.ser.fileno())
+            for watcher in self.watchers:
+                watcher.detach()
+            tasks = list(self.tasks)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            logger.info(f"UART frame counters: {frame_decoder.counters}")
+            logger.info(f"Capture queue stats: {self.capture_queue.stats()}")
+            if self.history is not None:
+                self.history.close()
+            if self.journal is not None:
+                if self.commit_handle is not None:
+                    self.commit_handle.cancel()
+                state_store.flush()  # 스냅샷 기록 후 저널 압축
+                self.journal.close()
+                logger.info(f"Telemetry journal stats: {self.journal.stats}")
+            if self.recorder is not None:
+                self.recorder.close()
+                logger.info(f"Link capture stats: {self.recorder.counters}")
 
 ### 메인 ###
 def main():
-    ser = initialize_serial(SERIAL_PORT, BAUD_RATE, TIMEOUT)
-    mapping_table = load_mapping_table(MAPPING_TABLE_FILE)
-    send_mapping_table = load_mapping_table(SEND_MAPPING_TABLE_FILE)
-    uart_thread = threading.Thread(target=receive_data_and_save, args=(ser, mapping_table))
-    uart_thread.start()
+    ser = initialize_serial(SERIAL_PORT, BAUD_RATE)
     try:
-        setup_room_capture_schedule()  # 스케줄 설정
-        while True:
-            check_for_requests(ser)
-            time.sleep(2)
-    except KeyboardInterrupt:
-        global running
-        running = False
-        uart_thread.join(timeout=5)
+        asyncio.run(UartService(ser).run())
     finally:
+        state_store.close()
         if ser.is_open:
             ser.close()
 
@@ -0,0 +1,313 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import termios
+import threading
+import time
+import tty
+import logging
+
+import serial
+
+import IMS_uart
+from IMS_frame import FrameDecoder, START_CODE, SET_INFO_RECEIVE, calculate_checksum
+from IMS_mapping import FIELD_STRUCT, iter_fields, load_mapping_file
+from IMS_jobs import CaptureQueue
+from IMS_store import StateStore
+from IMS_recorder import is_capture_file, read_capture, RX
+from IMS_history import SensorHistory
+
+logger = logging.getLogger(__name__)
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BITS_PER_BYTE = 10  # 8N1: 시작 비트 + 8 데이터 비트 + 정지 비트
+
+
+### 프레임 만들기 ###
+def build_frame(fields):
+    """(레지스터, 값) 목록으로 MCU → 메인보드 D1/40 프레임을 만듭니다."""
+    frame = bytearray([START_CODE, SET_INFO_RECEIVE, len(fields)])
+    for register, value in fields:
+        frame += FIELD_STRUCT.pack(register, value)
+    frame.append(calculate_checksum(frame))
+    return bytes(frame)
+
+
+def synthetic_frames(mapping_table, count, fields_per_frame=13, files=('sensor1.json', 'sensor2.json'), seed=0):
+    """
+    매핑 테이블의 센서 레지스터로 임의 값 프레임을 만듭니다.
+    첫 필드는 순번 레지스터(값 = 프레임 순번)로, 지연 시간 측정에 씁니다.
+    """
+    rng = random.Random(seed)
+    registers = sorted(int(id_addr, 16) for id_addr, mapping in mapping_table.items() if mapping.get("file") in files)
+    if not registers:
+        raise ValueError(f"No registers mapped to {files}")
+    sequence_register, others = registers[0], registers[1:]
+    frames = []
+    for seq in range(count):
+        fields = [(sequence_register, seq & 0xFFFF)]
+        fields += [(register, rng.randrange(0x10000)) for register in rng.sample(others, min(fields_per_frame - 1, len(others)))]
+        frames.append(build_frame(fields))
+    return frames, sequence_register
+
+
+def recorded_frames(path):
+    """
+    한 줄에 한 프레임씩 16진수로 적힌 파일(uart_test.py / 로그의 형식)을 읽습니다.
+    IMS_recorder 녹화 파일이면 RX 바이트를 디코딩한 프레임을 사용합니다.
+    """
+    if is_capture_file(path):
+        decoder = FrameDecoder()
+        frames = []
+        for _, direction, data in read_capture(path):
+            if direction == RX:
+                frames += decoder.feed(data)
+        return frames
+    frames = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip().replace("0x", "")
+            if line and not line.startswith('#'):
+                frames.append(bytes.fromhex(line))
+    return frames
+
+
+def inject_noise(data, rng, bit_error_rate=0.0, garbage_rate=0.0):
+    """비트 오류(비트당 확률)와 프레임 사이의 쓰레기 바이트(프레임당 확률)를 넣습니다."""
+    if bit_error_rate > 0:
+        data = bytearray(data)
+        flips = rng.binomialvariate(len(data) * 8, bit_error_rate) if hasattr(rng, "binomialvariate") else \
+            sum(1 for _ in range(len(data) * 8) if rng.random() < bit_error_rate)
+        for _ in range(flips):
+            bit = rng.randrange(len(data) * 8)
+            data[bit // 8] ^= 1 << (bit % 8)
+        data = bytes(data)
+    if garbage_rate > 0 and rng.random() < garbage_rate:
+        data = bytes(rng.randrange(256) for _ in range(rng.randint(1, 8))) + data
+    return data
+
+
+### 가상 MCU ###
+class VirtualMCU(threading.Thread):
+    """
+    pty 의 master 쪽에 프레임을 씁니다. 속도는 baud 의 바이트 시간에 맞춰 조절하고(pty 는 baud 를 흉내내지 않음),
+    rate(프레임/초)가 0 이면 line-rate 로 보냅니다. 프레임별 송신 시각을 sent_at 에 기록합니다.
+    """
+
+    def __init__(self, fd, frames, baud=115200, rate=0.0, bit_error_rate=0.0, garbage_rate=0.0, seed=0):
+        super().__init__(name="virtual-mcu", daemon=True)
+        self.fd = fd
+        self.frames = frames
+        self.byte_time = BITS_PER_BYTE / baud
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.bit_error_rate = bit_error_rate
+        self.garbage_rate = garbage_rate
+        self.rng = random.Random(seed)
+        self.sent_at = {}  # 프레임 번호(= 순번 레지스터 값, 65536 개 미만) -> 마지막 바이트를 쓴 시각 (perf_counter)
+        self.sent_bytes = 0
+        self.finished_at = None
+
+    def run(self):
+        next_start = time.perf_counter()
+        for index, frame in enumerate(self.frames):
+            data = inject_noise(frame, self.rng, self.bit_error_rate, self.garbage_rate)
+            # 직렬 회선에서 마지막 바이트가 도착하는 시각까지 기다린 뒤 씀
+            finish = next_start + len(data) * self.byte_time
+            delay = finish - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            view = memoryview(data)
+            while view:
+                written = os.write(self.fd, view)
+                view = view[written:]
+            self.sent_at[index] = time.perf_counter()
+            self.sent_bytes += len(data)
+            next_start = max(finish, next_start + self.interval)
+        self.finished_at = time.perf_counter()
+
+
+def open_pty_pair():
+    """raw 모드 pty 쌍을 만들고 (master fd, slave 경로)를 반환합니다."""
+    master, slave = os.openpty()
+    tty.setraw(master, termios.TCSANOW)
+    tty.setraw(slave, termios.TCSANOW)
+    path = os.ttyname(slave)
+    return master, slave, path
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+### 벤치마크 ###
+def benchmark_parser(frames, repeat=5, chunk=64, bit_error_rate=0.0, garbage_rate=0.0, seed=0):
+    """I/O 없이 FrameDecoder.feed 만 측정합니다 (chunk 바이트씩 나누어 넣음)."""
+    rng = random.Random(seed)
+    stream = b"".join(inject_noise(frame, rng, bit_error_rate, garbage_rate) for frame in frames)
+    best = None
+    for _ in range(repeat):
+        decoder = FrameDecoder()
+        started = time.perf_counter()
+        decoded = 0
+        for offset in range(0, len(stream), chunk):
+            decoded += len(decoder.feed(stream[offset:offset + chunk]))
+        elapsed = time.perf_counter() - started
+        if best is None or elapsed < best[0]:
+            best = (elapsed, decoded, dict(decoder.counters))
+    elapsed, decoded, counters = best
+    return {
+        "frames_in": len(frames),
+        "frames_out": decoded,
+        "bytes": len(stream),
+        "frames_per_s": round(decoded / elapsed, 1),
+        "mb_per_s": round(len(stream) / elapsed / 1e6, 2),
+        "us_per_frame": round(elapsed / max(decoded, 1) * 1e6, 2),
+        "counters": counters,
+    }
+
+
+async def benchmark_receive(frames, sequence_register, baud=115200, rate=0.0, bit_error_rate=0.0, garbage_rate=0.0,
+                            journal=False, settle=1.0, seed=0):
+    """
+    pty 가상 MCU → IMS_uart.UartService 수신 경로(디코딩, 매핑, 저장소 기록)의
+    프레임→디스크 지연 시간과 프레임당 CPU 시간을 측정합니다.
+    """
+    with tempfile.TemporaryDirectory(prefix="ims_uart_bench_") as workdir:
+        IMS_uart.BASE_DIRECTORY = workdir
+        IMS_uart.JOURNAL_FILE = os.path.join(workdir, "telemetry.journal") if journal else None
+        IMS_uart.state_store = StateStore(workdir, flush_interval=0)  # 프레임마다 기록 (지연 시간 = 디스크까지)
+        IMS_uart.frame_decoder = FrameDecoder()
+
+        master, slave, path = open_pty_pair()
+        ser = serial.Serial(path, baud, timeout=0)
+        service = IMS_uart.UartService(ser)
+        service.loop = asyncio.get_running_loop()
+        service.stop_event = asyncio.Event()
+
+        async def skip_capture(rooms, priority):
+            return None
+
+        service.capture_queue = CaptureQueue(skip_capture)
+        service.mapping_tables.reload()
+        registers = [register for register, target in enumerate(service.mapping_tables.receive)
+                     if target is not None and target[0] in IMS_uart.HISTORY_FILES]
+        service.history = SensorHistory(os.path.join(workdir, "history"), registers)
+        if service.journal is not None:
+            service.replay_journal()
+
+        latencies = []
+        received = set()
+        dispatch = service.dispatch_frames
+        mcu = VirtualMCU(master, frames, baud, rate, bit_error_rate, garbage_rate, seed)
+
+        def timed_dispatch(decoded):
+            dispatch(decoded)  # 저장소 기록까지 끝난 뒤 시각을 잼
+            now = time.perf_counter()
+            for frame in decoded:
+                register, seq = next(iter_fields(frame), (None, None))
+                if register == sequence_register and seq in mcu.sent_at and seq not in received:
+                    received.add(seq)
+                    latencies.append(now - mcu.sent_at[seq])
+
+        service.dispatch_frames = timed_dispatch
+        service.loop.add_reader(ser.fileno(), service.on_serial_readable)
+        cpu_started = time.thread_time()
+        started = time.perf_counter()
+        mcu.start()
+        while mcu.is_alive():
+            await asyncio.sleep(0.05)
+        # 마지막 프레임이 처리될 시간을 줌
+        deadline = time.perf_counter() + settle
+        while time.perf_counter() < deadline and len(received) < len(frames):
+            await asyncio.sleep(0.01)
+        elapsed = mcu.finished_at - started
+        cpu = time.thread_time() - cpu_started
+        service.loop.remove_reader(ser.fileno())
+        if service.journal is not None:
+            service.journal.close()
+        history_samples = service.history.samples()
+        service.history.close()
+        ser.close()
+        os.close(master)
+        os.close(slave)
+
+        frames_ok = IMS_uart.frame_decoder.counters["frames"]
+        line_capacity = baud / BITS_PER_BYTE / (sum(len(frame) for frame in frames) / len(frames))
+        return {
+            "frames_sent": len(frames),
+            "frames_decoded": frames_ok,
+            "frames_lost": len(frames) - len(received),
+            "send_seconds": round(elapsed, 3),
+            "offered_frames_per_s": round(len(frames) / elapsed, 1),
+            "line_rate_frames_per_s": round(line_capacity, 1),
+            "latency_ms": {
+                "p50": round(percentile(latencies, 0.5) * 1000, 3) if latencies else None,
+                "p99": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+                "max": round(max(latencies) * 1000, 3) if latencies else None,
+            },
+            "cpu_us_per_frame": round(cpu / max(frames_ok, 1) * 1e6, 1),
+            "decoder": IMS_uart.frame_decoder.counters,
+            "history_samples": history_samples,  # 해상도별 반영 값 수 (모두 같아야 함)
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IMS_uart 수신 경로 벤치마크 (pty 가상 MCU, 하드웨어 불필요)")
+    parser.add_argument("--frames", type=int, default=2000, help="합성 프레임 수")
+    parser.add_argument("--fields", type=int, default=13, help="합성 프레임당 필드 수")
+    parser.add_argument("--replay", help="16진수 프레임 파일 (한 줄에 한 프레임) 또는 IMS_recorder 녹화 파일")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--rate", type=float, default=0.0, help="프레임/초 (0 이면 line-rate)")
+    parser.add_argument("--ber", type=float, default=0.0, help="비트 오류율 (비트당 확률)")
+    parser.add_argument("--garbage", type=float, default=0.0, help="프레임 앞에 쓰레기 바이트를 넣을 확률")
+    parser.add_argument("--journal", action="store_true", help="수신 저널 사용")
+    parser.add_argument("--parser-only", action="store_true", help="FrameDecoder 만 측정")
+    parser.add_argument("--log-level", default="WARNING", help="측정 중 로그 수준 (기기 기본값은 DEBUG)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="결과를 JSON 으로 출력")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(args.log_level.upper())
+    mapping_file = os.path.join(SCRIPT_DIR, "mapping_table.json")
+    IMS_uart.MAPPING_TABLE_FILE = mapping_file
+    IMS_uart.SEND_MAPPING_TABLE_FILE = os.path.join(SCRIPT_DIR, "send_mapping_table.json")
+    frames, sequence_register = synthetic_frames(load_mapping_file(mapping_file), args.frames, args.fields, seed=args.seed)
+    if args.replay:
+        # 녹화 프레임 앞에 순번 레지스터를 붙여 지연 시간을 잴 수 있게 함
+        recorded = recorded_frames(args.replay)
+        frames = []
+        for seq in range(args.frames):
+            body = recorded[seq % len(recorded)]
+            fields = [(sequence_register, seq & 0xFFFF)] + list(iter_fields(body))
+            frames.append(build_frame(fields[:0xFF]))
+
+    results = {"parser": benchmark_parser(frames, bit_error_rate=args.ber, garbage_rate=args.garbage, seed=args.seed)}
+    if not args.parser_only:
+        results["receive"] = asyncio.run(benchmark_receive(
+            frames, sequence_register, args.baud, args.rate, args.ber, args.garbage, args.journal, seed=args.seed))
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+    p = results["parser"]
+    print(f"parser : {p['frames_per_s']:>10} frames/s  {p['mb_per_s']} MB/s  {p['us_per_frame']} us/frame  "
+          f"({p['frames_out']}/{p['frames_in']} frames, {p['counters']})")
+    if "receive" in results:
+        r = results["receive"]
+        print(f"receive: {r['offered_frames_per_s']} frames/s offered (line-rate {r['line_rate_frames_per_s']}), "
+              f"{r['frames_lost']} lost, latency p50 {r['latency_ms']['p50']} ms / p99 {r['latency_ms']['p99']} ms / "
+              f"max {r['latency_ms']['max']} ms, {r['cpu_us_per_frame']} us CPU per frame")
+        print(f"         decoder {r['decoder']}")
+    if "receive" in results and len(set(results["receive"]["history_samples"].values())) > 1:
+        print(f"history: resolutions received different sample counts {results['receive']['history_samples']}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
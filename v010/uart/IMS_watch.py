@@ -0,0 +1,161 @@
+import ctypes
+import ctypes.util
+import os
+import struct
+import logging
+
+logger = logging.getLogger(__name__)
+
+# inotify 상수 (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_STRUCT = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+def _load_inotify():
+    """libc 의 inotify 함수를 불러옵니다. 사용할 수 없으면 None 을 반환합니다."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError) as e:
+        logger.warning(f"inotify is not available, falling back to polling: {e}")
+        return None
+
+
+### 디렉토리 감시 ###
+class DirectoryWatcher:
+    """
+    디렉토리에 새로 닫히거나(rename 포함) 바뀐 파일을 감지하여 callback(파일명 목록)을 호출합니다.
+    - inotify(IN_CLOSE_WRITE | IN_MOVED_TO) 사용, 불가 시 mtime 폴링으로 대체
+    - settle 시간 동안 이어지는 이벤트는 한 번의 호출로 묶음
+    - attach(loop) 로 asyncio 이벤트 루프 안에서 감시 (스레드 없음), detach() 로 정리
+    """
+
+    def __init__(self, directory, callback, names=None, suffix=None,
+                 settle=0.05, poll_interval=2, use_inotify=True, initial_scan=True):
+        self.directory = directory
+        self.callback = callback
+        self.names = set(names) if names else None  # 특정 파일만 감시할 때
+        self.suffix = suffix  # 예: '.json'
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.initial_scan = initial_scan  # 시작 시 이미 있던 파일도 전달할지 여부
+        self.loop = None
+        self.fd = -1
+        self.pending = set()
+        self.handle = None
+        self.previous = {}  # 폴링 모드: 파일명 -> (mtime, size)
+
+    def _wanted(self, name):
+        if name.endswith('.tmp'):
+            return False
+        if self.names is not None and name not in self.names:
+            return False
+        return self.suffix is None or name.endswith(self.suffix)
+
+    def _dispatch(self, names):
+        try:
+            self.callback(sorted(names))
+        except Exception as e:
+            logger.error(f"Error handling changes in {self.directory}: {e}")
+
+    def _open_inotify(self):
+        """inotify fd 를 열어 디렉토리를 등록합니다. 실패하면 -1."""
+        libc = _load_inotify() if self.use_inotify else None
+        if libc is None:
+            return -1
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd >= 0 and libc.inotify_add_watch(fd, os.fsencode(self.directory),
+                                               IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            logger.warning(f"inotify_add_watch failed for {self.directory} "
+                           f"(errno {ctypes.get_errno()}), falling back to polling")
+            os.close(fd)
+            fd = -1
+        return fd
+
+    def _read_events(self, fd, names):
+        """inotify fd 에서 이벤트를 읽어 names 에 추가합니다. 큐 넘침이면 True."""
+        overflow = False
+        try:
+            buf = os.read(fd, 4096)
+        except BlockingIOError:
+            return False
+        offset = 0
+        while offset < len(buf):
+            wd, mask, cookie, length = EVENT_STRUCT.unpack_from(buf, offset)
+            offset += EVENT_STRUCT.size
+            name = buf[offset:offset + length].rstrip(b'\0').decode(errors='replace')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+            elif self._wanted(name):
+                names.add(name)
+        return overflow
+
+    def _scan(self):
+        """감시 대상 파일의 (mtime, size) 를 반환합니다."""
+        state = {}
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.is_file() and self._wanted(entry.name):
+                        st = entry.stat()
+                        state[entry.name] = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            pass
+        return state
+
+    ### 이벤트 루프 ###
+    def attach(self, loop):
+        """이벤트 루프의 fd 감시(add_reader)와 타이머로 동작합니다."""
+        self.loop = loop
+        self.fd = self._open_inotify()
+        if self.fd >= 0:
+            logger.info(f"Watching {self.directory} with inotify")
+            loop.add_reader(self.fd, self._on_readable)
+            if self.initial_scan:
+                self.pending |= set(self._scan())
+                if self.pending:
+                    self.handle = loop.call_soon(self._flush_pending)
+        else:
+            logger.info(f"Watching {self.directory} by polling every {self.poll_interval}s")
+            self.previous = {} if self.initial_scan else self._scan()
+            self.handle = loop.call_soon(self._poll_once)
+        return self
+
+    def detach(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        if self.fd >= 0:
+            self.loop.remove_reader(self.fd)
+            os.close(self.fd)
+            self.fd = -1
+
+    def _on_readable(self):
+        if self._read_events(self.fd, self.pending):
+            logger.warning(f"inotify queue overflow on {self.directory}, rescanning")
+            self.pending |= set(self._scan())
+        # 첫 이벤트 후 settle 시간 동안 모아서 한 번에 처리
+        if self.pending and self.handle is None:
+            self.handle = self.loop.call_later(self.settle, self._flush_pending)
+
+    def _flush_pending(self):
+        self.handle = None
+        names, self.pending = self.pending, set()
+        if names:
+            self._dispatch(names)
+
+    def _poll_once(self):
+        current = self._scan()
+        changed = {name for name, sig in current.items() if self.previous.get(name) != sig}
+        self.previous = current
+        if changed:
+            self._dispatch(changed)
+        self.handle = self.loop.call_later(self.poll_interval, self._poll_once)